@@ -3,13 +3,16 @@ import pandas as pd
 import pydeck as pdk
 from datetime import date
 
-from src.geocode import geocode_address
-from src.search import search_without_api
+from src.coordinator import CrawlCoordinator
 from src.utils import (
-    haversine_km, normalize_text, deduplicate_listings, apply_filters,
-    compute_cost_fields, format_currency, to_float
+    normalize_text, deduplicate_listings, format_currency, to_float
 )
-from src.exporting import export_excel_bytes, export_pdf_bytes
+from src.exporting import export_excel_bytes, export_pdf_bytes, to_required_frame
+from src.mapping import MAP_MODES, MAP_TOOLTIP, aggregate_for_map, build_layers, rent_label
+from src.market_stats import MarketStats
+from src.districts import assign_districts, zone_names
+from src.index import ListingIndex
+from src.query import run_query
 
 st.set_page_config(
     page_title="Madrid Office Rent Market",
@@ -18,6 +21,21 @@ st.set_page_config(
 
 st.title("Madrid Office Rent Market (alquiler oficinas)")
 
+@st.cache_resource
+def get_market_stats() -> MarketStats:
+    # process-wide: updated incrementally by every crawl, shared by all sessions
+    return MarketStats()
+
+@st.cache_resource
+def get_crawl_coordinator() -> CrawlCoordinator:
+    # process-wide: concurrent identical searches from several sessions share one crawl/geocode
+    return CrawlCoordinator(on_listing=get_market_stats().upsert)
+
+@st.cache_resource(max_entries=4)
+def get_listing_index(crawl_id: int, _listings: list[dict]) -> ListingIndex:
+    # one index per crawl result, shared by every session and search that reuses that crawl
+    return ListingIndex(_listings)
+
 with st.expander("Cómo funciona", expanded=False):
     st.markdown("""
 - Introduce una **dirección en Madrid** y pulsa **Buscar**.
@@ -36,9 +54,14 @@ radius_km = colB.number_input("Radio (km)", min_value=0.5, max_value=25.0, value
 top_n = st.sidebar.number_input("N resultados", min_value=5, max_value=50, value=20, step=1, disabled=not use_top_n)
 
 st.sidebar.subheader("Filtros (opcionales)")
-st.sidebar.caption("Nota: si pones distrito/zona (p.ej. AZCA) y la fuente no lo menciona en texto, puede filtrar todo. Prueba sin filtros primero.")
+zones = zone_names()
+if not zones:
+    st.sidebar.caption("Nota: si pones distrito/zona (p.ej. AZCA) y la fuente no lo menciona en texto, puede filtrar todo. Prueba sin filtros primero.")
 min_area = st.sidebar.number_input("Superficie mínima (m²)", min_value=0, value=0, step=50)
-district_filter = st.sidebar.text_input("Distrito/zona (contiene)", value="")
+if zones:
+    district_filter = st.sidebar.selectbox("Distrito/barrio", [""] + zones, format_func=lambda z: z or "(todos)")
+else:
+    district_filter = st.sidebar.text_input("Distrito/zona (contiene)", value="")
 rent_min = st.sidebar.number_input("Renta mín €/m²/mes", min_value=0.0, value=0.0, step=1.0)
 rent_max = st.sidebar.number_input("Renta máx €/m²/mes", min_value=0.0, value=200.0, step=1.0)
 availability_now = st.sidebar.checkbox("Disponibilidad inmediata", value=False)
@@ -54,12 +77,22 @@ ibi_rate_annual = st.sidebar.number_input("IBI estimado (€/m²/año)", min_val
 st.sidebar.subheader("Búsqueda web")
 st.sidebar.caption("Para mejores resultados, configura un API key en Streamlit Secrets.")
 max_pages = st.sidebar.slider("Páginas de resultados a analizar", min_value=1, max_value=5, value=2)
+search_deadline = st.sidebar.number_input("Tiempo máximo de búsqueda (s)", min_value=10, max_value=600, value=90, step=10,
+                                          help="Al agotarse se muestran las ofertas encontradas hasta ese momento.")
+
+st.sidebar.subheader("Mapa")
+map_mode = st.sidebar.selectbox("Modo de mapa", MAP_MODES, index=0, help="Clusters/hexágonos/heatmap se agregan en el servidor; 'Puntos' solo con pocas ofertas.")
+# st.pydeck_chart does not send the viewport back to Python, so the zoom used to size the
+# server-side clusters is chosen here (and is also the map's initial zoom)
+map_zoom = st.sidebar.slider("Zoom del mapa", min_value=10, max_value=16, value=13,
+                             help="Zoom inicial del mapa y tamaño de los clusters/celdas. Hacer zoom en el propio mapa no reagrupa.")
 
 search_btn = st.sidebar.button("Buscar", type="primary")
 
 if search_btn:
     with st.status("Geocodificando dirección…", expanded=False) as status:
-        geo = geocode_address(address)
+        coordinator = get_crawl_coordinator()
+        geo = coordinator.geocode(address)
         if not geo["ok"]:
             st.error(f"No se pudo geocodificar: {geo['error']}\n\nSugerencia: en Streamlit Cloud añade en Secrets `GEOCODER_USER_AGENT` con un contacto real (email/empresa).")
             st.stop()
@@ -91,88 +124,86 @@ if search_btn:
     st.pydeck_chart(deck, use_container_width=True)
 
     with st.status("Buscando ofertas en la web…", expanded=True) as status:
-        listings, diag = search_without_api(max_candidates=400)
+        market = get_market_stats()
+        listings, diag = coordinator.crawl(max_candidates=400, deadline_s=search_deadline)
         status.update(label=f"Extracción completada (modo sin APIs): {len(listings)} candidatos", state="complete")
 
+    shared = diag.get("coordinator", {})
+    if shared.get("result") == "coalesced":
+        st.caption("Resultados compartidos: otra sesión ya estaba rastreando las mismas fuentes.")
+    elif shared.get("result") == "reused":
+        st.caption(f"Resultados de un rastreo reciente (hace {shared['age_s']:.0f} s), compartidos entre sesiones.")
+
+    budget = diag.get("budget", {})
+    if budget.get("partial"):
+        skipped = budget.get("skipped", {})
+        parts = []
+        if skipped.get("urls_not_attempted"):
+            parts.append(f"{skipped['urls_not_attempted']} URLs sin descargar")
+        if skipped.get("sources_not_discovered"):
+            parts.append("fuentes sin explorar: " + ", ".join(skipped["sources_not_discovered"]))
+        st.warning(f"Resultados parciales: se alcanzó el tiempo máximo ({budget.get('elapsed_s', 0):.0f} s)"
+                   + (f"; {'; '.join(parts)}." if parts else "."))
+
     with st.expander("Diagnóstico de búsqueda", expanded=False):
         st.json(diag)
-
+        st.json(coordinator.report())
+
+
+    st.subheader("Mercado en la zona")
+    zone = market.around(lat, lon, rings=1)
+    if zone["rent_count"]:
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Mediana €/m²/mes", format_currency(zone["rent_eur_m2_month_median"]))
+        m2.metric("P25 – P75 €/m²/mes", f"{zone['rent_eur_m2_month_p25']:.2f} – {zone['rent_eur_m2_month_p75']:.2f}")
+        m3.metric("Superficie mediana (m²)", f"{zone['area_m2_median']:.0f}" if zone["area_m2_median"] else "N/D")
+        m4.metric("Disponibilidad inmediata", f"{zone['availability_now_share']:.0%}" if zone["availability_now_share"] is not None else "N/D")
+        st.caption(f"{zone['count']} ofertas con coordenadas en ~3×3 km alrededor de la dirección ({zone['rent_count']} con renta).")
+    else:
+        st.caption("Sin ofertas con coordenadas y renta alrededor de la dirección para estadísticas de mercado.")
 
     if not listings:
         st.warning("No se encontraron ofertas con extracción automática. Prueba a aumentar páginas o configurar el API key del buscador.")
         st.stop()
 
-    # Add distance + compute
-    for it in listings:
-        it["dist_km"] = haversine_km(lat, lon, it.get("lat", lat), it.get("lon", lon)) if it.get("lat") is not None else None
-
     # Deduplicate
     listings = deduplicate_listings(listings)
-
-    # Sort by distance if present, else by relevance score
-    listings = sorted(listings, key=lambda x: (x.get("dist_km") is None, x.get("dist_km", 1e9), -x.get("score", 0)))
-
-    # Apply radius/top_n
-    if use_top_n:
-        listings = listings[: int(top_n)]
-    else:
-        listings = [x for x in listings if x.get("dist_km") is not None and x["dist_km"] <= float(radius_km)]
-        listings = listings[:20]  # cap for UI
-
-    if not listings:
-        st.warning("No hay resultados tras aplicar radio/selección.")
-        st.stop()
-
-    # Apply optional filters
-    listings = apply_filters(
-        listings,
-        min_area=min_area,
-        district_contains=district_filter,
-        rent_min=rent_min,
-        rent_max=rent_max,
-        availability_now=availability_now
+    all_listings = listings
+
+    # District/barrio columns from coordinates (point-in-polygon); refresh market stats with them
+    assign_districts(listings)
+    market.upsert_many(listings)
+
+    # Filters are pushed into the index walk before top-N/radius truncation; costs only for the final rows
+    listings, plan = run_query(
+        get_listing_index(diag["crawl_id"], listings),
+        lat,
+        lon,
+        top_n=int(top_n),
+        radius_km=None if use_top_n else float(radius_km),
+        radius_limit=20,  # cap for UI
+        filters={
+            "min_area": min_area,
+            "district_contains": district_filter,
+            "rent_min": rent_min,
+            "rent_max": rent_max,
+            "availability_now": availability_now,
+            "zone_exact": bool(zones),  # selectbox names are exact district/barrio names
+        },
+        costs={
+            "treat_nd_as_zero": treat_nd_as_zero,
+            "enable_estimations": enable_estimations,
+            "community_rate": community_rate,
+            "ibi_rate_annual": ibi_rate_annual,
+        },
     )
 
     if not listings:
-        st.warning("No hay resultados tras aplicar filtros.")
+        st.warning("No hay resultados tras aplicar radio/selección y filtros.")
         st.stop()
 
-    # Compute costs and totals
-    for it in listings:
-        compute_cost_fields(
-            it,
-            treat_nd_as_zero=treat_nd_as_zero,
-            enable_estimations=enable_estimations,
-            community_rate=community_rate,
-            ibi_rate_annual=ibi_rate_annual
-        )
-
-    df = pd.DataFrame(listings)
-
     # Build required columns (keep extra columns hidden)
-    required_cols = [
-        "building_name",
-        "location",
-        "dist_km",
-        "area_m2",
-        "available_from",
-        "rent_eur_m2_month",
-        "rent_total_eur_month",
-        "community_eur_month",
-        "ibi_eur_month",
-        "total_1_rent_plus_community",
-        "total_2_rent_plus_ibi",
-        "total_3_community_plus_ibi",
-        "total_final",
-        "source_url",
-        "source_domain",
-        "consulted_on",
-        "notes",
-    ]
-    for c in required_cols:
-        if c not in df.columns:
-            df[c] = None
-    df = df[required_cols]
+    df = to_required_frame(listings)
 
     st.subheader("Resultados")
     st.caption("N/D se mantiene por defecto en los totales si Comunidad/IBI no están publicados. Activa 'Tratar N/D como 0' si quieres sumar con 0.")
@@ -199,31 +230,35 @@ if search_btn:
     if len(df) < 20:
         st.info(f"Se muestran {len(df)} resultados (menos de 20 disponibles con extracción automática).")
 
-    # Listings map
+    # Listings map: results on top of the whole crawl, aggregated server-side
     st.subheader("Mapa de ofertas")
-    pts = []
-    for _, row in df.iterrows():
-        if pd.notna(row.get("source_url")):
-            # listing lat/lon not in df; pull from original data if present
-            pass
-    # show approximate points if we have lat/lon in original listings
-    map_points = []
-    for it in listings:
-        if it.get("lat") is not None and it.get("lon") is not None:
-            map_points.append({"name": it.get("building_name","Oferta"), "lat": it["lat"], "lon": it["lon"], "dist": it.get("dist_km")})
-    if map_points:
-        mp = pd.DataFrame(map_points)
-        layers = [
-            pdk.Layer("ScatterplotLayer", data=input_point, get_position="[lon, lat]", get_radius=90, pickable=True),
-            pdk.Layer("ScatterplotLayer", data=mp, get_position="[lon, lat]", get_radius=60, pickable=True),
+    cols, map_info = aggregate_for_map(all_listings, map_mode, zoom=map_zoom)
+    if map_info["points"]:
+        result_points = pd.DataFrame(
+            [{"lat": it["lat"], "lon": it["lon"], "n": 1, "r": it.get("rent_eur_m2_month"),
+              "rt": rent_label(it.get("rent_eur_m2_month"))}
+             for it in listings if it.get("lat") is not None and it.get("lon") is not None],
+            columns=["lat", "lon", "n", "r", "rt"],
+        )
+        layers = build_layers(cols, map_info) + [
+            pdk.Layer("ScatterplotLayer", data=result_points, get_position="[lon, lat]", get_radius=40,
+                      get_fill_color=[30, 90, 220, 220], pickable=True),
+            pdk.Layer("ScatterplotLayer", data=input_point, get_position="[lon, lat]", get_radius=90,
+                      get_fill_color=[220, 30, 30, 230], pickable=False),
         ]
         deck2 = pdk.Deck(
             map_style=None,
-            initial_view_state=pdk.ViewState(latitude=lat, longitude=lon, zoom=13),
+            initial_view_state=pdk.ViewState(latitude=lat, longitude=lon, zoom=map_zoom),
             layers=layers,
-            tooltip={"text": "{name}\nDist: {dist} km"}
+            tooltip=MAP_TOOLTIP
         )
         st.pydeck_chart(deck2, use_container_width=True)
+        st.caption(
+            f"Modo {map_info['mode']}: {map_info['points']} ofertas con coordenadas en {map_info['bins']} celdas"
+            + (f" de ~{map_info['cell_m']} m" if map_info["cell_m"] else "")
+            + f"; datos del mapa {map_info['payload_bytes'] / 1024:.1f} KB."
+            + (" Límite de tamaño alcanzado." if map_info["capped"] else "")
+        )
     else:
         st.caption("No se pudieron inferir coordenadas de las ofertas (se muestran solo en tabla).")
 
@@ -0,0 +1,121 @@
+"""
+Local load test for src/service.py.
+
+    python -m bench.load_service --listings 5000 --clients 32 --requests 4000
+
+Starts the service in-process over a synthetic snapshot (no network, no geocoding:
+queries use lat/lon) and drives it with keep-alive clients. Prints latency
+percentiles and throughput per endpoint.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from src.service import ServiceState, serve
+from src.snapshot import save_snapshot
+
+MADRID_BBOX = (40.36, 40.50, -3.78, -3.60)
+
+def synthetic_listings(n: int, seed: int = 7) -> list[dict]:
+    rnd = random.Random(seed)
+    lat0, lat1, lon0, lon1 = MADRID_BBOX
+    out = []
+    for i in range(n):
+        area = rnd.randint(80, 3000)
+        out.append({
+            "building_name": f"Edificio {i}",
+            "location": f"Calle {i}, Madrid",
+            "lat": rnd.uniform(lat0, lat1),
+            "lon": rnd.uniform(lon0, lon1),
+            "area_m2": float(area),
+            "available_from": rnd.choice(["Inmediato", "N/D", "01/2027"]),
+            "rent_eur_m2_month": round(rnd.uniform(12, 38), 2),
+            "community_eur_month": rnd.choice([None, area * 3.0]),
+            "ibi_eur_month": None,
+            "source_url": f"https://example.invalid/anuncio/{i}",
+            "source_domain": "example.invalid",
+            "consulted_on": "2026-01-01",
+            "score": 2.0,
+            "notes": "",
+        })
+    return out
+
+async def _client(host, port, paths, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for path in paths:
+            t0 = time.perf_counter()
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.decode("latin-1").split("\r\n"):
+                if line.lower().startswith("content-length:"):
+                    length = int(line.split(":", 1)[1])
+            await reader.readexactly(length)
+            if not head.startswith(b"HTTP/1.1 200"):
+                raise RuntimeError(head.split(b"\r\n", 1)[0].decode())
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+    finally:
+        writer.close()
+
+async def run_load(host, port, make_path, clients, total):
+    per_client = max(total // clients, 1)
+    latencies: list[float] = []
+    t0 = time.perf_counter()
+    await asyncio.gather(*[
+        _client(host, port, [make_path() for _ in range(per_client)], latencies) for _ in range(clients)
+    ])
+    elapsed = time.perf_counter() - t0
+    lat = sorted(latencies)
+    pct = lambda p: lat[min(int(p / 100 * len(lat)), len(lat) - 1)]
+    return {
+        "requests": len(lat),
+        "rps": len(lat) / elapsed,
+        "p50_ms": statistics.median(lat),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+    }
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--listings", type=int, default=5000)
+    ap.add_argument("--clients", type=int, default=32)
+    ap.add_argument("--requests", type=int, default=4000)
+    ap.add_argument("--port", type=int, default=8599)
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp()
+    snap = os.path.join(tmp, "bench.json.gz")
+    save_snapshot(snap, synthetic_listings(args.listings))
+    state = ServiceState(snapshot=snap, geocode_cache=None)
+    state.refresh()
+
+    loop = asyncio.new_event_loop()
+    ready = asyncio.Event()
+    threading.Thread(target=lambda: loop.run_until_complete(serve(state, "127.0.0.1", args.port, ready)), daemon=True).start()
+    while not ready.is_set():
+        time.sleep(0.01)
+
+    rnd = random.Random(1)
+    lat0, lat1, lon0, lon1 = MADRID_BBOX
+    point = lambda: f"lat={rnd.uniform(lat0, lat1):.5f}&lon={rnd.uniform(lon0, lon1):.5f}"
+    scenarios = {
+        "/health": lambda: "/health",
+        "/nearest top_n=20": lambda: f"/nearest?{point()}&top_n=20",
+        "/nearest radius_km=1": lambda: f"/nearest?{point()}&radius_km=1&top_n=50",
+        "/export csv top_n=20": lambda: f"/export?{point()}&top_n=20&format=csv",
+    }
+    print(f"listings={args.listings} clients={args.clients} requests/scenario={args.requests}")
+    for name, make in scenarios.items():
+        r = asyncio.run(run_load("127.0.0.1", args.port, make, args.clients, args.requests))
+        print(f"{name:24s} {r['requests']:6d} req  {r['rps']:8.0f} req/s  "
+              f"p50 {r['p50_ms']:6.2f} ms  p95 {r['p95_ms']:6.2f} ms  p99 {r['p99_ms']:6.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark for src/market_stats.py: upsert and lookup cost as the corpus grows.
+
+    python -m bench.market_stats --sizes 1000 10000 100000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from bench.load_service import synthetic_listings, MADRID_BBOX
+from src.market_stats import MarketStats
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    ap.add_argument("--lookups", type=int, default=20_000)
+    args = ap.parse_args(argv)
+
+    rnd = random.Random(3)
+    lat0, lat1, lon0, lon1 = MADRID_BBOX
+    print(f"{'corpus':>8s} {'insert us/op':>13s} {'re-upsert us/op':>16s} {'at() us/op':>11s} {'around() us/op':>15s}")
+    for n in args.sizes:
+        listings = synthetic_listings(n)
+        stats = MarketStats()
+        t0 = time.perf_counter()
+        stats.upsert_many(listings)
+        insert_us = (time.perf_counter() - t0) / n * 1e6
+
+        # re-crawl: same URLs with a changed rent (remove old + add new contributions)
+        changed = []
+        for it in rnd.sample(listings, min(n, 10_000)):
+            it = dict(it)
+            it["rent_eur_m2_month"] = round(rnd.uniform(12, 38), 2)
+            changed.append(it)
+        t0 = time.perf_counter()
+        stats.upsert_many(changed)
+        update_us = (time.perf_counter() - t0) / len(changed) * 1e6
+
+        points = [(rnd.uniform(lat0, lat1), rnd.uniform(lon0, lon1)) for _ in range(args.lookups)]
+        t0 = time.perf_counter()
+        for lat, lon in points:
+            stats.at(lat, lon)
+        at_us = (time.perf_counter() - t0) / len(points) * 1e6
+        t0 = time.perf_counter()
+        for lat, lon in points[:2000]:
+            stats.around(lat, lon)
+        around_us = (time.perf_counter() - t0) / 2000 * 1e6
+
+        # accuracy check of the sketch against the exact median
+        exact = statistics.median(stats.rows[k]["rent"] for k in stats.rows if stats.rows[k]["rent"] is not None)
+        approx = stats.total.summary()["rent_eur_m2_month_median"]
+        print(f"{n:8d} {insert_us:13.2f} {update_us:16.2f} {at_us:11.2f} {around_us:15.2f}"
+              f"   median exact {exact:.2f} / sketch {approx:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Local stand-in for the listing sources, to time the crawl without the network.
+
+    python -m bench.standin_server --listings 60 --latency-ms 40
+
+Starts one HTTP server per source on 127.0.0.1 (different ports, so each is its own host
+for sitemap discovery and politeness). Two sources expose listing links on their seed page;
+the other two answer the seed with 403 and are found through a sitemap index, like blocked
+sources in production. Every response is delayed by --latency-ms.
+
+The benchmark points direct_sources.DEFAULT_SOURCES at the stand-ins and runs
+search_without_api twice: two-phase (discovery, then download) and pipelined.
+"""
+import argparse
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src import direct_sources
+from src.parse_cache import ParseCache
+from src.search import search_without_api
+from src.transport import use_transport
+
+# path prefix of listing links per source, chosen to pass direct_sources.SOURCE_PATTERNS
+LISTING_PREFIX = {
+    "LoopNet": "/loopnet.es/anuncio/",
+    "JLL": "/es/oficinas-alquiler/",
+    "CBRE": "/cbre.es/oficinas-alquiler/",
+    "Savills": "/savills.es/oficinas-alquiler/",
+}
+BLOCKED_SEED = {"CBRE", "Savills"}
+SITEMAP_CHUNK = 20
+
+def _listing_html(name: str, i: int) -> str:
+    return (
+        f"<html><head><title>{name} {i}</title></head><body>"
+        f"<h1>Edificio {name} {i}</h1><address>Calle de Prueba {i}, 28001 Madrid</address>"
+        f"<p>Oficina en alquiler. Superficie {300 + 10 * i} m². Renta {18 + i % 15} €/m²/mes. "
+        f"Disponibilidad inmediata.</p></body></html>"
+    )
+
+def _handler(name: str, listings: int, latency_s: float, counters: dict, statuses: dict):
+    prefix = LISTING_PREFIX[name]
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code: int, body: str, ctype: str = "text/html; charset=utf-8"):
+            data = body.encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            time.sleep(latency_s)
+            counters[name] = counters.get(name, 0) + 1
+            base = f"http://{self.headers.get('Host')}"
+            path = self.path.split("?")[0]
+            if path == "/seed":
+                if name in BLOCKED_SEED:
+                    return self._send(403, "<html><body>Forbidden</body></html>")
+                links = "".join(f'<a href="{prefix}{i}">{i}</a>' for i in range(listings))
+                return self._send(200, f"<html><body>{links}</body></html>")
+            if path == "/sitemap.xml" and name in BLOCKED_SEED:
+                parts = (listings + SITEMAP_CHUNK - 1) // SITEMAP_CHUNK
+                locs = "".join(f"<sitemap><loc>{base}/sitemap-{p}.xml</loc></sitemap>" for p in range(parts))
+                return self._send(200, f'<?xml version="1.0"?><sitemapindex>{locs}</sitemapindex>', "application/xml")
+            if path.startswith("/sitemap-") and name in BLOCKED_SEED:
+                p = int(path[len("/sitemap-"):-len(".xml")])
+                ids = range(p * SITEMAP_CHUNK, min((p + 1) * SITEMAP_CHUNK, listings))
+                locs = "".join(f"<url><loc>{base}{prefix}{i}</loc></url>" for i in ids)
+                return self._send(200, f'<?xml version="1.0"?><urlset>{locs}</urlset>', "application/xml")
+            if path.startswith(prefix):
+                i = int(path[len(prefix):])
+                if i in statuses:
+                    return self._send(statuses[i], "<html><body>Error</body></html>")
+                return self._send(200, _listing_html(name, i))
+            return self._send(404, "<html><body>Not found</body></html>")
+
+    return Handler
+
+@contextmanager
+def standin_sources(listings: int = 60, latency_ms: float = 40.0, statuses: dict | None = None,
+                    source_latency_ms: dict | None = None):
+    """
+    Run the stand-in servers and point direct_sources.DEFAULT_SOURCES at them.
+    statuses (optional) maps a listing number to the HTTP status its page answers with on
+    every source, e.g. {3: 404, 4: 403}; the dict is read per request, so it can change mid-test.
+    source_latency_ms (optional) overrides latency_ms per source, e.g. {"Savills": 3000}.
+    Yields the per-source request counters.
+    """
+    statuses = {} if statuses is None else statuses
+    counters: dict[str, int] = {}
+    servers = []
+    sources = {}
+    for name in LISTING_PREFIX:
+        latency_s = (source_latency_ms or {}).get(name, latency_ms) / 1000.0
+        srv = ThreadingHTTPServer(("127.0.0.1", 0), _handler(name, listings, latency_s, counters, statuses))
+        srv.daemon_threads = True
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        servers.append(srv)
+        sources[name] = f"http://127.0.0.1:{srv.server_address[1]}/seed"
+    saved = direct_sources.DEFAULT_SOURCES
+    direct_sources.DEFAULT_SOURCES = sources
+    try:
+        with use_transport("live"):
+            yield counters
+    finally:
+        direct_sources.DEFAULT_SOURCES = saved
+        for srv in servers:
+            srv.shutdown()
+            srv.server_close()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Crawl timing against local stand-in sources")
+    ap.add_argument("--listings", type=int, default=60, help="listings per source")
+    ap.add_argument("--latency-ms", type=float, default=40.0)
+    ap.add_argument("--max-candidates", type=int, default=400)
+    args = ap.parse_args(argv)
+
+    with standin_sources(args.listings, args.latency_ms):
+        t0 = time.perf_counter()
+        direct_sources.collect_candidate_urls(max_per_source=200)
+        discovery_s = time.perf_counter() - t0
+        print(f"discovery only: {discovery_s:.2f}s")
+        for pipelined in (False, True):
+            listings, diag = search_without_api(max_candidates=args.max_candidates, parse_cache=ParseCache(),
+                                                pipelined=pipelined)
+            p = diag["pipeline"]
+            print(f"{'pipelined ' if pipelined else 'two-phase '}: total {p['total_s']:.2f}s, "
+                  f"first download at {p['first_download_s']:.2f}s, "
+                  f"{diag['urls_attempted']} URLs, {len(listings)} listings")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+# makes the repository root importable for tests (src.*)
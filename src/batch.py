@@ -0,0 +1,185 @@
+"""
+Batch evaluation of many addresses against a single crawl.
+
+    python -m src.batch direcciones.csv -o resultados.csv
+    python -m src.batch direcciones.csv -o resultados.parquet --snapshot crawl.json.gz --radius-km 2
+
+The crawl runs once (or is loaded from a snapshot), a ListingIndex is built once,
+and each address only costs a (cached) geocode plus an index query.
+"""
+import argparse
+import csv
+import importlib.util
+import sys
+import time
+
+from .exporting import to_required_frame
+from .districts import assign_districts
+from .gazetteer import geocode_listings
+from .geocode import flush_geocode_cache, geocode_address_cached, geocoder_stats
+from .history import get_rent_history
+from .index import ListingIndex
+from .search import search_without_api
+from .snapshot import load_snapshot, save_snapshot
+from .query import run_query
+from .utils import fold_accents
+
+BATCH_KEY_COLS = ["input_address", "geocoded_name"]
+
+ADDRESS_HEADERS = {"address", "direccion", "domicilio", "ubicacion", "location", "calle"}
+
+def read_addresses(path: str, column: str = "address", header: bool | None = None) -> list[str]:
+    """
+    Read addresses from a CSV: the `column` column when the header names it, otherwise the first.
+    header: True/False says whether the first row is a header; None detects it, i.e. a cell of
+    the first row is `column` or a usual address header (case and accents ignored).
+    """
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        rows = list(csv.reader(f))
+    if not rows:
+        return []
+    names = [fold_accents(h) for h in rows[0]]
+    wanted = fold_accents(column)
+    if header is None:
+        header = wanted in names or any(n in ADDRESS_HEADERS for n in names)
+    idx = names.index(wanted) if header and wanted in names else 0
+    body = rows[1:] if header else rows
+    return [r[idx].strip() for r in body if len(r) > idx and r[idx].strip()]
+
+def load_or_crawl(snapshot: str | None = None, save_to: str | None = None, max_candidates: int = 400,
+                  frontier_path: str | None = None, deadline_s: float | None = None) -> tuple[list[dict], dict]:
+    if snapshot:
+        listings, diag = load_snapshot(snapshot)
+    else:
+        listings, diag = search_without_api(max_candidates=max_candidates, frontier_path=frontier_path,
+                                            deadline_s=deadline_s)
+    geocode_listings(listings)
+    assign_districts(listings)
+    if not snapshot:
+        diag["history"] = get_rent_history().record(listings, gone=diag.get("gone_urls", ()))
+    if save_to:
+        save_snapshot(save_to, listings, diag)
+    return listings, diag
+
+def evaluate_addresses(
+    addresses: list[str],
+    index: ListingIndex,
+    top_n: int = 20,
+    radius_km: float | None = None,
+    geocode_cache: str | None = None,
+    filters: dict | None = None,
+    treat_nd_as_zero: bool = False,
+    enable_estimations: bool = False,
+    community_rate: float = 3.5,
+    ibi_rate_annual: float = 20.0,
+):
+    """
+    Answer a top-N (or radius, if radius_km is given) query for every address against a shared index.
+    Returns (DataFrame with BATCH_KEY_COLS + REQUIRED_COLS, diag).
+    """
+    diag = {"addresses": len(addresses), "geocode_ok": 0, "geocode_failed": [], "geocode_cache_hits": 0, "rows": 0}
+    rows = []
+    for address in addresses:
+        geo = geocode_address_cached(address, cache_path=geocode_cache)
+        if not geo.get("ok"):
+            diag["geocode_failed"].append(address)
+            rows.append({"input_address": address, "notes": f"No se pudo geocodificar: {geo.get('error', '')}"})
+            continue
+        diag["geocode_ok"] += 1
+        diag["geocode_cache_hits"] += int(bool(geo.get("cached")))
+
+        # filters pushed into the index walk before truncation; costs only for the returned rows
+        hits, _ = run_query(
+            index,
+            geo["lat"],
+            geo["lon"],
+            top_n=top_n,
+            radius_km=radius_km,
+            filters=filters,
+            costs={
+                "treat_nd_as_zero": treat_nd_as_zero,
+                "enable_estimations": enable_estimations,
+                "community_rate": community_rate,
+                "ibi_rate_annual": ibi_rate_annual,
+            },
+        )
+        for it in hits:
+            it["input_address"] = address
+            it["geocoded_name"] = geo.get("display_name")
+            rows.append(it)
+
+    if geocode_cache:
+        flush_geocode_cache(geocode_cache)
+    diag["rows"] = len(rows)
+    diag["geocoder"] = geocoder_stats()
+    return to_required_frame(rows, extra_cols=BATCH_KEY_COLS), diag
+
+PARQUET_HELP = "La salida .parquet necesita pyarrow (pip install pyarrow); usa .csv o instálalo."
+
+def parquet_available() -> bool:
+    # optional dependency, not in requirements.txt: only needed for .parquet output
+    return any(importlib.util.find_spec(m) is not None for m in ("pyarrow", "fastparquet"))
+
+def write_output(df, path: str):
+    if path.lower().endswith(".parquet"):
+        if not parquet_available():
+            raise RuntimeError(PARQUET_HELP)
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Evaluación en lote de direcciones (un único rastreo compartido).")
+    ap.add_argument("addresses_csv", help="CSV con una columna 'address' (o la primera columna)")
+    ap.add_argument("-o", "--output", default="madrid_alquiler_oficinas_lote.csv", help=".csv o .parquet")
+    ap.add_argument("--column", default="address")
+    ap.add_argument("--header", action=argparse.BooleanOptionalAction, default=None,
+                    help="La primera fila es (--header) o no es (--no-header) una cabecera; por defecto se detecta")
+    ap.add_argument("--snapshot", help="Cargar ofertas desde un snapshot (.json.gz) en lugar de rastrear")
+    ap.add_argument("--save-snapshot", help="Guardar el rastreo en este snapshot (.json.gz)")
+    ap.add_argument("--frontier", help="Fichero SQLite de la frontera de rastreo (reanuda un rastreo interrumpido)")
+    ap.add_argument("--geocode-cache", default="geocode_cache.json")
+    ap.add_argument("--top-n", type=int, default=20)
+    ap.add_argument("--radius-km", type=float, default=None)
+    ap.add_argument("--max-candidates", type=int, default=400)
+    ap.add_argument("--deadline-s", type=float, default=None, help="Tiempo máximo del rastreo en segundos (devuelve resultados parciales)")
+    ap.add_argument("--treat-nd-as-zero", action="store_true")
+    ap.add_argument("--enable-estimations", action="store_true")
+    ap.add_argument("--community-rate", type=float, default=3.5)
+    ap.add_argument("--ibi-rate-annual", type=float, default=20.0)
+    args = ap.parse_args(argv)
+    if args.output.lower().endswith(".parquet") and not parquet_available():
+        # fail before the crawl, not after it
+        ap.error(PARQUET_HELP)
+
+    addresses = read_addresses(args.addresses_csv, column=args.column, header=args.header)
+
+    t0 = time.perf_counter()
+    listings, _ = load_or_crawl(args.snapshot, args.save_snapshot, args.max_candidates, args.frontier, args.deadline_s)
+    index = ListingIndex(listings)
+    t1 = time.perf_counter()
+
+    df, diag = evaluate_addresses(
+        addresses,
+        index,
+        top_n=args.top_n,
+        radius_km=args.radius_km,
+        geocode_cache=args.geocode_cache,
+        treat_nd_as_zero=args.treat_nd_as_zero,
+        enable_estimations=args.enable_estimations,
+        community_rate=args.community_rate,
+        ibi_rate_annual=args.ibi_rate_annual,
+    )
+    t2 = time.perf_counter()
+    write_output(df, args.output)
+
+    print(
+        f"{len(addresses)} direcciones, {len(index)} ofertas, {diag['rows']} filas -> {args.output} "
+        f"(rastreo/carga {t1 - t0:.1f}s, consultas {t2 - t1:.1f}s, "
+        f"geocodificación fallida: {len(diag['geocode_failed'])})",
+        file=sys.stderr,
+    )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
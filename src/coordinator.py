@@ -0,0 +1,92 @@
+"""
+Process-wide crawl coordinator shared by every app session (held with st.cache_resource).
+
+- Identical crawls requested while one is running are coalesced: one crawl, many waiters.
+- The last finished crawl is reused for `result_ttl_s` seconds (env CRAWL_RESULT_TTL_S,
+  default 300), so sessions searching one after another do not hit the portals again.
+  A crawl cut by its deadline is kept as partial and reused only by callers whose deadline is
+  the same or shorter (they could not get more); a complete crawl serves any deadline.
+- Geocodes go through geocode_address_cached, which coalesces identical lookups too.
+- Each crawl that actually runs is appended once to the rent history (src/history.py).
+
+Every caller gets its own copy of the listings, since the app annotates them per session
+(distance, costs). diag["crawl_id"] identifies the crawl a result came from, e.g. to cache
+a ListingIndex per crawl.
+"""
+import itertools
+import os
+import threading
+import time
+from typing import Callable
+
+from .districts import assign_districts
+from .geocode import geocode_address_cached, geocoder_stats
+from .history import get_rent_history
+from .search import search_without_api
+from .singleflight import SingleFlight
+
+class CrawlCoordinator:
+    def __init__(self, on_listing: Callable[[dict], None] | None = None, result_ttl_s: float | None = None):
+        self.on_listing = on_listing
+        self.result_ttl_s = float(os.getenv("CRAWL_RESULT_TTL_S") or 300) if result_ttl_s is None else result_ttl_s
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+        # max_candidates -> (finished at, deadline_s, partial, listings, diag)
+        self._last: dict[int, tuple[float, float | None, bool, list[dict], dict]] = {}
+        self._crawl_ids = itertools.count(1)
+        self.stats = {"crawl_requests": 0, "crawls_run": 0, "crawls_coalesced": 0, "crawls_reused": 0}
+
+    def _run(self, max_candidates: int, deadline_s: float | None):
+        listings, diag = search_without_api(max_candidates=max_candidates, on_listing=self.on_listing,
+                                            deadline_s=deadline_s)
+        assign_districts(listings)
+        with self._lock:
+            diag["crawl_id"] = next(self._crawl_ids)
+        diag["history"] = get_rent_history().record(listings, gone=diag.get("gone_urls", ()))
+        partial = bool((diag.get("budget") or {}).get("partial"))
+        with self._lock:
+            self._last[max_candidates] = (time.monotonic(), deadline_s, partial, listings, diag)
+        return listings, diag
+
+    def _reusable(self, max_candidates: int, deadline_s: float | None):
+        last = self._last.get(max_candidates)
+        if last is None or time.monotonic() - last[0] >= self.result_ttl_s:
+            return None
+        _, last_deadline, partial, _, _ = last
+        if partial and (deadline_s is None or last_deadline is None or deadline_s > last_deadline):
+            return None
+        return last
+
+    def crawl(self, max_candidates: int = 400, deadline_s: float | None = None) -> tuple[list[dict], dict]:
+        """
+        Same result as search_without_api(max_candidates, deadline_s=...), shared across sessions.
+        diag["coordinator"] says whether this call ran the crawl, waited on one ("coalesced")
+        or reused a recent one ("reused").
+        """
+        key = (max_candidates, deadline_s)
+        with self._lock:
+            self.stats["crawl_requests"] += 1
+            last = self._reusable(max_candidates, deadline_s)
+            if last is not None:
+                self.stats["crawls_reused"] += 1
+                return self._copy(last[3], last[4], "reused", time.monotonic() - last[0])
+
+        (listings, diag), shared = self._flight.do(key, self._run, max_candidates, deadline_s)
+        with self._lock:
+            self.stats["crawls_coalesced" if shared else "crawls_run"] += 1
+        return self._copy(listings, diag, "coalesced" if shared else "ran", 0.0)
+
+    @staticmethod
+    def _copy(listings: list[dict], diag: dict, how: str, age_s: float) -> tuple[list[dict], dict]:
+        return [dict(it) for it in listings], dict(diag, coordinator={"result": how, "age_s": round(age_s, 1)})
+
+    def geocode(self, address: str) -> dict:
+        return geocode_address_cached(address)
+
+    def report(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        return {
+            "crawl": dict(stats, single_flight=self._flight.stats(), result_ttl_s=self.result_ttl_s),
+            "geocode": geocoder_stats()["single_flight"],
+        }
@@ -1,9 +1,13 @@
+import threading
 import time
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin
 import xml.etree.ElementTree as ET
 
+from .frontier import Frontier
+from .transport import http_get
 from .utils import canonical_url
 
 DEFAULT_SOURCES = {
@@ -28,9 +32,20 @@ def _headers():
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
     }
 
+def clamp_timeout(timeout, deadline: float | None):
+    """
+    Shrink a requests timeout (seconds or (connect, read)) so it ends by `deadline` (time.monotonic()).
+    """
+    if deadline is None:
+        return timeout
+    remaining = max(deadline - time.monotonic(), 0.5)
+    if isinstance(timeout, tuple):
+        return tuple(min(t, remaining) for t in timeout)
+    return min(timeout, remaining)
+
 def _get(url: str, timeout=(7, 15)) -> tuple[str|None, str|None]:
     try:
-        r = requests.get(url, headers=_headers(), timeout=timeout, allow_redirects=True)
+        r = http_get(url, headers=_headers(), timeout=timeout, allow_redirects=True)
         if r.status_code >= 400:
             return None, f"http_{r.status_code}"
         txt = r.text or ""
@@ -74,24 +89,36 @@ def _extract_links(base_url: str, html: str, must_contain: list[str] | None = No
         out.append(u)
     return out
 
-def _sitemap_urls(root_url: str, max_sitemaps: int = 8, max_urls: int = 600) -> tuple[list[str], dict]:
+def _sitemap_urls(root_url: str, max_sitemaps: int = 8, max_urls: int = 600, frontier: Frontier | None = None,
+                  stop: threading.Event | None = None, deadline: float | None = None,
+                  queue: Callable[[list[str]], None] | None = None) -> tuple[list[str], dict]:
     """
     Best-effort sitemap discovery:
     - tries /sitemap.xml and /sitemap_index.xml
     - supports sitemap indexes (nested sitemaps)
+    Sitemaps to fetch are queued in the frontier (kind "sitemap:<host>"), so a resumed
+    crawl does not fetch the same sitemap twice. With queue, each sitemap's URLs are handed to
+    it (the caller filters and queues them as listings) before that sitemap is marked done, so
+    an interrupted walk never loses them.
     """
     diag = {"sitemaps_fetched": [], "sitemap_errors": []}
     base = root_url.split("/")[0] + "//" + root_url.split("/")[2]
+    frontier = frontier or Frontier()
+    kind = f"sitemap:{base}"
+    frontier.add_many([base + "/sitemap.xml", base + "/sitemap_index.xml"], priority=0, kind=kind)
 
     candidates = []
-    to_fetch = [base + "/sitemap.xml", base + "/sitemap_index.xml"]
-
     fetched = 0
-    while to_fetch and fetched < max_sitemaps and len(candidates) < max_urls:
-        sm = to_fetch.pop(0)
-        xml_txt, reason = _get(sm, timeout=(7, 20))
+    while fetched < max_sitemaps and len(candidates) < max_urls:
+        if stop is not None and stop.is_set():
+            break
+        sm = frontier.pop(kind)
+        if sm is None:
+            break
+        xml_txt, reason = _get(sm, timeout=clamp_timeout((7, 20), deadline))
         if not xml_txt:
             diag["sitemap_errors"].append({sm: reason})
+            frontier.done(sm, status=reason)
             continue
         diag["sitemaps_fetched"].append(sm)
         fetched += 1
@@ -104,35 +131,34 @@ def _sitemap_urls(root_url: str, max_sitemaps: int = 8, max_urls: int = 600) ->
             # Detect sitemap index
             if "sitemapindex" in tag:
                 for loc in root.findall(".//{*}loc"):
-                    if loc.text and loc.text.strip():
-                        u = loc.text.strip()
-                        if u not in to_fetch and len(to_fetch) < max_sitemaps:
-                            to_fetch.append(u)
+                    if loc.text and loc.text.strip() and frontier.pending(kind) < max_sitemaps:
+                        frontier.add(loc.text.strip(), priority=1, kind=kind)
+                frontier.done(sm, status="index")
                 continue
 
             # URL set
+            found = []
             if "urlset" in tag:
                 for loc in root.findall(".//{*}loc"):
                     if loc.text and loc.text.strip():
                         u = canonical_url(loc.text.strip())
                         if u:
-                            candidates.append(u)
-                            if len(candidates) >= max_urls:
+                            found.append(u)
+                            if len(candidates) + len(found) >= max_urls:
                                 break
+            candidates.extend(found)
+            if queue is not None:
+                queue(found)
+            frontier.done(sm, status="ok")
         except Exception:
             diag["sitemap_errors"].append({sm: "parse_error"})
+            frontier.done(sm, status="parse_error")
             continue
 
-        time.sleep(0.2)
+        (stop.wait if stop is not None else time.sleep)(0.2)
 
-    # de-dup
-    out, seen = [], set()
-    for u in candidates:
-        if u in seen:
-            continue
-        seen.add(u)
-        out.append(u)
-    return out, diag
+    # de-dup preserve order
+    return list(dict.fromkeys(candidates)), diag
 
 def _filter_urls(urls: list[str], contains_tokens: list[str], max_keep: int) -> list[str]:
     out = []
@@ -149,64 +175,146 @@ def _filter_urls(urls: list[str], contains_tokens: list[str], max_keep: int) ->
             break
     return out
 
-def collect_candidate_urls(max_per_source: int = 150, pages_loopnet: int = 3) -> tuple[list[str], dict]:
-    diag = {
-        "mode": "direct_sources_plus_sitemap",
-        "sources": list(DEFAULT_SOURCES.keys()),
-        "seed_fetch": {},
-        "sitemap": {},
-        "candidates_by_source": {},
-        "total_candidates": 0,
-    }
+class _SourceOrder:
+    """
+    Queues the listing URLs of concurrently discovered sources in source order, so the frontier
+    pops them as a serial discovery would (and a replayed crawl attempts the same URLs).
+    Every URL of source i gets priority i. The first unfinished source queues them poppable;
+    later sources queue them held (stored and de-duplicated) and they are released once every
+    earlier source finished. A source is marked done only when its URLs are released.
+    """
 
-    candidates = []
+    def __init__(self, frontier: Frontier, names: list[str], done_sources: set, diag: dict, lock: threading.Lock):
+        self.frontier = frontier
+        self.names = names
+        self.done_sources = done_sources
+        self.diag = diag
+        self.lock = lock
+        self.head = 0
+        self.finished: dict[str, bool] = {}
+        self._advance()
 
-    # 1) Try seed pages (fast)
-    for name, seed in DEFAULT_SOURCES.items():
-        html, reason = _get(seed)
-        diag["seed_fetch"][seed] = "ok" if html else reason
+    def add(self, name: str, urls: list[str]):
+        with self.lock:
+            held = self.head < len(self.names) and self.names[self.head] != name
+            self.frontier.add_many(urls, priority=self.names.index(name), kind="listing", held=held)
+
+    def finish(self, name: str, complete: bool):
+        with self.lock:
+            self.finished[name] = complete
+            self._advance()
+
+    def _advance(self):
+        while self.head < len(self.names):
+            name = self.names[self.head]
+            if name in self.done_sources:
+                pass
+            elif name not in self.finished:
+                break
+            elif self.finished[name]:
+                self.done_sources.add(name)
+            self.head += 1
+            if self.head < len(self.names):
+                self.frontier.release("listing", self.head)
+        self.diag["sources_done"] = sorted(self.done_sources)
+        self.frontier.set_meta("discovery_diag", self.diag)
+
+def _discover_source(name: str, seed: str, max_per_source: int, frontier: Frontier, diag: dict,
+                     order: _SourceOrder, lock: threading.Lock, stop: threading.Event | None,
+                     deadline: float | None):
+    """
+    Seed page first; if it is blocked (403/404) or yields too few links, sitemap discovery.
+    Candidates go to the frontier (through `order`) as soon as each step resolves.
+    """
+    complete = False
+    try:
+        complete = _discover_steps(name, seed, max_per_source, frontier, diag, order, lock, stop, deadline)
+    finally:
+        # interrupted (or failed): not marked done, so a resumed crawl discovers it again
+        order.finish(name, complete)
+
+def _discover_steps(name: str, seed: str, max_per_source: int, frontier: Frontier, diag: dict,
+                    order: _SourceOrder, lock: threading.Lock, stop: threading.Event | None,
+                    deadline: float | None) -> bool:
+    # 1) Seed page (fast)
+    if seed not in diag["seed_fetch"]:
+        html, reason = _get(seed, timeout=clamp_timeout((7, 15), deadline))
         urls = []
         if html:
             must = ["loopnet.es/anuncio"] if name == "LoopNet" else None
             urls = _extract_links(seed, html, must_contain=must)
         urls = urls[:max_per_source]
-        diag["candidates_by_source"][name] = len(urls)
-        candidates += urls
-        time.sleep(0.25)
-
-    # 2) If a source is blocked (403/404) or yields too few, try sitemap discovery
-    for name, seed in DEFAULT_SOURCES.items():
-        current = diag["candidates_by_source"].get(name, 0)
-        seed_status = None
-        for k, v in diag["seed_fetch"].items():
-            if k == seed:
-                seed_status = v
-                break
+        order.add(name, urls)
+        with lock:
+            diag["seed_fetch"][seed] = "ok" if html else reason
+            diag["candidates_by_source"][name] = len(urls)
+            frontier.set_meta("discovery_diag", diag)
 
-        if current >= 25:
-            continue  # already enough
+    if stop is not None and stop.is_set():
+        return False
 
-        # sitemap discovery
-        urls, smdiag = _sitemap_urls(seed, max_sitemaps=10, max_urls=1000)
-        diag["sitemap"][name] = smdiag
+    # 2) Sitemap discovery unless the seed already gave enough
+    if diag["candidates_by_source"].get(name, 0) < 25:
+        # For LoopNet we specifically want /anuncio/
+        tokens = ["loopnet.es/anuncio/"] if name == "LoopNet" else SOURCE_PATTERNS.get(name, [])
+        kept = []
+
+        def queue(urls: list[str]):
+            if len(kept) >= max_per_source:
+                return
+            out = _filter_urls(urls, tokens, max_keep=max_per_source - len(kept))
+            kept.extend(out)
+            order.add(name, out)
+
+        # each sitemap's listing URLs are queued as it is parsed (see _sitemap_urls)
+        urls, smdiag = _sitemap_urls(seed, max_sitemaps=10, max_urls=1000, frontier=frontier, stop=stop,
+                                     deadline=deadline, queue=queue)
+        if stop is not None and stop.is_set():
+            # interrupted walk: a resumed crawl finishes it
+            return False
 
-        tokens = SOURCE_PATTERNS.get(name, [])
         filtered = _filter_urls(urls, tokens, max_keep=max_per_source)
-        # For LoopNet we specifically want /anuncio/
-        if name == "LoopNet":
-            filtered = _filter_urls(urls, ["loopnet.es/anuncio/"], max_keep=max_per_source)
+        with lock:
+            diag["sitemap"][name] = smdiag
+            diag["candidates_by_source"][name] = max(diag["candidates_by_source"].get(name, 0), len(filtered))
+    return True
 
-        diag["candidates_by_source"][name] = max(diag["candidates_by_source"].get(name, 0), len(filtered))
-        candidates += filtered
-        time.sleep(0.25)
+def collect_candidate_urls(max_per_source: int = 150, pages_loopnet: int = 3, frontier: Frontier | None = None,
+                           stop: threading.Event | None = None, deadline: float | None = None) -> tuple[list[str], dict]:
+    """
+    Discover listing URLs from seed pages (and sitemaps for sources that yield too few).
+    Candidates are queued in the frontier (kind "listing") as each source resolves; the frontier
+    also de-duplicates them across sources, so a consumer can pop them while discovery runs.
+    Sources are different hosts and are discovered concurrently, but their URLs become poppable
+    in source order (see _SourceOrder), so the crawl does not depend on which host answers first.
+    Sources already discovered in a previous run on the same frontier are skipped.
+    stop (optional) ends discovery early (e.g. the consumer already has enough URLs).
+    deadline (optional, time.monotonic()) caps request timeouts so discovery ends close to it.
+    """
+    frontier = frontier or Frontier()
+    diag = frontier.get_meta("discovery_diag") or {
+        "mode": "direct_sources_plus_sitemap",
+        "sources": list(DEFAULT_SOURCES.keys()),
+        "seed_fetch": {},
+        "sitemap": {},
+        "candidates_by_source": {},
+        "total_candidates": 0,
+    }
+    done_sources = set(diag.get("sources_done", []))
+    lock = threading.Lock()
+    order = _SourceOrder(frontier, list(DEFAULT_SOURCES), done_sources, diag, lock)
 
-    # de-dup preserve order
-    out, seen = [], set()
-    for u in candidates:
-        if u in seen:
-            continue
-        seen.add(u)
-        out.append(u)
+    todo = [(name, seed) for name, seed in DEFAULT_SOURCES.items() if name not in done_sources]
+    if todo:
+        with ThreadPoolExecutor(max_workers=len(todo), thread_name_prefix="discovery") as pool:
+            futures = [pool.submit(_discover_source, name, seed, max_per_source, frontier, diag, order, lock, stop, deadline)
+                       for name, seed in todo]
+            for fut in futures:
+                fut.result()
 
-    diag["total_candidates"] = len(out)
-    return out, diag
+    with lock:
+        diag["sources_done"] = sorted(done_sources)
+        diag["total_candidates"] = frontier.count("listing")
+        frontier.set_meta("discovery_diag", diag)
+    frontier.checkpoint()
+    return frontier.urls("listing"), diag
@@ -0,0 +1,245 @@
+"""
+Geometric district / barrio membership from a local GeoJSON (WGS84 lon/lat).
+
+Default files (override with env vars):
+    data/madrid_distritos.geojson   MADRID_DISTRICTS_GEOJSON
+    data/madrid_barrios.geojson     MADRID_BARRIOS_GEOJSON
+
+Polygons are indexed with a static STR-packed bounding-box R-tree; batches of points take
+their candidate polygons from the tree and are tested with a vectorized (numpy) ray casting.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+
+from .utils import fold_accents
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+DISTRICTS_PATH = os.getenv("MADRID_DISTRICTS_GEOJSON") or os.path.join(DATA_DIR, "madrid_distritos.geojson")
+BARRIOS_PATH = os.getenv("MADRID_BARRIOS_GEOJSON") or os.path.join(DATA_DIR, "madrid_barrios.geojson")
+
+MAX_CELLS = 4_000_000
+NAME_KEYS = ["name", "NOMBRE", "nombre", "NOMDIS", "NOMBAR", "DISTRITO", "BARRIO", "distrito", "barrio"]
+
+class BBoxRTree:
+    """
+    Static R-tree over bounding boxes (minx, miny, maxx, maxy), bulk-loaded with Sort-Tile-Recursive.
+    """
+
+    def __init__(self, boxes: list[tuple[float, float, float, float]], node_size: int = 8):
+        self.node_size = node_size
+        # level 0: one entry per box -> (bbox, item id)
+        level = [(b, i) for i, b in enumerate(boxes)]
+        self.levels = [level]
+        while len(level) > node_size:
+            level = self._pack(level)
+            self.levels.append(level)
+        self.root = level
+
+    def _pack(self, entries):
+        n = len(entries)
+        leaves = -(-n // self.node_size)
+        slices = max(int(np.ceil(np.sqrt(leaves))), 1)
+        per_slice = slices * self.node_size
+        by_x = sorted(entries, key=lambda e: (e[0][0] + e[0][2]))
+        parents = []
+        for s in range(0, n, per_slice):
+            chunk = sorted(by_x[s:s + per_slice], key=lambda e: (e[0][1] + e[0][3]))
+            for k in range(0, len(chunk), self.node_size):
+                children = chunk[k:k + self.node_size]
+                bbox = (
+                    min(c[0][0] for c in children), min(c[0][1] for c in children),
+                    max(c[0][2] for c in children), max(c[0][3] for c in children),
+                )
+                parents.append((bbox, children))
+        return parents
+
+    def query_point(self, x: float, y: float) -> list[int]:
+        out = []
+        stack = list(self.root)
+        while stack:
+            (minx, miny, maxx, maxy), child = stack.pop()
+            if x < minx or x > maxx or y < miny or y > maxy:
+                continue
+            if isinstance(child, int):
+                out.append(child)
+            else:
+                stack.extend(child)
+        return out
+
+    def query_points(self, xs: np.ndarray, ys: np.ndarray) -> dict[int, np.ndarray]:
+        """
+        Batch query: item id -> indices of the points inside its box. Descends the tree once,
+        carrying the subset of points inside each node's box.
+        """
+        out: dict[int, list[np.ndarray]] = {}
+        stack = [(entry, np.arange(len(xs))) for entry in self.root]
+        while stack:
+            ((minx, miny, maxx, maxy), child), idx = stack.pop()
+            px, py = xs[idx], ys[idx]
+            idx = idx[(px >= minx) & (px <= maxx) & (py >= miny) & (py <= maxy)]
+            if not len(idx):
+                continue
+            if isinstance(child, int):
+                out.setdefault(child, []).append(idx)
+            else:
+                stack.extend((c, idx) for c in child)
+        return {i: np.concatenate(parts) for i, parts in out.items()}
+
+def _rings_contain(rings: list[np.ndarray], xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """
+    Even-odd ray casting over all rings (outer + holes) of one polygon, vectorized over points.
+    """
+    inside = np.zeros(xs.shape, dtype=bool)
+    for ring in rings:
+        x1, y1 = ring[:-1, 0], ring[:-1, 1]
+        x2, y2 = ring[1:, 0], ring[1:, 1]
+        # points x edges
+        py = ys[:, None]
+        px = xs[:, None]
+        crosses = (y1 > py) != (y2 > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_at = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        hits = crosses & (px < x_at)
+        inside ^= (np.count_nonzero(hits, axis=1) % 2 == 1)
+    return inside
+
+class AreaIndex:
+    """
+    Named polygons (one GeoJSON feature each) with point lookup and batch classification.
+    """
+
+    def __init__(self, geojson: dict, name_key: str | None = None):
+        self.names: list[str] = []
+        self.polygons: list[list[list[np.ndarray]]] = []  # feature -> polygons -> rings
+        boxes = []
+        for feat in geojson.get("features") or []:
+            geom = feat.get("geometry") or {}
+            props = feat.get("properties") or {}
+            name = props.get(name_key) if name_key else next((props[k] for k in NAME_KEYS if props.get(k)), None)
+            if not name:
+                continue
+            if geom.get("type") == "Polygon":
+                polys = [geom["coordinates"]]
+            elif geom.get("type") == "MultiPolygon":
+                polys = geom["coordinates"]
+            else:
+                continue
+            rings = [[self._closed(np.asarray(r, dtype=float)[:, :2]) for r in poly] for poly in polys]
+            allpts = np.vstack([r for poly in rings for r in poly])
+            boxes.append((allpts[:, 0].min(), allpts[:, 1].min(), allpts[:, 0].max(), allpts[:, 1].max()))
+            self.names.append(str(name).strip())
+            self.polygons.append(rings)
+        self.boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        self.tree = BBoxRTree([tuple(b) for b in boxes])
+        self._by_folded = {fold_accents(n): n for n in self.names}
+
+    @staticmethod
+    def _closed(ring: np.ndarray) -> np.ndarray:
+        if len(ring) and not np.array_equal(ring[0], ring[-1]):
+            ring = np.vstack([ring, ring[:1]])
+        return ring
+
+    def __len__(self):
+        return len(self.names)
+
+    def _contains(self, i: int, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        inside = np.zeros(xs.shape, dtype=bool)
+        for rings in self.polygons[i]:
+            # bound the points x edges matrices to ~MAX_CELLS booleans
+            edges = sum(len(r) for r in rings)
+            step = max(MAX_CELLS // max(edges, 1), 1)
+            for s in range(0, len(xs), step):
+                inside[s:s + step] |= _rings_contain(rings, xs[s:s + step], ys[s:s + step])
+        return inside
+
+    def lookup(self, lat: float, lon: float) -> str | None:
+        xs, ys = np.array([lon], dtype=float), np.array([lat], dtype=float)
+        for i in sorted(self.tree.query_point(lon, lat)):  # lowest feature wins on overlaps
+            if self._contains(i, xs, ys)[0]:
+                return self.names[i]
+        return None
+
+    def classify(self, lats, lons) -> list[str | None]:
+        """
+        Name of the containing area for each point (None outside every polygon / missing coords).
+        """
+        lats = np.asarray([np.nan if v is None else v for v in lats], dtype=float)
+        lons = np.asarray([np.nan if v is None else v for v in lons], dtype=float)
+        out = np.full(lats.shape, -1, dtype=int)
+        # R-tree: candidate points per polygon (NaN coords fall outside every box),
+        # then one vectorized containment test per polygon
+        candidates = self.tree.query_points(lons, lats)
+        for i in sorted(candidates):  # lowest feature wins on overlaps, as in lookup()
+            cand = candidates[i]
+            cand = cand[out[cand] < 0]
+            if not len(cand):
+                continue
+            hit = self._contains(i, lons[cand], lats[cand])
+            out[cand[hit]] = i
+        return [self.names[i] if i >= 0 else None for i in out]
+
+    def canonical_name(self, name: str) -> str | None:
+        """
+        The area name spelled as in the GeoJSON for any casing/accents of it, else None.
+        """
+        return self._by_folded.get(fold_accents(name))
+
+_AREAS: dict[str, AreaIndex | None] = {}
+_AREAS_LOCK = threading.Lock()
+
+def load_areas(path: str) -> AreaIndex | None:
+    """
+    Load (once per process) an AreaIndex from a GeoJSON file; None if the file is missing or invalid.
+    """
+    with _AREAS_LOCK:
+        if path not in _AREAS:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    _AREAS[path] = AreaIndex(json.load(f))
+            except Exception:
+                _AREAS[path] = None
+        return _AREAS[path]
+
+def canonical_zone(name: str) -> str | None:
+    """
+    The district (else barrio) name matching `name` exactly up to case/accents, else None.
+    A known zone name is filtered by exact match (utils.listing_filter zone_exact).
+    """
+    for path in (DISTRICTS_PATH, BARRIOS_PATH):
+        areas = load_areas(path)
+        zone = areas.canonical_name(name) if areas and name else None
+        if zone:
+            return zone
+    return None
+
+def zone_names() -> list[str]:
+    """
+    District names followed by barrio names (for the sidebar selector).
+    """
+    names = []
+    for path in (DISTRICTS_PATH, BARRIOS_PATH):
+        areas = load_areas(path)
+        if areas:
+            names += sorted(areas.names)
+    return names
+
+def assign_districts(listings: list[dict]) -> list[dict]:
+    """
+    Store `district` and `barrio` columns on each listing (in place) from its coordinates.
+    Listings without coordinates, or when no GeoJSON is available, are left untouched.
+    """
+    located = [it for it in listings if it.get("lat") is not None and it.get("lon") is not None]
+    if not located:
+        return listings
+    lats = [it["lat"] for it in located]
+    lons = [it["lon"] for it in located]
+    for col, path in (("district", DISTRICTS_PATH), ("barrio", BARRIOS_PATH)):
+        areas = load_areas(path)
+        if not areas:
+            continue
+        for it, name in zip(located, areas.classify(lats, lons)):
+            it[col] = name
+    return listings
@@ -2,6 +2,39 @@ import io
 from reportlab.lib.pagesizes import A4, landscape
 from reportlab.pdfgen import canvas
 
+# Output columns shared by the app table, the batch CSV/Parquet and the exports
+REQUIRED_COLS = [
+    "building_name",
+    "location",
+    "dist_km",
+    "area_m2",
+    "available_from",
+    "rent_eur_m2_month",
+    "rent_total_eur_month",
+    "community_eur_month",
+    "ibi_eur_month",
+    "total_1_rent_plus_community",
+    "total_2_rent_plus_ibi",
+    "total_3_community_plus_ibi",
+    "total_final",
+    "source_url",
+    "source_domain",
+    "consulted_on",
+    "notes",
+]
+
+def to_required_frame(listings, extra_cols=None):
+    """
+    Build a DataFrame with REQUIRED_COLS (missing ones as None), optionally prefixed by extra_cols.
+    """
+    import pandas as pd
+    cols = list(extra_cols or []) + REQUIRED_COLS
+    df = pd.DataFrame(listings)
+    for c in cols:
+        if c not in df.columns:
+            df[c] = None
+    return df[cols]
+
 def export_excel_bytes(df):
     import pandas as pd
     bio = io.BytesIO()
@@ -0,0 +1,248 @@
+"""
+Persistent, resumable crawl frontier.
+
+- Priority queue of URLs stored in SQLite (stdlib): lower priority value is fetched first,
+  ties in insertion order. The queue lives on disk, not in Python lists.
+- Seen-set: a Bloom filter over canonical URLs (fixed size, ~2.3 bytes per expected URL at 1e-4).
+  A Bloom hit is confirmed against the table, so membership stays exact.
+- Checkpoints: writes are committed every `checkpoint_every` operations or `checkpoint_seconds`,
+  and on checkpoint()/close();
+  the Bloom filter is rebuilt from the table when the frontier is reopened.
+  After a crash, URLs that were popped but not marked done go back to pending.
+- Thread-safe: a producer (discovery) can add URLs while a consumer (download) pops them;
+  wait_for_urls() blocks the consumer until something new is queued.
+"""
+import hashlib
+import json
+import math
+import sqlite3
+import threading
+import time
+
+from .utils import canonical_url
+
+PENDING, IN_PROGRESS, DONE, HELD = 0, 1, 2, 3  # HELD: queued but not poppable until release()
+
+class BloomFilter:
+    def __init__(self, capacity: int = 500_000, error_rate: float = 1e-4):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.m = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 64)
+        self.k = max(int(round(self.m / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.m + 7) // 8)
+
+    def _positions(self, item: str):
+        d = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(d[:8], "little")
+        h2 = int.from_bytes(d[8:], "little") | 1
+        for i in range(self.k):
+            yield (h1 + i * h2) % self.m
+
+    def add(self, item: str):
+        for p in self._positions(item):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def nbytes(self) -> int:
+        return len(self.bits)
+
+class Frontier:
+    """
+    URL frontier persisted to `path` (":memory:" for a throwaway one).
+    URLs are grouped by `kind` (e.g. "listing", "sitemap:<host>") so several queues share one file.
+    """
+
+    def __init__(self, path: str = ":memory:", expected_urls: int = 500_000, error_rate: float = 1e-4,
+                 checkpoint_every: int = 50, checkpoint_seconds: float = 5.0):
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_seconds = checkpoint_seconds
+        self._pending_ops = 0
+        self._last_checkpoint = time.monotonic()
+        self._seq = 0
+        self._lock = threading.RLock()
+        self._added = threading.Condition(self._lock)
+        self.stats = {"added": 0, "duplicates": 0, "bloom_false_positives": 0, "popped": 0, "resumed": 0}
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS frontier (
+                url TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                priority REAL NOT NULL,
+                seq INTEGER NOT NULL,
+                state INTEGER NOT NULL DEFAULT 0,
+                status TEXT,
+                result TEXT
+            );
+            CREATE INDEX IF NOT EXISTS frontier_queue ON frontier (kind, state, priority, seq);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+
+        # the filter is rebuilt from the table on open, so it never disagrees with committed rows
+        self.seen = BloomFilter(expected_urls, error_rate)
+        for (url,) in self.db.execute("SELECT url FROM frontier"):
+            self.seen.add(url)
+
+        self._seq = (self.db.execute("SELECT MAX(seq) FROM frontier").fetchone()[0] or 0) + 1
+        # anything popped but never marked done is retried
+        cur = self.db.execute("UPDATE frontier SET state = ? WHERE state = ?", (PENDING, IN_PROGRESS))
+        self.stats["resumed"] = cur.rowcount
+        self.db.commit()
+
+    def _tick(self):
+        self._pending_ops += 1
+        if self._pending_ops >= self.checkpoint_every or time.monotonic() - self._last_checkpoint >= self.checkpoint_seconds:
+            self.checkpoint()
+
+    def checkpoint(self):
+        with self._lock:
+            self.db.commit()
+            self._pending_ops = 0
+            self._last_checkpoint = time.monotonic()
+
+    def close(self):
+        self.checkpoint()
+        self.db.close()
+
+    def get_meta(self, key: str, default=None):
+        with self._lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        try:
+            return json.loads(row[0])
+        except (TypeError, ValueError):
+            return default
+
+    def set_meta(self, key: str, value, commit: bool = True):
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value, default=str)))
+            if commit:
+                self.db.commit()
+
+    def add(self, url: str, priority: float = 0.0, kind: str = "listing", held: bool = False) -> bool:
+        """
+        Queue a URL unless it was ever seen (in any kind). Returns True if it was added.
+        held: stored (and de-duplicated) now, but pop() skips it until release(kind, priority).
+        """
+        u = canonical_url(url)
+        if not u:
+            return False
+        with self._lock:
+            if u in self.seen:
+                if self.db.execute("SELECT 1 FROM frontier WHERE url = ?", (u,)).fetchone():
+                    self.stats["duplicates"] += 1
+                    return False
+                self.stats["bloom_false_positives"] += 1
+            self.db.execute(
+                "INSERT INTO frontier (url, kind, priority, seq, state) VALUES (?, ?, ?, ?, ?)",
+                (u, kind, float(priority), self._seq, HELD if held else PENDING),
+            )
+            self._seq += 1
+            self.seen.add(u)
+            self.stats["added"] += 1
+            self._tick()
+            self._added.notify_all()
+            return True
+
+    def add_many(self, urls, priority: float = 0.0, kind: str = "listing", held: bool = False) -> int:
+        return sum(1 for u in urls if self.add(u, priority=priority, kind=kind, held=held))
+
+    def release(self, kind: str, priority: float) -> int:
+        """
+        Make the held URLs of this kind and priority poppable. Returns how many were released.
+        """
+        with self._lock:
+            n = self.db.execute("UPDATE frontier SET state = ? WHERE kind = ? AND priority = ? AND state = ?",
+                                (PENDING, kind, float(priority), HELD)).rowcount
+            if n:
+                self._tick()
+                self._added.notify_all()
+            return n
+
+    def pop(self, kind: str = "listing") -> str | None:
+        """
+        Next pending URL of this kind (marked in progress until done()).
+        """
+        with self._lock:
+            row = self.db.execute(
+                "SELECT url FROM frontier WHERE kind = ? AND state = ? ORDER BY priority, seq LIMIT 1",
+                (kind, PENDING),
+            ).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE frontier SET state = ? WHERE url = ?", (IN_PROGRESS, row[0]))
+            self.stats["popped"] += 1
+            self._tick()
+            return row[0]
+
+    def wait_for_urls(self, timeout: float) -> bool:
+        """
+        Block until another thread adds a URL (True) or the timeout expires (False).
+        """
+        with self._added:
+            return self._added.wait(timeout)
+
+    def done(self, url: str, status: str = "ok", result: dict | None = None):
+        """
+        Mark a popped URL as finished; `result` (e.g. the extracted listing) is kept for resumed runs.
+        """
+        with self._lock:
+            self.db.execute(
+                "UPDATE frontier SET state = ?, status = ?, result = ? WHERE url = ?",
+                (DONE, status, json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+                 canonical_url(url)),
+            )
+            self._tick()
+
+    def pending(self, kind: str = "listing") -> int:
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM frontier WHERE kind = ? AND state != ?", (kind, DONE)).fetchone()[0]
+
+    def count(self, kind: str | None = None) -> int:
+        with self._lock:
+            if kind is None:
+                return self.db.execute("SELECT COUNT(*) FROM frontier").fetchone()[0]
+            return self.db.execute("SELECT COUNT(*) FROM frontier WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def urls(self, kind: str = "listing", statuses=None) -> list[str]:
+        """
+        URLs of this kind in queue order; with statuses, only finished ones with one of those statuses.
+        """
+        with self._lock:
+            if statuses is None:
+                rows = self.db.execute("SELECT url FROM frontier WHERE kind = ? ORDER BY priority, seq", (kind,))
+            else:
+                statuses = list(statuses)
+                rows = self.db.execute(
+                    f"SELECT url FROM frontier WHERE kind = ? AND state = ? AND status IN ({','.join('?' * len(statuses))})"
+                    " ORDER BY priority, seq",
+                    (kind, DONE, *statuses),
+                )
+            return [u for (u,) in rows]
+
+    def results(self, kind: str = "listing") -> list[dict]:
+        """
+        Stored results of finished URLs, in queue order.
+        """
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT result FROM frontier WHERE kind = ? AND state = ? AND result IS NOT NULL ORDER BY priority, seq",
+                (kind, DONE),
+            ).fetchall()
+        return [json.loads(r) for (r,) in rows]
+
+    def status_counts(self, kind: str = "listing") -> dict[tuple[str, bool], int]:
+        """
+        Finished URLs grouped by (status, has_result).
+        """
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT status, result IS NOT NULL, COUNT(*) FROM frontier WHERE kind = ? AND state = ? GROUP BY 1, 2",
+                (kind, DONE),
+            ).fetchall()
+        return {(status, bool(has)): n for status, has, n in rows}
@@ -0,0 +1,361 @@
+"""
+Offline Madrid street gazetteer (municipal "callejero": one row per street number with coordinates).
+
+File: data/madrid_callejero.csv[.gz] (override with env MADRID_CALLEJERO_CSV). Columns are detected
+by name (official names first): VIA_CLASE, VIA_PAR, VIA_NOMBRE, NUMERO, LATITUD, LONGITUD.
+Coordinates may be decimal degrees or DMS strings such as 40º25'6.12'' N.
+
+Lookups use a normalized street key (accent folding, street type and particles removed):
+exact key -> prefix (bisect over sorted keys) -> fuzzy (trigram shortlist + difflib ratio).
+House numbers are matched exactly or interpolated between neighbours with the same parity.
+Addresses naming another municipality (a place after the street that is not Madrid or one of
+its districts, or a postcode outside the city) are not answered: the streets are Madrid's only.
+
+The first load parses the CSV and writes the prebuilt index next to it (<file>.index.json.gz);
+later loads read that index unless the CSV changed.
+"""
+import bisect
+import csv
+import difflib
+import gzip
+import io
+import json
+import os
+import re
+import threading
+
+from .utils import fold_accents
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+CALLEJERO_PATH = os.getenv("MADRID_CALLEJERO_CSV") or os.path.join(DATA_DIR, "madrid_callejero.csv")
+
+COLUMNS = {
+    "type": ["VIA_CLASE", "CLASE_VIA", "TIPO_VIA", "clase", "type"],
+    "particle": ["VIA_PAR", "PARTICULA", "particula"],
+    "name": ["VIA_NOMBRE", "NOMBRE_VIA", "NOMBRE", "calle", "street", "name"],
+    "number": ["NUMERO", "NUM", "numero", "number"],
+    "lat": ["LATITUD", "LAT", "lat", "latitude"],
+    "lon": ["LONGITUD", "LON", "lon", "lng", "longitude"],
+}
+
+STREET_TYPES = {
+    "calle", "c", "cl", "avenida", "av", "avda", "paseo", "po", "plaza", "pl", "pza", "glorieta",
+    "gta", "ronda", "rda", "camino", "cm", "carretera", "ctra", "travesia", "trva", "costanilla", "cuesta",
+    "pasaje", "psaje", "via", "autovia", "bulevar", "callejon", "plazuela", "senda",
+}
+PARTICLES = {"de", "del", "la", "las", "los", "el", "d", "l"}
+NOISE = {"madrid", "espana", "spain", "n", "no", "num", "nº"}
+# words after the street that do not name a place (premises, region)
+PLACE_NOISE = NOISE | PARTICLES | {
+    "comunidad", "provincia", "planta", "piso", "bajo", "local", "oficina", "oficinas", "izda", "dcha",
+    "izquierda", "derecha", "bis", "edificio", "esc", "escalera", "puerta",
+}
+MADRID_DISTRICTS = {
+    "centro", "arganzuela", "retiro", "salamanca", "chamartin", "tetuan", "chamberi", "fuencarral pardo",
+    "moncloa aravaca", "latina", "carabanchel", "usera", "puente vallecas", "moratalaz", "ciudad lineal",
+    "hortaleza", "villaverde", "villa vallecas", "vicalvaro", "san blas canillejas", "barajas",
+}
+MADRID_POSTCODES = range(28001, 28056)
+
+RE_NUMBER = re.compile(r"(?:^|[\s,])(?:n[ºo°\.]?\s*)?(\d{1,4})(?:\s*[a-z](?![a-z]))?(?=$|[\s,\-])", re.I)
+RE_POSTCODE = re.compile(r"\b28\d{3}\b")
+RE_COORD_PART = re.compile(r"\d+(?:[.,]\d+)?")
+RE_COORD_NEG = re.compile(r"[WwSsOo]\s*$")
+RE_WORD = re.compile(r"[a-z0-9]+")
+RE_LEADING_INT = re.compile(r"\s*(\d+)")
+INDEX_VERSION = 1
+
+def street_key(s: str) -> str:
+    words = RE_WORD.findall(fold_accents(s).replace("ñ", "n"))
+    while words and words[0] in STREET_TYPES:
+        words = words[1:]
+    return " ".join(w for w in words if w not in PARTICLES and w not in NOISE)
+
+def _split(address: str) -> tuple[str, int | None, str]:
+    # (street, number, rest of the address after them), postcodes removed
+    s = RE_POSTCODE.sub(" ", address or "")
+    first, sep, rest = s.partition(",")
+    if re.search(r"\d", first):
+        s, tail = first, sep + rest
+    else:
+        tail = ""
+    m = RE_NUMBER.search(s)
+    if not m:
+        return s.split(",")[0].strip(), None, s.partition(",")[2] + tail
+    return s[: m.start()].strip(" ,"), int(m.group(1)), s[m.end():] + tail
+
+def split_address(address: str) -> tuple[str, int | None]:
+    """
+    "Calle de Serrano 21, 28001 Madrid" -> ("Calle de Serrano", 21)
+    """
+    street, number, _ = _split(address)
+    return street, number
+
+def names_other_place(address: str) -> bool:
+    """
+    True if the address names a municipality other than Madrid: "Calle Mayor 1, Alcalá de Henares"
+    or a postcode outside the city. Madrid district names and premises ("3º izda") are fine.
+    """
+    if any(int(code) not in MADRID_POSTCODES for code in RE_POSTCODE.findall(address or "")):
+        return True
+    for segment in _split(address)[2].split(","):
+        if re.search(r"\d", segment):
+            continue
+        words = [w for w in RE_WORD.findall(fold_accents(segment).replace("ñ", "n")) if w not in PLACE_NOISE]
+        if words and " ".join(words) not in MADRID_DISTRICTS:
+            return True
+    return False
+
+def _parse_coord(v: str) -> float | None:
+    if v is None:
+        return None
+    s = str(v).strip()
+    if not s:
+        return None
+    try:
+        return float(s.replace(",", "."))
+    except ValueError:
+        pass
+    parts = RE_COORD_PART.findall(s.replace(",", "."))
+    if not parts:
+        return None
+    nums = [float(p) for p in parts[:3]] + [0.0, 0.0]
+    val = nums[0] + nums[1] / 60.0 + nums[2] / 3600.0
+    return -val if RE_COORD_NEG.search(s) or s.startswith("-") else val
+
+def _trigrams(key: str) -> set[str]:
+    k = f"  {key} "
+    return {k[i:i + 3] for i in range(len(k) - 2)}
+
+class Street:
+    __slots__ = ("name", "numbers")
+
+    def __init__(self, name: str):
+        self.name = name
+        # parity (0 even / 1 odd) -> sorted list of (number, lat, lon)
+        self.numbers: dict[int, list[tuple[int, float, float]]] = {0: [], 1: []}
+
+    def locate(self, number: int | None) -> tuple[float, float, str]:
+        if number is None:
+            pts = self.numbers[0] + self.numbers[1]
+            mid = sorted(pts)[len(pts) // 2]
+            return mid[1], mid[2], "street"
+        side = self.numbers[number % 2] or self.numbers[1 - number % 2]
+        i = bisect.bisect_left(side, (number, -1e9, -1e9))
+        if i < len(side) and side[i][0] == number:
+            return side[i][1], side[i][2], "exact"
+        if 0 < i < len(side):
+            (n0, la0, lo0), (n1, la1, lo1) = side[i - 1], side[i]
+            t = (number - n0) / (n1 - n0)
+            return la0 + t * (la1 - la0), lo0 + t * (lo1 - lo0), "interpolated"
+        n, la, lo = side[0] if i == 0 else side[-1]
+        return la, lo, "nearest_number"
+
+class Gazetteer:
+    def __init__(self, streets: dict[str, Street]):
+        self.streets = {k: v for k, v in streets.items() if v.numbers[0] or v.numbers[1]}
+        self.keys = sorted(self.streets)
+        self.trigram_index: dict[str, list[str]] = {}
+        for k in self.keys:
+            for g in _trigrams(k):
+                self.trigram_index.setdefault(g, []).append(k)
+        # trigrams shared by this many streets ("cal", " sa") do not help to shortlist
+        self.common_trigram = max(50, len(self.keys) // 20)
+
+    @classmethod
+    def from_rows(cls, rows) -> "Gazetteer":
+        streets: dict[str, Street] = {}
+        keys: dict[str, str] = {}  # raw name -> key (every portal repeats its street name)
+        for r in rows:
+            key = keys.get(r["name"])
+            if key is None:
+                key = keys[r["name"]] = street_key(r["name"])
+            if not key or r["lat"] is None or r["lon"] is None:
+                continue
+            st = streets.get(key)
+            if st is None:
+                st = streets[key] = Street(r["name"])
+            if r["number"] is not None:
+                st.numbers[r["number"] % 2].append((r["number"], r["lat"], r["lon"]))
+        for st in streets.values():
+            for side in st.numbers.values():
+                side.sort()
+        return cls(streets)
+
+    def to_json(self) -> dict:
+        return {
+            "version": INDEX_VERSION,
+            "streets": {k: [st.name, st.numbers[0], st.numbers[1]] for k, st in self.streets.items()},
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Gazetteer":
+        streets = {}
+        for k, (name, even, odd) in data["streets"].items():
+            st = streets[k] = Street(name)
+            st.numbers[0] = [tuple(p) for p in even]
+            st.numbers[1] = [tuple(p) for p in odd]
+        return cls(streets)
+
+    def __len__(self):
+        return len(self.streets)
+
+    def _prefix(self, key: str) -> str | None:
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i].startswith(key):
+            return self.keys[i]
+        return None
+
+    def _fuzzy(self, key: str, cutoff: float = 0.8) -> str | None:
+        counts: dict[str, int] = {}
+        grams = [self.trigram_index.get(g, ()) for g in _trigrams(key)]
+        rare = [p for p in grams if len(p) <= self.common_trigram]
+        for posting in rare or grams:
+            for k in posting:
+                counts[k] = counts.get(k, 0) + 1
+        shortlist = sorted(counts, key=counts.get, reverse=True)[:15]
+        best = difflib.get_close_matches(key, shortlist, n=1, cutoff=cutoff)
+        return best[0] if best else None
+
+    def find_street(self, street: str) -> tuple[str | None, str]:
+        key = street_key(street)
+        if not key:
+            return None, "none"
+        if key in self.streets:
+            return key, "exact"
+        k = self._prefix(key)
+        if k:
+            return k, "prefix"
+        k = self._fuzzy(key)
+        if k:
+            return k, "fuzzy"
+        return None, "none"
+
+    def geocode(self, address: str) -> dict | None:
+        if names_other_place(address):
+            return None
+        street, number = split_address(address)
+        key, how = self.find_street(street)
+        if key is None:
+            return None
+        st = self.streets[key]
+        lat, lon, num_how = st.locate(number)
+        label = f"{st.name} {number}" if number is not None else st.name
+        return {
+            "ok": True,
+            "lat": lat,
+            "lon": lon,
+            "display_name": f"{label}, Madrid, España",
+            "provider": "callejero",
+            "match": f"{how}/{num_how}",
+        }
+
+def _open_text(path: str):
+    raw = gzip.open(path, "rb").read() if path.endswith(".gz") else open(path, "rb").read()
+    for enc in ("utf-8-sig", "latin-1"):
+        try:
+            return raw.decode(enc)
+        except UnicodeDecodeError:
+            continue
+    return raw.decode("utf-8", errors="ignore")
+
+def read_callejero(path: str):
+    text = _open_text(path)
+    first = text.split("\n", 1)[0]
+    delim = ";" if first.count(";") > first.count(",") else ","
+    reader = csv.DictReader(io.StringIO(text), delimiter=delim)
+    fields = {f.strip(): f for f in (reader.fieldnames or [])}
+    col = {k: next((fields[c] for c in cands if c in fields), None) for k, cands in COLUMNS.items()}
+    if not col["name"] or not col["lat"] or not col["lon"]:
+        raise ValueError(f"Callejero sin columnas de nombre/coordenadas: {list(fields)}")
+    for r in reader:
+        name = " ".join(x for x in [
+            (r.get(col["type"]) or "").strip() if col["type"] else "",
+            (r.get(col["particle"]) or "").strip() if col["particle"] else "",
+            (r.get(col["name"]) or "").strip(),
+        ] if x)
+        num = RE_LEADING_INT.match(r.get(col["number"]) or "") if col["number"] else None
+        yield {
+            "name": name.title(),
+            "number": int(num.group(1)) if num else None,
+            "lat": _parse_coord(r.get(col["lat"])),
+            "lon": _parse_coord(r.get(col["lon"])),
+        }
+
+_GAZ: dict[str, Gazetteer | None] = {}
+_GAZ_LOCK = threading.Lock()
+
+def index_path(path: str) -> str:
+    return (path[:-3] if path.endswith(".gz") else path) + ".index.json.gz"
+
+def build_gazetteer(path: str) -> Gazetteer:
+    """
+    Load the prebuilt index if it is newer than the CSV; otherwise parse the CSV and (re)write it.
+    """
+    ipath = index_path(path)
+    if os.path.exists(ipath) and os.path.getmtime(ipath) >= os.path.getmtime(path):
+        try:
+            with gzip.open(ipath, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                return Gazetteer.from_json(data)
+        except (OSError, ValueError, KeyError):
+            pass
+    gaz = Gazetteer.from_rows(read_callejero(path))
+    try:
+        tmp = ipath + ".tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(gaz.to_json(), f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, ipath)
+    except OSError:
+        pass
+    return gaz
+
+def get_gazetteer(path: str | None = None) -> Gazetteer | None:
+    """
+    Load (once per process) the gazetteer; None if the file is missing or unreadable.
+    """
+    path = path or CALLEJERO_PATH
+    with _GAZ_LOCK:
+        if path not in _GAZ:
+            candidates = [path, path + ".gz"] if not path.endswith(".gz") else [path]
+            _GAZ[path] = None
+            for p in candidates:
+                if os.path.exists(p):
+                    try:
+                        _GAZ[path] = build_gazetteer(p)
+                    except Exception:
+                        _GAZ[path] = None
+                    break
+        return _GAZ[path]
+
+def local_geocode(address: str, approximate: bool = False) -> dict | None:
+    """
+    Gazetteer answer for an exact street match in Madrid; None (use the network providers)
+    for prefix/fuzzy matches, other municipalities or no gazetteer.
+    approximate=True also accepts prefix/fuzzy street matches (`match` says which): the
+    fallback of geocode_address when the network providers fail.
+    """
+    gaz = get_gazetteer()
+    res = gaz.geocode(address) if gaz else None
+    return res if res and (approximate or res["match"].startswith("exact/")) else None
+
+def geocode_listings(listings: list[dict]) -> int:
+    """
+    Fill lat/lon from the listing `location` text for listings without coordinates
+    (offline only; only exact street matches with a house number). Returns how many were located.
+    """
+    gaz = get_gazetteer()
+    if not gaz:
+        return 0
+    n = 0
+    for it in listings:
+        if it.get("lat") is not None and it.get("lon") is not None:
+            continue
+        res = gaz.geocode(it.get("location") or "")
+        if not res or not res["match"].startswith("exact/") or res["match"].endswith("/street"):
+            continue
+        it["lat"], it["lon"] = res["lat"], res["lon"]
+        it["notes"] = (it.get("notes", "") + " | Coordenadas aproximadas (callejero)").strip(" |")
+        n += 1
+    return n
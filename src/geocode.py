@@ -1,6 +1,14 @@
+import atexit
+import json
 import os
+import threading
 import time
-import requests
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .gazetteer import local_geocode
+from .singleflight import SingleFlight
+from .transport import http_get
 
 PHOTON_URL = "https://photon.komoot.io/api"
 NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
@@ -15,10 +23,16 @@ def _contains_madrid(s: str) -> bool:
     s = (s or "").lower()
     return "madrid" in s
 
-def _photon_geocode(address: str) -> dict | None:
+def _photon_geocode(address: str, timeout: float = 20, stop: threading.Event | None = None) -> dict | None:
+    """
+    stop (optional): set when another provider already answered or the deadline passed;
+    the request is then not sent.
+    """
+    if stop is not None and stop.is_set():
+        return None
     try:
         params = {"q": address, "limit": 5, "lang": "es"}
-        r = requests.get(PHOTON_URL, params=params, headers={"User-Agent": _ua()}, timeout=20)
+        r = http_get(PHOTON_URL, params=params, headers={"User-Agent": _ua()}, timeout=timeout)
         r.raise_for_status()
         data = r.json()
         feats = data.get("features") or []
@@ -49,7 +63,42 @@ def _photon_geocode(address: str) -> dict | None:
     except Exception:
         return None
 
-def _nominatim_geocode(address: str) -> dict | None:
+class _RateLimiter:
+    """
+    Process-wide token bucket of one token: request starts are spaced by 1/rate_per_s seconds,
+    whichever thread (hedged variant, retry, batch worker) sends them.
+    """
+
+    def __init__(self, rate_per_s: float):
+        self.interval = 1.0 / rate_per_s
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, stop: threading.Event | None = None) -> bool:
+        """
+        Wait for the next slot. False if stop was set meanwhile (the slot is not reused).
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        delay = slot - now
+        if delay <= 0:
+            return not (stop is not None and stop.is_set())
+        if stop is not None:
+            return not stop.wait(delay)
+        time.sleep(delay)
+        return True
+
+# Nominatim's usage policy: at most 1 request/s from the whole application
+NOMINATIM_LIMITER = _RateLimiter(float(os.getenv("NOMINATIM_RATE_PER_S") or 1.0))
+
+def _nominatim_geocode(address: str, timeout: float = 20, stop: threading.Event | None = None) -> dict | None:
+    """
+    Every request (retries included) takes a NOMINATIM_LIMITER slot first.
+    stop (optional) aborts the wait and the retry loop: set when another provider already
+    answered or the overall deadline passed.
+    """
     params = {
         "q": address,
         "format": "jsonv2",
@@ -63,11 +112,14 @@ def _nominatim_geocode(address: str) -> dict | None:
 
     headers = {"User-Agent": _ua(), "Accept-Language": "es-ES,es;q=0.9,en;q=0.7"}
 
+    pause = stop.wait if stop is not None else time.sleep
     for attempt in range(3):
+        if not NOMINATIM_LIMITER.acquire(stop):
+            return None
         try:
-            r = requests.get(NOMINATIM_URL, params=params, headers=headers, timeout=20)
+            r = http_get(NOMINATIM_URL, params=params, headers=headers, timeout=timeout)
             if r.status_code in (429, 503):
-                time.sleep(1.0 + attempt)
+                pause(1.0 + attempt)
                 continue
             if r.status_code == 403:
                 return None
@@ -93,28 +145,267 @@ def _nominatim_geocode(address: str) -> dict | None:
                 "provider": "nominatim",
             }
         except Exception:
-            time.sleep(0.5 + attempt)
+            pause(0.5 + attempt)
             continue
     return None
 
-def geocode_address(address: str) -> dict:
-    if not address or not address.strip():
-        return {"ok": False, "error": "Dirección vacía"}
-
-    addr = address.strip()
+def _forced_query(addr: str) -> str:
+    return f"{addr}, España" if _contains_madrid(addr) else f"{addr}, Madrid, España"
 
+def _geocode_sequential(addr: str) -> dict:
     res = _photon_geocode(addr) or _nominatim_geocode(addr)
     if res and _contains_madrid(res.get("display_name","")):
         return res
 
     # Force Madrid context and retry
-    if _contains_madrid(addr):
-        forced = f"{addr}, España"
-    else:
-        forced = f"{addr}, Madrid, España"
-
-    res2 = _nominatim_geocode(forced) or _photon_geocode(forced)
+    res2 = _nominatim_geocode(_forced_query(addr)) or _photon_geocode(_forced_query(addr))
     if res2:
         return res2
 
     return {"ok": False, "error": "No se pudo geocodificar en Madrid. Revisa la dirección y/o configura GEOCODER_USER_AGENT."}
+
+
+# Hedged mode: every (provider, query variant) runs concurrently and the first Madrid result wins.
+# Nominatim variants wait for NOMINATIM_LIMITER slots, so the second one starts ~1 s after the first.
+HEDGE_DEADLINE_S = float(os.getenv("GEOCODER_DEADLINE_S") or 8.0)
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="geocode")
+_STATS_LOCK = threading.Lock()
+_PROVIDER_STATS: dict[str, dict] = {}
+_HEDGE_STATS = {"requests": 0, "won": 0, "fallback_non_madrid": 0, "failed": 0, "deadline_hit": 0}
+
+def _record_attempt(variant: str, elapsed: float, res: dict | None, skipped: bool):
+    with _STATS_LOCK:
+        st = _PROVIDER_STATS.setdefault(variant, {
+            "calls": 0, "skipped": 0, "ok": 0, "madrid_ok": 0, "wins": 0, "latencies_ms": deque(maxlen=500),
+        })
+        if skipped:
+            st["skipped"] += 1
+            return
+        st["calls"] += 1
+        st["latencies_ms"].append(elapsed * 1000.0)
+        if res:
+            st["ok"] += 1
+            st["madrid_ok"] += int(_contains_madrid(res.get("display_name", "")))
+
+def _pct(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    v = sorted(values)
+    return round(v[min(int(q * len(v)), len(v) - 1)], 1)
+
+def geocoder_stats() -> dict:
+    """
+    Hedged-mode counters plus per (provider, variant) latency percentiles and win rates.
+    Late answers (after a winner or the deadline) still count towards latency.
+    """
+    with _STATS_LOCK:
+        hedged = dict(_HEDGE_STATS)
+        providers = {}
+        for variant, st in _PROVIDER_STATS.items():
+            lat = list(st["latencies_ms"])
+            providers[variant] = {
+                "calls": st["calls"],
+                "skipped": st["skipped"],
+                "ok": st["ok"],
+                "madrid_ok": st["madrid_ok"],
+                "wins": st["wins"],
+                "win_rate": round(st["wins"] / hedged["requests"], 3) if hedged["requests"] else None,
+                "p50_ms": _pct(lat, 0.50),
+                "p95_ms": _pct(lat, 0.95),
+            }
+    return {"hedged": hedged, "providers": providers, "single_flight": _GEOCODE_FLIGHT.stats()}
+
+def _attempt(variant: str, fn, query: str, start_delay: float, deadline: float, stop: threading.Event):
+    if start_delay and stop.wait(start_delay):
+        _record_attempt(variant, 0.0, None, skipped=True)
+        return variant, None
+    remaining = deadline - time.monotonic()
+    if stop.is_set() or remaining <= 0:
+        _record_attempt(variant, 0.0, None, skipped=True)
+        return variant, None
+    t0 = time.monotonic()
+    res = fn(query, timeout=max(remaining, 0.5), stop=stop)
+    _record_attempt(variant, time.monotonic() - t0, res, skipped=False)
+    return variant, res
+
+def _geocode_hedged(addr: str, deadline_s: float) -> dict:
+    forced = _forced_query(addr)
+    plan = [
+        ("photon", _photon_geocode, addr, 0.0),
+        ("photon+madrid", _photon_geocode, forced, 0.0),
+        ("nominatim", _nominatim_geocode, addr, 0.0),
+        ("nominatim+madrid", _nominatim_geocode, forced, 0.0),
+    ]
+    deadline = time.monotonic() + deadline_s
+    stop = threading.Event()
+    pending = {_EXECUTOR.submit(_attempt, v, fn, q, delay, deadline, stop) for v, fn, q, delay in plan}
+    fallback = None
+    winner = None
+    try:
+        while pending and winner is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for fut in done:
+                variant, res = fut.result()
+                if not res:
+                    continue
+                if _contains_madrid(res.get("display_name", "")):
+                    winner = (variant, res)
+                    break
+                # like the sequential mode, a forced-query answer is better than a plain non-Madrid one
+                if fallback is None or variant.endswith("+madrid"):
+                    fallback = (variant, res)
+    finally:
+        # queued/staggered attempts never start; running ones stop retrying and their answer is ignored
+        stop.set()
+        for fut in pending:
+            fut.cancel()
+
+    with _STATS_LOCK:
+        _HEDGE_STATS["requests"] += 1
+        if winner is None and pending:
+            _HEDGE_STATS["deadline_hit"] += 1
+        chosen = winner or fallback
+        if chosen:
+            _PROVIDER_STATS[chosen[0]]["wins"] += 1
+            _HEDGE_STATS["won" if winner else "fallback_non_madrid"] += 1
+        else:
+            _HEDGE_STATS["failed"] += 1
+    if chosen:
+        return dict(chosen[1], variant=chosen[0])
+    return {"ok": False, "error": "No se pudo geocodificar en Madrid a tiempo. Revisa la dirección y/o configura GEOCODER_USER_AGENT."}
+
+def geocode_address(address: str, hedged: bool | None = None, deadline_s: float | None = None) -> dict:
+    """
+    Local street gazetteer first (exact street matches), then the network providers; when
+    those fail, a prefix/fuzzy gazetteer match is better than nothing.
+    hedged (default: env GEOCODER_MODE != "sequential") queries Photon and Nominatim, plain and
+    Madrid-forced, concurrently and returns the first Madrid result within deadline_s
+    (default env GEOCODER_DEADLINE_S or 8 s). The sequential mode is the original
+    Photon -> Nominatim -> forced retry chain.
+    """
+    if not address or not address.strip():
+        return {"ok": False, "error": "Dirección vacía"}
+
+    addr = address.strip()
+
+    # Offline street gazetteer first; the network providers are only a fallback
+    res = local_geocode(addr)
+    if res:
+        return res
+
+    if hedged is None:
+        hedged = (os.getenv("GEOCODER_MODE") or "hedged").lower() != "sequential"
+    if hedged:
+        res = _geocode_hedged(addr, deadline_s or HEDGE_DEADLINE_S)
+    else:
+        res = _geocode_sequential(addr)
+    if not res.get("ok"):
+        return local_geocode(addr, approximate=True) or res
+    return res
+
+
+# Process-wide geocode cache (normalized address -> result), optionally persisted as JSON
+_CACHE: dict[str, dict] = {}
+_CACHE_FILES_LOADED: set[str] = set()
+# cache file -> keys it holds: entries read from it plus those looked up with it
+_CACHE_FILE_KEYS: dict[str, set[str]] = {}
+_CACHE_LOCK = threading.Lock()
+# cache files with unsaved entries -> last save time; a miss rewrites the file at most every
+# CACHE_FLUSH_S seconds, the rest is written by flush_geocode_cache (and at exit)
+_CACHE_DIRTY: dict[str, float] = {}
+_CACHE_SAVED_AT: dict[str, float] = {}
+CACHE_FLUSH_S = float(os.getenv("GEOCODE_CACHE_FLUSH_S") or 30)
+# identical geocodes in flight at the same time (several sessions/clients) share one lookup
+_GEOCODE_FLIGHT = SingleFlight()
+
+def _cache_key(address: str) -> str:
+    return " ".join((address or "").strip().lower().split())
+
+def _load_cache_file(cache_path: str):
+    if cache_path in _CACHE_FILES_LOADED:
+        return
+    _CACHE_FILES_LOADED.add(cache_path)
+    if not os.path.exists(cache_path):
+        return
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            _CACHE.update(data)
+            _CACHE_FILE_KEYS.setdefault(cache_path, set()).update(data)
+    except Exception:
+        pass
+
+def _save_cache_file(cache_path: str):
+    entries = {k: _CACHE[k] for k in sorted(_CACHE_FILE_KEYS.get(cache_path, ())) if k in _CACHE}
+    tmp = cache_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False)
+    os.replace(tmp, cache_path)
+
+def _mark_dirty(cache_path: str, key: str) -> bool:
+    """
+    Add key to cache_path's entries (caller holds _CACHE_LOCK). True when a rewrite is due.
+    """
+    _CACHE_FILE_KEYS.setdefault(cache_path, set()).add(key)
+    _CACHE_DIRTY[cache_path] = time.monotonic()
+    saved = _CACHE_SAVED_AT.get(cache_path)
+    return saved is None or time.monotonic() - saved >= CACHE_FLUSH_S
+
+def flush_geocode_cache(cache_path: str | None = None):
+    """
+    Write unsaved entries to cache_path (default: every cache file with unsaved entries).
+    """
+    with _CACHE_LOCK:
+        for path in [cache_path] if cache_path else list(_CACHE_DIRTY):
+            if path not in _CACHE_DIRTY:
+                continue
+            try:
+                _save_cache_file(path)
+            except Exception:
+                continue
+            _CACHE_DIRTY.pop(path, None)
+            _CACHE_SAVED_AT[path] = time.monotonic()
+
+atexit.register(flush_geocode_cache)
+
+def geocode_address_cached(address: str, cache_path: str | None = None) -> dict:
+    """
+    Same as geocode_address but memoized per normalized address.
+    Only successful results are cached (without the bulky provider payload).
+    If cache_path is given the cache is loaded from / written to that JSON file, which holds only
+    its own entries (the ones read from it or looked up with it, hits from another file included);
+    the file is rewritten at most every CACHE_FLUSH_S seconds, call flush_geocode_cache() at the
+    end of a batch.
+    Concurrent misses for the same address are coalesced into one lookup (coalesced=True
+    on the callers that waited).
+    """
+    key = _cache_key(address)
+    due = False
+    with _CACHE_LOCK:
+        if cache_path:
+            _load_cache_file(cache_path)
+        hit = _CACHE.get(key)
+        if hit is not None and cache_path and key not in _CACHE_FILE_KEYS.get(cache_path, ()):
+            due = _mark_dirty(cache_path, key)
+    if hit is not None:
+        if due:
+            flush_geocode_cache(cache_path)
+        return dict(hit, cached=True)
+
+    res, shared = _GEOCODE_FLIGHT.do(key, geocode_address, address)
+    if shared:
+        return dict(res, coalesced=True)
+    if res.get("ok"):
+        slim = {k: v for k, v in res.items() if k != "raw"}
+        with _CACHE_LOCK:
+            _CACHE[key] = slim
+            if cache_path:
+                due = _mark_dirty(cache_path, key)
+        if due:
+            flush_geocode_cache(cache_path)
+    return res
@@ -0,0 +1,296 @@
+"""
+Append-only rent history across crawls.
+
+Each crawl is compared with the last known state of every canonical URL and only the fields
+that changed are appended, so storage grows with changes, not with the number of crawls.
+
+SQLite (stdlib) layout:
+    listings  one row per canonical URL: current state (for diffing), district, grid cell,
+              first/last seen
+    changes   (listing_id, ts, seq) -> delta, WITHOUT ROWID so rows are clustered per listing in
+              time order; indexes on (district, ts) and (cell, ts) give the per-district and
+              per-cell time-ordered scans
+    crawls    one row per recorded crawl
+
+Deltas are compact JSON with one-letter keys (FIELD_CODES); a field that disappeared is
+stored as null and "x": 1 marks a listing delisted: its page answered 404/410 (GONE_STATUSES).
+A listing merely missing from a crawl (blocked, timed out, source truncated or not discovered)
+keeps its last state.
+A listing that moves to another district or grid cell also gets an exit row ("m": 1, seq 0)
+tagged with its old district/cell, so that scan stops counting it; the regular delta (seq 1)
+is tagged with the new ones and repeats the rent.
+In memory by default; with a path (or env RENT_HISTORY_PATH) it persists across runs.
+"""
+import json
+import math
+import os
+import sqlite3
+import statistics
+import threading
+import time
+from datetime import datetime, timezone
+
+from .utils import canonical_url, to_float
+
+FIELD_CODES = {
+    "rent_eur_m2_month": "r",
+    "area_m2": "a",
+    "available_from": "v",
+    "community_eur_month": "c",
+    "ibi_eur_month": "i",
+    "building_name": "n",
+    "location": "l",
+    "district": "d",
+    "barrio": "b",
+    "lat": "y",
+    "lon": "o",
+}
+CODE_FIELDS = {v: k for k, v in FIELD_CODES.items()}
+DELISTED = "x"
+MOVED_OUT = "m"
+NUMERIC = {"rent_eur_m2_month", "area_m2", "community_eur_month", "ibi_eur_month", "lat", "lon"}
+CELL_DEG = 0.01  # same grid as MarketStats
+GONE_STATUSES = ("http_404", "http_410")  # frontier statuses that mean the listing was removed
+
+def _value(field: str, v):
+    if v in (None, "", "N/D"):
+        return None
+    if field in NUMERIC:
+        f = to_float(v)
+        return round(f, 6 if field in ("lat", "lon") else 2) if f is not None else None
+    return str(v)
+
+def _state(it: dict) -> dict:
+    return {code: val for field, code in FIELD_CODES.items() if (val := _value(field, it.get(field))) is not None}
+
+def _cell(lat, lon) -> str | None:
+    if lat is None or lon is None:
+        return None
+    return f"{math.floor(lat / CELL_DEG)}:{math.floor(lon / CELL_DEG)}"
+
+def _month(ts: int) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m")
+
+class RentHistory:
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self.db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS listings (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL UNIQUE,
+                state TEXT NOT NULL,
+                district TEXT,
+                cell TEXT,
+                first_seen INTEGER NOT NULL,
+                last_seen INTEGER NOT NULL,
+                delisted INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS changes (
+                listing_id INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                district TEXT,
+                cell TEXT,
+                delta TEXT NOT NULL,
+                PRIMARY KEY (listing_id, ts, seq)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS changes_district ON changes (district, ts);
+            CREATE INDEX IF NOT EXISTS changes_cell ON changes (cell, ts);
+            CREATE TABLE IF NOT EXISTS crawls (
+                ts INTEGER PRIMARY KEY,
+                seen INTEGER NOT NULL,
+                changed INTEGER NOT NULL,
+                delisted INTEGER NOT NULL
+            );
+        """)
+
+    @staticmethod
+    def _append(cur, lid: int, ts: int, district, cell, delta: dict, seq: int = 1):
+        # two recordings in the same second fold into one change row
+        row = cur.execute("SELECT delta FROM changes WHERE listing_id = ? AND ts = ? AND seq = ?",
+                          (lid, ts, seq)).fetchone()
+        if row is not None:
+            delta = dict(json.loads(row[0]), **delta)
+        cur.execute(
+            "INSERT OR REPLACE INTO changes (listing_id, ts, seq, district, cell, delta) VALUES (?, ?, ?, ?, ?, ?)",
+            (lid, ts, seq, district, cell, json.dumps(delta, separators=(",", ":"))),
+        )
+
+    def record(self, listings: list[dict], ts: int | None = None, gone=()) -> dict:
+        """
+        Append the deltas of one crawl (ts: epoch seconds, default now). gone: URLs whose page
+        answered 404/410 in this crawl (search diag["gone_urls"]); known ones are marked delisted.
+        Returns counters: seen, new, changed, unchanged, delisted.
+        """
+        ts = int(time.time()) if ts is None else int(ts)
+        gone = {u for u in (canonical_url(g) for g in gone) if u}
+        latest: dict[str, dict] = {}
+        for it in listings:
+            u = canonical_url(it.get("source_url") or "")
+            if u and u not in gone:  # a snippet-only item of a removed page is not a sighting
+                latest[u] = it
+        counts = {"seen": len(latest), "new": 0, "changed": 0, "unchanged": 0, "delisted": 0}
+        with self._lock:
+            cur = self.db.cursor()
+            for u, it in latest.items():
+                state = _state(it)
+                district = state.get("d")
+                cell = _cell(state.get("y"), state.get("o"))
+                row = cur.execute("SELECT id, state, delisted, district, cell FROM listings WHERE url = ?",
+                                  (u,)).fetchone()
+                if row is None:
+                    cur.execute(
+                        "INSERT INTO listings (url, state, district, cell, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?)",
+                        (u, json.dumps(state, separators=(",", ":")), district, cell, ts, ts),
+                    )
+                    delta = state
+                    lid = cur.lastrowid
+                    counts["new"] += 1
+                else:
+                    lid, old_json, was_delisted, old_district, old_cell = row
+                    old = json.loads(old_json)
+                    delta = {k: v for k, v in state.items() if old.get(k) != v}
+                    delta.update({k: None for k in old if k not in state})
+                    moved = (old_district, old_cell) != (district, cell)
+                    if moved and not was_delisted:
+                        # leave the old district/cell scans before entering the new ones
+                        self._append(cur, lid, ts, old_district, old_cell, {MOVED_OUT: 1}, seq=0)
+                    if was_delisted:
+                        delta[DELISTED] = 0
+                    if "r" in state and (moved or was_delisted):
+                        # back in a district/cell scan: repeat the rent so that scan sees it
+                        delta["r"] = state["r"]
+                    if delta:
+                        cur.execute(
+                            "UPDATE listings SET state = ?, district = ?, cell = ?, last_seen = ?, delisted = 0 WHERE id = ?",
+                            (json.dumps(state, separators=(",", ":")), district, cell, ts, lid),
+                        )
+                        counts["changed"] += 1
+                    else:
+                        cur.execute("UPDATE listings SET last_seen = ? WHERE id = ?", (ts, lid))
+                        counts["unchanged"] += 1
+                if delta:
+                    self._append(cur, lid, ts, district, cell, delta)
+            for u in gone:
+                row = cur.execute("SELECT id, district, cell FROM listings WHERE url = ? AND delisted = 0",
+                                  (u,)).fetchone()
+                if row is None:
+                    continue
+                lid, district, cell = row
+                cur.execute("UPDATE listings SET delisted = 1 WHERE id = ?", (lid,))
+                self._append(cur, lid, ts, district, cell, {DELISTED: 1})
+                counts["delisted"] += 1
+            cur.execute("INSERT OR REPLACE INTO crawls (ts, seen, changed, delisted) VALUES (?, ?, ?, ?)",
+                        (ts, counts["seen"], counts["new"] + counts["changed"], counts["delisted"]))
+            self.db.commit()
+        return counts
+
+    def listing_history(self, url: str) -> list[dict]:
+        """
+        States of one listing after each change, oldest first: {"ts", "changed": [...fields], **fields}.
+        """
+        with self._lock:
+            row = self.db.execute("SELECT id FROM listings WHERE url = ?", (canonical_url(url),)).fetchone()
+            if row is None:
+                return []
+            rows = self.db.execute("SELECT ts, delta FROM changes WHERE listing_id = ? AND seq = 1 ORDER BY ts",
+                                   (row[0],)).fetchall()
+        out, state = [], {}
+        for ts, delta_json in rows:
+            delta = json.loads(delta_json)
+            for k, v in delta.items():
+                if v is None:
+                    state.pop(k, None)
+                else:
+                    state[k] = v
+            out.append(dict(
+                {CODE_FIELDS[k]: v for k, v in state.items() if k in CODE_FIELDS},
+                ts=ts,
+                delisted=bool(state.get(DELISTED)),
+                changed=[CODE_FIELDS.get(k, "delisted") for k in delta],
+            ))
+        return out
+
+    def rent_trend(self, url: str) -> list[tuple[str, float | None]]:
+        """
+        (date, €/m²/month) each time the asking rent of this listing changed.
+        """
+        return [
+            (datetime.fromtimestamp(h["ts"], tz=timezone.utc).date().isoformat(), h.get("rent_eur_m2_month"))
+            for h in self.listing_history(url)
+            if "rent_eur_m2_month" in h["changed"]
+        ]
+
+    def _monthly_median(self, column: str, key: str) -> list[dict]:
+        # carry each listing's last known rent forward through the months (until delisted)
+        with self._lock:
+            rows = self.db.execute(
+                f"SELECT listing_id, ts, delta FROM changes WHERE {column} = ? ORDER BY ts, seq", (key,)
+            ).fetchall()
+        if not rows:
+            return []
+        current: dict[int, float] = {}
+        out = []
+        month = _month(rows[0][1])
+        for lid, ts, delta_json in rows + [(None, None, None)]:
+            m = _month(ts) if ts is not None else None
+            if m != month:
+                rents = list(current.values())
+                out.append({
+                    "month": month,
+                    "listings": len(rents),
+                    "median_rent_eur_m2_month": round(statistics.median(rents), 2) if rents else None,
+                })
+                month = m
+            if lid is None:
+                break
+            delta = json.loads(delta_json)
+            if delta.get(DELISTED) or delta.get(MOVED_OUT):
+                current.pop(lid, None)
+            elif "r" in delta:
+                if delta["r"] is None:
+                    current.pop(lid, None)
+                else:
+                    current[lid] = delta["r"]
+        return out
+
+    def district_rent_by_month(self, district: str) -> list[dict]:
+        """
+        Median asking €/m²/month per month over listings recorded in this district.
+        Months without changes carry no row; the value holds until the next month listed.
+        """
+        return self._monthly_median("district", district)
+
+    def cell_rent_by_month(self, lat: float, lon: float) -> list[dict]:
+        """
+        Same as district_rent_by_month for the ~1 km grid cell (MarketStats grid) containing lat/lon.
+        """
+        return self._monthly_median("cell", _cell(lat, lon))
+
+    def stats(self) -> dict:
+        with self._lock:
+            listings = self.db.execute("SELECT COUNT(*) FROM listings").fetchone()[0]
+            changes = self.db.execute("SELECT COUNT(*) FROM changes").fetchone()[0]
+            crawls = self.db.execute("SELECT COUNT(*) FROM crawls").fetchone()[0]
+        return {"path": self.path, "listings": listings, "changes": changes, "crawls": crawls}
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+_default: RentHistory | None = None
+_default_lock = threading.Lock()
+
+def get_rent_history() -> RentHistory:
+    """
+    Process-wide history (persistent if env RENT_HISTORY_PATH is set).
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = RentHistory(os.getenv("RENT_HISTORY_PATH") or None)
+        return _default
@@ -0,0 +1,180 @@
+import heapq
+import math
+
+from .utils import haversine_km, deduplicate_listings, fold_accents, listing_filter, zone_text
+
+KM_PER_DEG_LAT = 111.32
+
+class ListingIndex:
+    """
+    Grid-bucket spatial index over deduplicated listings.
+    Built once per crawl and shared by every query (top-N and radius).
+    Listings without coordinates are kept apart and only used to pad top-N results,
+    the same way the app sorts them after the located ones.
+    Listings carrying `district`/`barrio` columns are also indexed by zone name; zone queries
+    return exactly the listings the district filter of utils.listing_filter accepts
+    (exact names through by_zone, free text through a substring scan).
+    """
+
+    def __init__(self, listings: list[dict], cell_deg: float = 0.01):
+        self.cell_deg = cell_deg
+        self.listings = deduplicate_listings(list(listings))
+        self.cells: dict[tuple[int, int], list[int]] = {}
+        self.no_coords: list[int] = []
+        self.by_zone: dict[str, list[int]] = {}
+        self.unzoned: list[int] = []  # neither district nor barrio: zone matches use the location
+        self._zone_texts: list[str] | None = None
+        self._zone_members: dict[tuple[str, bool], tuple[list[int], list[int]]] = {}
+        for i, it in enumerate(self.listings):
+            for col in ("district", "barrio"):
+                if it.get(col):
+                    self.by_zone.setdefault(fold_accents(it[col]), []).append(i)
+            if not (it.get("district") or it.get("barrio")):
+                self.unzoned.append(i)
+            lat, lon = it.get("lat"), it.get("lon")
+            if lat is None or lon is None:
+                self.no_coords.append(i)
+                continue
+            self.cells.setdefault(self._cell(lat, lon), []).append(i)
+        self.no_coords.sort(key=lambda i: -self.listings[i].get("score", 0))
+        if self.cells:
+            rows = [c[0] for c in self.cells]
+            cols = [c[1] for c in self.cells]
+            self._bounds = (min(rows), max(rows), min(cols), max(cols))
+        else:
+            self._bounds = None
+
+    def __len__(self):
+        return len(self.listings)
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def _cell_km(self, lat: float) -> float:
+        # smallest side of a cell around this latitude
+        return self.cell_deg * KM_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01)
+
+    def _ring(self, ci: int, cj: int, r: int):
+        if r == 0:
+            yield (ci, cj)
+            return
+        for dj in range(-r, r + 1):
+            yield (ci - r, cj + dj)
+            yield (ci + r, cj + dj)
+        for di in range(-r + 1, r):
+            yield (ci + di, cj - r)
+            yield (ci + di, cj + r)
+
+    def _max_ring(self, ci: int, cj: int) -> int:
+        if self._bounds is None:
+            return -1
+        i0, i1, j0, j1 = self._bounds
+        return max(abs(ci - i0), abs(ci - i1), abs(cj - j0), abs(cj - j1))
+
+    def _row(self, i: int, dist) -> dict:
+        it = dict(self.listings[i])
+        it["dist_km"] = dist
+        return it
+
+    def in_zone(self, zone: str) -> list[int]:
+        return self.by_zone.get(fold_accents(zone), [])
+
+    def zone_members(self, zone: str, exact: bool = False) -> tuple[list[int], list[int]]:
+        """
+        (located, not located) listings the district filter accepts for this name: with exact
+        (a district/barrio name, see listing_filter zone_exact) the by_zone entry plus the unzoned
+        listings whose location names it; otherwise those whose zone_text contains it.
+        Not located ones are in no_coords order. Memoized per name: the index does not change.
+        """
+        key = fold_accents(zone)
+        members = self._zone_members.get((key, exact))
+        if members is None:
+            if exact:
+                in_location = listing_filter(district_contains=zone, zone_exact=True)
+                hits = set(self.by_zone.get(key, ())) | {i for i in self.unzoned if in_location(self.listings[i])}
+            else:
+                if self._zone_texts is None:
+                    self._zone_texts = [fold_accents(zone_text(it)) for it in self.listings]
+                hits = {i for i, text in enumerate(self._zone_texts) if key in text}
+            located = [i for i in sorted(hits) if self.listings[i].get("lat") is not None
+                       and self.listings[i].get("lon") is not None]
+            members = self._zone_members[(key, exact)] = (located, [i for i in self.no_coords if i in hits])
+        return members
+
+    def _zone_rows(self, lat: float, lon: float, zone: str, exact: bool, where=None) -> list[tuple[float, float, int]]:
+        # zone members are few: sort them directly instead of walking the grid
+        rows = []
+        for i in self.zone_members(zone, exact)[0]:
+            it = self.listings[i]
+            if where is not None and not where(it):
+                continue
+            rows.append((haversine_km(lat, lon, it["lat"], it["lon"]), -it.get("score", 0), i))
+        rows.sort()
+        return rows
+
+    def nearest(self, lat: float, lon: float, k: int = 20, zone: str | None = None, where=None,
+                zone_exact: bool = False) -> list[dict]:
+        """
+        k closest listings (copies with dist_km set), padded with listings without
+        coordinates when fewer than k are located.
+        With zone, only zone_members(zone, zone_exact) are considered.
+        where (optional) is a predicate over the stored listing, checked before a listing
+        enters the top-k, so k matching rows come back whenever they exist.
+        """
+        k = int(k)
+        if k <= 0:
+            return []
+        if zone:
+            out = [self._row(i, d) for d, _, i in self._zone_rows(lat, lon, zone, zone_exact, where)[:k]]
+            for i in self.zone_members(zone, zone_exact)[1]:
+                if len(out) >= k:
+                    break
+                if where is None or where(self.listings[i]):
+                    out.append(self._row(i, None))
+            return out
+        ci, cj = self._cell(lat, lon)
+        cell_km = self._cell_km(lat)
+        heap: list[tuple[float, float, int]] = []  # max-heap via negated distance
+        for r in range(self._max_ring(ci, cj) + 1):
+            for c in self._ring(ci, cj, r):
+                for i in self.cells.get(c, ()):
+                    if where is not None and not where(self.listings[i]):
+                        continue
+                    d = haversine_km(lat, lon, self.listings[i]["lat"], self.listings[i]["lon"])
+                    entry = (-d, self.listings[i].get("score", 0), -i)
+                    if len(heap) < k:
+                        heapq.heappush(heap, entry)
+                    elif entry > heap[0]:
+                        heapq.heapreplace(heap, entry)
+            # every cell beyond ring r is at least r * cell_km away
+            if len(heap) >= k and -heap[0][0] <= r * cell_km:
+                break
+        found = sorted(((-d, -s, -i) for d, s, i in heap))
+        out = [self._row(i, d) for d, _, i in found]
+        for i in self.no_coords:
+            if len(out) >= k:
+                break
+            if where is None or where(self.listings[i]):
+                out.append(self._row(i, None))
+        return out
+
+    def within(self, lat: float, lon: float, radius_km: float, limit: int | None = None, zone: str | None = None,
+               where=None, zone_exact: bool = False) -> list[dict]:
+        """
+        Listings within radius_km sorted by distance (copies with dist_km set).
+        zone, where: as in nearest(); limit keeps the closest matches with a heap.
+        """
+        if zone:
+            hits = [h for h in self._zone_rows(lat, lon, zone, zone_exact, where) if h[0] <= float(radius_km)]
+            return [self._row(i, d) for d, _, i in hits[: limit if limit is not None else None]]
+        ci, cj = self._cell(lat, lon)
+        rings = min(int(math.ceil(float(radius_km) / self._cell_km(lat))) + 1, self._max_ring(ci, cj))
+        hits = []
+        for r in range(rings + 1):
+            for c in self._ring(ci, cj, r):
+                for i in self.cells.get(c, ()):
+                    d = haversine_km(lat, lon, self.listings[i]["lat"], self.listings[i]["lon"])
+                    if d <= float(radius_km) and (where is None or where(self.listings[i])):
+                        hits.append((d, -self.listings[i].get("score", 0), i))
+        hits = heapq.nsmallest(int(limit), hits) if limit is not None else sorted(hits)
+        return [self._row(i, d) for d, _, i in hits]
@@ -0,0 +1,183 @@
+import json
+import math
+import statistics
+
+from .utils import to_float
+
+MAP_MODES = ["Clusters", "Hexágonos", "Heatmap €/m²", "Puntos"]
+MAX_POINTS = 2000
+MAX_PAYLOAD_BYTES = 200_000
+M_PER_DEG = 111_320.0
+HEX_SIZE_FACTOR = math.sqrt(2 / (3 * math.sqrt(3)))
+
+# deck.gl expressions (evaluated in the browser) so colors are not shipped per row
+RENT_COLOR = "r < 0 ? [150, 150, 150, 140] : [255, 230 - r * 6, 40, 170]"
+# tooltip templates cannot branch on r: build_layers adds the rent text as column "rt"
+MAP_TOOLTIP = {"text": "{n} oferta(s) · {rt}"}
+
+def rent_label(r) -> str:
+    """
+    Tooltip text for a median rent (None or the -1 "no rent" marker -> N/D).
+    """
+    r = to_float(r)
+    return f"mediana {r:.1f} €/m²/mes" if r is not None and r >= 0 else "renta N/D"
+
+def cluster_cell_deg(zoom: float, cluster_px: int = 60) -> float:
+    """
+    Cell size in degrees so that one cluster covers ~cluster_px screen pixels at this zoom.
+    """
+    return cluster_px * 360.0 / (256.0 * 2 ** float(zoom))
+
+def _located(listings):
+    for it in listings:
+        lat, lon = it.get("lat"), it.get("lon")
+        if lat is not None and lon is not None:
+            yield float(lat), float(lon), to_float(it.get("rent_eur_m2_month"))
+
+def _columns(groups: dict) -> dict[str, list]:
+    """
+    groups: key -> (lat_sum, lon_sum, n, [rents]). Returns compact columns: lat, lon, n, r (median rent, -1 if none).
+    """
+    cols = {"lat": [], "lon": [], "n": [], "r": []}
+    for lat_s, lon_s, n, rents in groups.values():
+        cols["lat"].append(round(lat_s / n, 5))
+        cols["lon"].append(round(lon_s / n, 5))
+        cols["n"].append(n)
+        cols["r"].append(round(statistics.median(rents), 1) if rents else -1)
+    return cols
+
+def _add(groups, key, lat, lon, rent):
+    g = groups.get(key)
+    if g is None:
+        g = groups[key] = [0.0, 0.0, 0, []]
+    g[0] += lat
+    g[1] += lon
+    g[2] += 1
+    if rent is not None:
+        g[3].append(rent)
+
+def grid_bins(listings, cell_deg: float) -> dict[str, list]:
+    """
+    Square-grid aggregation; each bin is placed at the centroid of its members.
+    """
+    groups = {}
+    for lat, lon, rent in _located(listings):
+        _add(groups, (math.floor(lat / cell_deg), math.floor(lon / cell_deg)), lat, lon, rent)
+    return _columns(groups)
+
+def hex_bins(listings, size_deg: float, ref_lat: float = 40.42) -> dict[str, list]:
+    """
+    Pointy-top hexagon aggregation on a local equirectangular projection.
+    Bins are placed at the hexagon center (so they tile without overlap).
+    """
+    kx = math.cos(math.radians(ref_lat))
+    groups = {}
+    for lat, lon, rent in _located(listings):
+        x, y = lon * kx / size_deg, lat / size_deg
+        q = (math.sqrt(3) / 3 * x - y / 3)
+        r = 2.0 / 3 * y
+        # cube rounding
+        cx, cz = q, r
+        cy = -cx - cz
+        rx, ry, rz = round(cx), round(cy), round(cz)
+        dx, dy, dz = abs(rx - cx), abs(ry - cy), abs(rz - cz)
+        if dx > dy and dx > dz:
+            rx = -ry - rz
+        elif dy > dz:
+            ry = -rx - rz
+        else:
+            rz = -rx - ry
+        _add(groups, (rx, rz), lat, lon, rent)
+    cols = _columns(groups)
+    # move each bin to its hexagon center
+    for i, (rx, rz) in enumerate(groups.keys()):
+        cx = size_deg * math.sqrt(3) * (rx + rz / 2.0)
+        cy = size_deg * 1.5 * rz
+        cols["lon"][i] = round(cx / kx, 5)
+        cols["lat"][i] = round(cy, 5)
+    return cols
+
+def point_columns(listings) -> dict[str, list]:
+    cols = {"lat": [], "lon": [], "n": [], "r": []}
+    for lat, lon, rent in _located(listings):
+        cols["lat"].append(round(lat, 5))
+        cols["lon"].append(round(lon, 5))
+        cols["n"].append(1)
+        cols["r"].append(round(rent, 1) if rent is not None else -1)
+    return cols
+
+def payload_bytes(cols: dict[str, list]) -> int:
+    """
+    Size of the layer data as pydeck serializes it (list of records).
+    """
+    n = len(cols.get("lat", []))
+    return len(json.dumps([{k: v[i] for k, v in cols.items()} for i in range(n)], separators=(",", ":")))
+
+def aggregate_for_map(listings, mode: str, zoom: float = 13, max_payload_bytes: int = MAX_PAYLOAD_BYTES) -> tuple[dict, dict]:
+    """
+    Aggregate located listings server-side for the given map mode and zoom.
+    Bins are coarsened (cell size doubled) until the payload fits max_payload_bytes.
+    Returns (columns, info) where info reports mode, bins, points and payload size.
+    """
+    listings = list(listings)
+    n_points = sum(1 for _ in _located(listings))
+    effective = mode
+    if mode == "Puntos" and n_points > MAX_POINTS:
+        effective = "Clusters"
+
+    cell = cluster_cell_deg(zoom)
+    for _ in range(12):
+        if effective == "Puntos":
+            cols = point_columns(listings)
+        elif effective == "Hexágonos":
+            # hexagon circumradius so that its area matches a square cell
+            cols = hex_bins(listings, cell * HEX_SIZE_FACTOR)
+        else:
+            cols = grid_bins(listings, cell)
+        size = payload_bytes(cols)
+        if size <= max_payload_bytes:
+            break
+        if effective == "Puntos":
+            effective = "Clusters"
+            continue
+        cell *= 2
+
+    if effective == "Heatmap €/m²":
+        keep = [i for i, r in enumerate(cols["r"]) if r >= 0]
+        cols = {k: [v[i] for i in keep] for k, v in cols.items()}
+        size = payload_bytes(cols)
+
+    info = {
+        "mode": effective,
+        "points": n_points,
+        "bins": len(cols["lat"]),
+        # square side, or hexagon circumradius
+        "cell_m": None if effective == "Puntos" else round(cell * (HEX_SIZE_FACTOR if effective == "Hexágonos" else 1.0) * M_PER_DEG),
+        "payload_bytes": size,
+        "capped": size > max_payload_bytes,
+    }
+    return cols, info
+
+def build_layers(cols: dict[str, list], info: dict):
+    """
+    pydeck layers for aggregated columns (imports pydeck lazily, like exporting does with pandas).
+    """
+    import pandas as pd
+    import pydeck as pdk
+
+    data = pd.DataFrame(cols)
+    data["rt"] = [rent_label(r) for r in cols["r"]]
+    mode = info["mode"]
+    if mode == "Heatmap €/m²":
+        return [pdk.Layer("HeatmapLayer", data=data, get_position="[lon, lat]", get_weight="r",
+                          aggregation="MEAN", radius_pixels=50, opacity=0.6)]
+    if mode == "Hexágonos":
+        return [pdk.Layer("ColumnLayer", data=data, get_position="[lon, lat]", disk_resolution=6,
+                          radius=info["cell_m"] * 0.95, extruded=False, get_fill_color=RENT_COLOR,
+                          pickable=True)]
+    if mode == "Puntos":
+        return [pdk.Layer("ScatterplotLayer", data=data, get_position="[lon, lat]", get_radius=60,
+                          get_fill_color=RENT_COLOR, pickable=True)]
+    return [pdk.Layer("ScatterplotLayer", data=data, get_position="[lon, lat]", get_radius="n",
+                      radius_units="pixels", radius_scale=1.5, radius_min_pixels=5, radius_max_pixels=40,
+                      get_fill_color=RENT_COLOR, pickable=True)]
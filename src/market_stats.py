@@ -0,0 +1,198 @@
+import math
+import threading
+
+from .utils import canonical_url, dedup_key, normalize_text, to_float
+
+class QuantileSketch:
+    """
+    Mergeable log-bucket quantile sketch (DDSketch-style) with relative accuracy `alpha`.
+    Buckets are plain counts, so merging and deleting a value are O(1).
+    """
+
+    def __init__(self, alpha: float = 0.01):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: dict[int, int] = {}
+        self.count = 0
+
+    def _key(self, x: float) -> int:
+        return math.ceil(math.log(x) / self._log_gamma)
+
+    def add(self, x: float, n: int = 1):
+        if x is None or x <= 0:
+            return
+        k = self._key(x)
+        c = self.buckets.get(k, 0) + n
+        if c:
+            self.buckets[k] = c
+        else:
+            self.buckets.pop(k, None)
+        self.count += n
+
+    def remove(self, x: float):
+        self.add(x, -1)
+
+    def merge(self, other: "QuantileSketch"):
+        for k, c in other.buckets.items():
+            self.buckets[k] = self.buckets.get(k, 0) + c
+        self.count += other.count
+
+    def quantile(self, q: float):
+        if self.count <= 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for k in sorted(self.buckets):
+            seen += self.buckets[k]
+            if seen > rank:
+                return 2 * self.gamma ** k / (self.gamma + 1)
+        return None
+
+class CellStats:
+    """
+    Running statistics for one district or grid cell.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.available_now = 0
+        self.rent = QuantileSketch()
+        self.area = QuantileSketch()
+        self._summary = None
+
+    def apply(self, row: dict, sign: int):
+        self.count += sign
+        self.available_now += sign * int(row["available_now"])
+        if row["rent"] is not None:
+            self.rent.add(row["rent"], sign)
+        if row["area"] is not None:
+            self.area.add(row["area"], sign)
+        self._summary = None
+
+    def merge(self, other: "CellStats"):
+        self.count += other.count
+        self.available_now += other.available_now
+        self.rent.merge(other.rent)
+        self.area.merge(other.area)
+        self._summary = None
+
+    def summary(self) -> dict:
+        # cached until the next update, so repeated lookups are O(1)
+        if self._summary is None:
+            r = lambda v: round(v, 2) if v is not None else None
+            self._summary = {
+                "count": self.count,
+                "rent_count": self.rent.count,
+                "rent_eur_m2_month_p25": r(self.rent.quantile(0.25)),
+                "rent_eur_m2_month_median": r(self.rent.quantile(0.5)),
+                "rent_eur_m2_month_p75": r(self.rent.quantile(0.75)),
+                "area_m2_p25": r(self.area.quantile(0.25)),
+                "area_m2_median": r(self.area.quantile(0.5)),
+                "area_m2_p75": r(self.area.quantile(0.75)),
+                "availability_now_share": r(self.available_now / self.count) if self.count else None,
+            }
+        return self._summary
+
+def _is_available_now(it: dict) -> bool:
+    avail = normalize_text(it.get("available_from", ""))
+    return "inmedi" in avail or "immediate" in avail
+
+class MarketStats:
+    """
+    Per-district and per-grid-cell market statistics maintained incrementally.
+    Rows are keyed like deduplicate_listings (utils.dedup_key), so the same office listed on
+    two portals counts once; each row remembers the canonical URLs listing it. Upserting a
+    known URL first removes its previous contribution, so re-crawls do not double count.
+    Upserts come from crawl threads (on_listing); every read takes the same lock.
+    """
+
+    def __init__(self, cell_deg: float = 0.01):
+        self.cell_deg = cell_deg
+        self.rows: dict[tuple, dict] = {}
+        self._owners: dict[tuple, set[str]] = {}  # row key -> URLs listing that office
+        self._key_of: dict[str, tuple] = {}  # URL -> row key
+        self.cells: dict[tuple[int, int], CellStats] = {}
+        self.districts: dict[str, CellStats] = {}
+        self.total = CellStats()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def _targets(self, row: dict):
+        yield self.total
+        if row["cell"] is not None:
+            yield self.cells.setdefault(row["cell"], CellStats())
+        if row["district"]:
+            yield self.districts.setdefault(row["district"], CellStats())
+
+    def _apply(self, row: dict, sign: int):
+        for s in self._targets(row):
+            s.apply(row, sign)
+
+    def upsert(self, it: dict):
+        key = dedup_key(it)
+        url = canonical_url(it.get("source_url", "")) or repr(key)
+        lat, lon = it.get("lat"), it.get("lon")
+        area = to_float(it.get("area_m2"))
+        rent = to_float(it.get("rent_eur_m2_month"))
+        row = {
+            "cell": self._cell(float(lat), float(lon)) if lat is not None and lon is not None else None,
+            "district": it.get("district") or None,
+            "rent": rent if rent and rent > 0 else None,
+            "area": area if area and area > 0 else None,
+            "available_now": _is_available_now(it),
+        }
+        with self._lock:
+            old_key = self._key_of.get(url)
+            if old_key is not None and old_key != key:
+                # this URL's office changed (e.g. new rent): leave the old row
+                owners = self._owners[old_key]
+                owners.discard(url)
+                if not owners:
+                    del self._owners[old_key]
+                    self._apply(self.rows.pop(old_key), -1)
+            self._key_of[url] = key
+            self._owners.setdefault(key, set()).add(url)
+            old = self.rows.get(key)
+            if old == row:
+                return
+            if old is not None:
+                self._apply(old, -1)
+            self._apply(row, +1)
+            self.rows[key] = row
+
+    def upsert_many(self, listings):
+        for it in listings:
+            self.upsert(it)
+
+    def at(self, lat: float, lon: float) -> dict:
+        """
+        Statistics of the grid cell containing (lat, lon).
+        """
+        with self._lock:
+            s = self.cells.get(self._cell(lat, lon))
+            return s.summary() if s else CellStats().summary()
+
+    def around(self, lat: float, lon: float, rings: int = 1) -> dict:
+        """
+        Statistics merged over the (2*rings+1)^2 cells around (lat, lon); cost is independent of corpus size.
+        """
+        ci, cj = self._cell(lat, lon)
+        out = CellStats()
+        with self._lock:
+            for di in range(-rings, rings + 1):
+                for dj in range(-rings, rings + 1):
+                    s = self.cells.get((ci + di, cj + dj))
+                    if s:
+                        out.merge(s)
+        return out.summary()
+
+    def district(self, name: str) -> dict:
+        with self._lock:
+            s = self.districts.get(name)
+            return s.summary() if s else CellStats().summary()
@@ -0,0 +1,136 @@
+"""
+Extraction cache: skips re-parsing pages whose HTML did not change since the last crawl.
+
+Key = sha256(PARSER_VERSION, title hint, raw body). The body is not normalized: the extraction
+regexes stop at newlines and count characters, so even whitespace changes can change the result. The cached value is the
+extractor output without its per-fetch fields (source_url, consulted_on), which are stamped
+again on every hit. Bumping parsers.PARSER_VERSION invalidates all entries.
+
+In memory by default; with a path (or env PARSE_CACHE_PATH) entries persist in SQLite across runs.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+from .parsers import PARSER_VERSION, extract_listing_from_html
+
+PER_FETCH_FIELDS = ("source_url", "consulted_on")
+_MISSING = object()
+
+def body_hash(html: str, title_hint: str = "") -> str:
+    h = hashlib.sha256(f"v{PARSER_VERSION}\x00{title_hint}\x00".encode("utf-8"))
+    h.update((html or "").encode("utf-8", errors="surrogatepass"))
+    return h.hexdigest()
+
+class ParseCache:
+    def __init__(self, path: str | None = None, max_memory_entries: int = 20_000):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self._mem: OrderedDict[str, tuple[dict | None, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "cpu_parse_s": 0.0, "cpu_saved_s": 0.0}
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.executescript("""
+                PRAGMA journal_mode = WAL;
+                PRAGMA synchronous = NORMAL;
+                CREATE TABLE IF NOT EXISTS parse_cache (
+                    key TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    result TEXT,
+                    cpu_s REAL NOT NULL
+                );
+            """)
+            # entries of older parser versions can never hit again
+            self.db.execute("DELETE FROM parse_cache WHERE version != ?", (PARSER_VERSION,))
+            self.db.commit()
+
+    def _get(self, key: str):
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                return self._mem[key]
+        if self.db is not None:
+            row = self.db.execute("SELECT result, cpu_s FROM parse_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                value = (json.loads(row[0]) if row[0] is not None else None, row[1])
+                self._remember(key, value)
+                return value
+        return _MISSING
+
+    def _remember(self, key: str, value):
+        with self._lock:
+            self._mem[key] = value
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_memory_entries:
+                self._mem.popitem(last=False)
+
+    def _put(self, key: str, result: dict | None, cpu_s: float):
+        self._remember(key, (result, cpu_s))
+        if self.db is not None:
+            with self._lock:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO parse_cache (key, version, result, cpu_s) VALUES (?, ?, ?, ?)",
+                    (key, PARSER_VERSION, json.dumps(result, ensure_ascii=False) if result is not None else None, cpu_s),
+                )
+                self.db.commit()
+
+    def extract(self, url: str, html: str, title_hint: str = "") -> dict | None:
+        """
+        Same contract as parsers.extract_listing_from_html, served from the cache when the body is unchanged.
+        """
+        key = body_hash(html, title_hint)
+        hit = self._get(key)
+        if hit is not _MISSING:
+            result, cpu_s = hit
+            with self._lock:
+                self.stats["hits"] += 1
+                self.stats["cpu_saved_s"] += cpu_s
+            if result is None:
+                return None
+            item = dict(result)
+            item["source_url"] = url
+            item["consulted_on"] = str(date.today())
+            return item
+
+        # this thread's CPU only: discovery and other downloads run in parallel threads
+        t0 = time.thread_time()
+        item = extract_listing_from_html(url=url, html=html, title_hint=title_hint)
+        cpu_s = time.thread_time() - t0
+        with self._lock:
+            self.stats["misses"] += 1
+            self.stats["cpu_parse_s"] += cpu_s
+        stored = {k: v for k, v in item.items() if k not in PER_FETCH_FIELDS} if item else None
+        self._put(key, stored, cpu_s)
+        return item
+
+    def report(self) -> dict:
+        total = self.stats["hits"] + self.stats["misses"]
+        return {
+            "path": self.path,
+            "parser_version": PARSER_VERSION,
+            "hits": self.stats["hits"],
+            "misses": self.stats["misses"],
+            "hit_rate": round(self.stats["hits"] / total, 3) if total else None,
+            "cpu_parse_s": round(self.stats["cpu_parse_s"], 3),
+            "cpu_saved_s": round(self.stats["cpu_saved_s"], 3),
+        }
+
+_default: ParseCache | None = None
+_default_lock = threading.Lock()
+
+def get_parse_cache() -> ParseCache:
+    """
+    Process-wide cache (persistent if env PARSE_CACHE_PATH is set).
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = ParseCache(os.getenv("PARSE_CACHE_PATH") or None)
+        return _default
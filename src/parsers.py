@@ -2,6 +2,10 @@ import re
 from bs4 import BeautifulSoup
 from datetime import date
 
+# Bump whenever the extraction logic or patterns change: cached parse results keyed
+# with an older version are ignored (see parse_cache.py)
+PARSER_VERSION = 1
+
 # Heuristic patterns (Spanish)
 RE_AREA = re.compile(r"(\d[\d\.\,]{0,10})\s*(m2|m²)\b", re.I)
 RE_RENT_M2 = re.compile(r"(\d[\d\.\,]{0,10})\s*€\s*/\s*(m2|m²)\s*/\s*mes", re.I)
@@ -0,0 +1,71 @@
+"""
+Query planner for "listings near an address": filter before truncate.
+
+    rows, plan = run_query(index, lat, lon, top_n=20, filters={...}, costs={...})
+
+1. Access path: a zone name (zone_exact, from the selector) uses the index's by_zone lookup;
+   free text equal to a district/barrio of the index uses its substring zone scan; in both cases
+   the district predicate is dropped. Otherwise the grid index (k-nearest or radius).
+2. The remaining predicates (min area, rent range, availability, district substring) are
+   pushed down into the index walk, so a row is filtered before it can take a top-k slot.
+3. Top-k by distance with a bounded heap inside the index.
+4. compute_cost_fields runs on the final k rows only.
+
+The plan dict tells which path was used and how many rows were examined.
+"""
+from .index import ListingIndex
+from .utils import compute_cost_fields, listing_filter
+
+DEFAULT_FILTERS = {"min_area": 0, "district_contains": "", "rent_min": 0.0, "rent_max": 200.0, "availability_now": False,
+                   "zone_exact": False}
+
+def plan_query(index: ListingIndex, lat: float, lon: float, top_n: int = 20, radius_km: float | None = None,
+               filters: dict | None = None, radius_limit: int | None = None) -> tuple[list[dict], dict]:
+    """
+    Rows (copies with dist_km) matching every filter: the top_n closest, or with radius_km the
+    closest inside the radius (at most radius_limit). No cost fields yet.
+    """
+    f = dict(DEFAULT_FILTERS, **(filters or {}))
+    zone, zone_exact = None, f["zone_exact"]
+    if f["district_contains"] and (zone_exact or index.in_zone(f["district_contains"])):
+        zone, f["district_contains"], f["zone_exact"] = f["district_contains"], "", False
+    match = listing_filter(**f)
+    examined = 0
+
+    def where(it: dict) -> bool:
+        nonlocal examined
+        examined += 1
+        return match(it)
+
+    if radius_km is not None:
+        rows = index.within(lat, lon, radius_km, limit=radius_limit, zone=zone, where=where, zone_exact=zone_exact)
+        access = "zone_radius" if zone else "grid_radius"
+    else:
+        rows = index.nearest(lat, lon, k=top_n, zone=zone, where=where, zone_exact=zone_exact)
+        access = "zone_knn" if zone else "grid_knn"
+    plan = {
+        "access": access,
+        "zone": zone,
+        "zone_exact": bool(zone and zone_exact),
+        "pushed_filters": {k: v for k, v in f.items() if v != DEFAULT_FILTERS[k]},
+        "indexed": len(index),
+        "examined": examined,
+        "returned": len(rows),
+    }
+    return rows, plan
+
+def run_query(index: ListingIndex, lat: float, lon: float, top_n: int = 20, radius_km: float | None = None,
+              filters: dict | None = None, costs: dict | None = None,
+              radius_limit: int | None = None) -> tuple[list[dict], dict]:
+    """
+    plan_query plus compute_cost_fields on the returned rows only.
+    costs: keyword arguments of compute_cost_fields (treat_nd_as_zero, enable_estimations,
+    community_rate, ibi_rate_annual).
+    """
+    rows, plan = plan_query(index, lat, lon, top_n=top_n, radius_km=radius_km, filters=filters,
+                            radius_limit=radius_limit)
+    costs = dict({"treat_nd_as_zero": False, "enable_estimations": False, "community_rate": 3.5,
+                  "ibi_rate_annual": 20.0}, **(costs or {}))
+    for it in rows:
+        compute_cost_fields(it, **costs)
+    return rows, plan
@@ -1,43 +1,225 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
 from datetime import date
+from typing import Callable
 from urllib.parse import urlparse
 
-from .direct_sources import collect_candidate_urls, _get
+from .direct_sources import DEFAULT_SOURCES, clamp_timeout, collect_candidate_urls, _get
+from .frontier import Frontier
+from .gazetteer import geocode_listings
+from .history import GONE_STATUSES
+from .parse_cache import ParseCache, get_parse_cache
 from .parsers import extract_listing_from_html
+from .transport import transport_info
 
-def search_without_api(max_candidates: int = 300) -> tuple[list[dict], dict]:
-    urls, diag = collect_candidate_urls(max_per_source=200, pages_loopnet=3)
-    urls = urls[:max_candidates]
+STAGES = ("discovery", "download", "parse")
 
-    diag.update({
-        "urls_attempted": 0,
-        "downloads_ok": 0,
-        "extracted_listings": 0,
-        "blocked": {},
-        "kept_from_snippet_only": 0,
-    })
+class SearchBudget:
+    """
+    Total deadline plus optional per-stage budgets (seconds). Discovery is measured as wall time
+    from the start of the search; download and parse as the time actually spent in each stage
+    (they overlap with discovery when pipelined). Once a budget is exhausted no new work of that
+    stage is scheduled; in-flight requests are bounded by their clamped timeouts.
+    """
+
+    def __init__(self, deadline_s: float | None = None, budgets: dict | None = None):
+        budgets = budgets or {}
+        unknown = set(budgets) - set(STAGES)
+        if unknown:
+            raise ValueError(f"Unknown budget stages: {sorted(unknown)}; use {STAGES}")
+        self.deadline_s = deadline_s
+        self.budgets = {k: float(v) for k, v in budgets.items() if v is not None}
+        self.start = time.monotonic()
+        self.end = self.start + deadline_s if deadline_s else None
+        self.spent = {"download": 0.0, "parse": 0.0}
+        self.stopped_by: str | None = None
+        self.discovery_cut = False
+
+    def discovery_end(self) -> float | None:
+        ends = [e for e in (self.end, self.start + self.budgets["discovery"] if "discovery" in self.budgets else None)
+                if e is not None]
+        return min(ends) if ends else None
+
+    def exhausted(self) -> str | None:
+        if self.end is not None and time.monotonic() >= self.end:
+            return "deadline"
+        for stage in ("download", "parse"):
+            if stage in self.budgets and self.spent[stage] >= self.budgets[stage]:
+                return f"{stage}_budget"
+        return None
+
+    def request_deadline(self) -> float | None:
+        ends = [self.end] if self.end is not None else []
+        if "download" in self.budgets:
+            ends.append(time.monotonic() + max(self.budgets["download"] - self.spent["download"], 0.0))
+        return min(ends) if ends else None
 
-    listings: list[dict] = []
-    for url in urls:
-        diag["urls_attempted"] += 1
-        html, reason = _get(url)
+    def remaining(self) -> float | None:
+        return None if self.end is None else self.end - time.monotonic()
+
+def _download(frontier: Frontier, discovery: Future, listings: list[dict], max_candidates: int,
+              on_listing: Callable[[dict], None] | None, parse_cache: ParseCache, t0: float, timings: dict,
+              budget: SearchBudget):
+    """
+    Consumer stage: pop listing URLs as discovery queues them until max_candidates were attempted
+    (counting a resumed run's earlier attempts), discovery finished and the queue is empty,
+    or the budget ran out (budget.stopped_by says which).
+    """
+    attempted = sum(frontier.status_counts("listing").values())
+    while attempted < max_candidates:
+        budget.stopped_by = budget.exhausted()
+        if budget.stopped_by:
+            break
+        url = frontier.pop("listing")
+        if url is None:
+            if discovery.done():
+                # discovery may have queued its last URLs after the pop above
+                url = frontier.pop("listing")
+                if url is None:
+                    break
+            else:
+                remaining = budget.remaining()
+                frontier.wait_for_urls(timeout=0.5 if remaining is None else max(min(0.5, remaining), 0.0))
+                continue
+        if timings["first_download_s"] is None:
+            timings["first_download_s"] = round(time.perf_counter() - t0, 3)
+        attempted += 1
+        t_get = time.monotonic()
+        html, reason = _get(url, timeout=clamp_timeout((7, 15), budget.request_deadline()))
+        budget.spent["download"] += time.monotonic() - t_get
         if not html:
-            diag["blocked"][reason] = diag["blocked"].get(reason, 0) + 1
             item = extract_listing_from_html(url=url, html=f"<html><body>{url}</body></html>", title_hint="")
             if item:
                 item["notes"] = (item.get("notes","") + " | No se pudo descargar (posible anti-bot).").strip(" |")
                 item["consulted_on"] = str(date.today())
                 item["source_domain"] = urlparse(url).netloc
+                geocode_listings([item])
                 listings.append(item)
-                diag["kept_from_snippet_only"] += 1
+                if on_listing:
+                    on_listing(item)
+            frontier.done(url, status=reason, result=item)
             continue
 
-        diag["downloads_ok"] += 1
-        item = extract_listing_from_html(url=url, html=html, title_hint="")
+        t_parse = time.monotonic()
+        item = parse_cache.extract(url=url, html=html, title_hint="")
+        budget.spent["parse"] += time.monotonic() - t_parse
         if not item:
+            frontier.done(url, status="no_listing")
             continue
         item["consulted_on"] = str(date.today())
         item["source_domain"] = urlparse(url).netloc
+        geocode_listings([item])
         listings.append(item)
+        if on_listing:
+            on_listing(item)
+        frontier.done(url, status="ok", result=item)
+
+def search_without_api(max_candidates: int = 300, on_listing: Callable[[dict], None] | None = None,
+                       frontier_path: str | None = None, parse_cache: ParseCache | None = None,
+                       pipelined: bool = True, deadline_s: float | None = None,
+                       budgets: dict | None = None) -> tuple[list[dict], dict]:
+    """
+    Crawl the direct sources and extract listings.
+    on_listing (optional) is called with each listing as soon as it is extracted,
+    e.g. MarketStats.upsert to keep market statistics up to date during the crawl.
+    frontier_path (optional) persists the crawl frontier to a SQLite file: rerunning with the
+    same path resumes where a previous (interrupted) run stopped, reusing its listings.
+    parse_cache (optional) defaults to the process-wide extraction cache.
+    pipelined (default) runs discovery in a background thread and downloads listing URLs as soon
+    as they are queued; False discovers every source first (the original two-phase crawl).
+    deadline_s (optional) bounds the whole search and budgets (optional) each stage, e.g.
+    {"discovery": 20, "download": 60, "parse": 10} in seconds. When time runs out no new work is
+    scheduled and the listings found so far are returned; diag["budget"] states what was skipped.
+    """
+    budget = SearchBudget(deadline_s, budgets)
+    parse_cache = parse_cache or get_parse_cache()
+    frontier = Frontier(frontier_path) if frontier_path else Frontier()
+    t0 = time.perf_counter()
+    timings = {"first_download_s": None}
+    stop_discovery = threading.Event()
+    discovery_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="discovery")
+    discovery = discovery_pool.submit(collect_candidate_urls, max_per_source=200, pages_loopnet=3,
+                                      frontier=frontier, stop=stop_discovery, deadline=budget.discovery_end())
+    discovery_timer = None
+    if budget.discovery_end() is not None:
+        def _cut_discovery():
+            if not discovery.done():
+                budget.discovery_cut = True
+                stop_discovery.set()
+        discovery_timer = threading.Timer(max(budget.discovery_end() - time.monotonic(), 0.0), _cut_discovery)
+        discovery_timer.daemon = True
+        discovery_timer.start()
+    if not pipelined:
+        discovery.result()
+
+    listings: list[dict] = frontier.results("listing")
+    resumed = len(listings)
+    if on_listing:
+        for item in listings:
+            on_listing(item)
 
-    diag["extracted_listings"] = len(listings)
+    try:
+        _download(frontier, discovery, listings, max_candidates, on_listing, parse_cache, t0, timings, budget)
+    finally:
+        # enough URLs attempted, out of time (or an error): discovery still running has nothing left to feed
+        stop_discovery.set()
+        if discovery_timer is not None:
+            discovery_timer.cancel()
+    discovery_abandoned = False
+    try:
+        # in-flight discovery requests end by their clamped timeouts; do not wait much past the deadline
+        remaining = budget.remaining()
+        _, diag = discovery.result(timeout=None if remaining is None else max(remaining, 0.0) + 1.0)
+    except FutureTimeout:
+        discovery_abandoned = True
+        diag = frontier.get_meta("discovery_diag") or {"sources": list(DEFAULT_SOURCES.keys())}
+    discovery_pool.shutdown(wait=not discovery_abandoned)
+    timings["total_s"] = round(time.perf_counter() - t0, 3)
+    diag["resumed_listings"] = resumed
+
+    # counters over the whole frontier, so a resumed run reports the full crawl
+    diag.update({
+        "urls_attempted": 0,
+        "downloads_ok": 0,
+        "extracted_listings": len(listings),
+        "blocked": {},
+        "kept_from_snippet_only": 0,
+    })
+    for (status, has_result), n in frontier.status_counts("listing").items():
+        diag["urls_attempted"] += n
+        if status in ("ok", "no_listing"):
+            diag["downloads_ok"] += n
+        else:
+            diag["blocked"][status] = diag["blocked"].get(status, 0) + n
+            if has_result:
+                diag["kept_from_snippet_only"] += n
+    diag["frontier"] = dict(frontier.stats, path=frontier_path, pending=frontier.pending("listing"))
+    # removed pages (404/410): the rent history delists these, never pages that merely failed
+    diag["gone_urls"] = frontier.urls("listing", statuses=GONE_STATUSES)
+    diag["pipeline"] = dict(timings, pipelined=pipelined)
+    not_discovered = [name for name in diag.get("sources", []) if name not in diag.get("sources_done", [])]
+    if not_discovered and budget.discovery_end() is not None and time.monotonic() >= budget.discovery_end():
+        # discovery may have returned on its own deadline check before the timer fired
+        budget.discovery_cut = True
+    diag["budget"] = {
+        "deadline_s": deadline_s,
+        "budgets": budget.budgets,
+        "elapsed_s": round(time.monotonic() - budget.start, 3),
+        "spent_s": {k: round(v, 3) for k, v in budget.spent.items()},
+        "stopped_by": budget.stopped_by,
+        "partial": bool(budget.stopped_by or budget.discovery_cut or discovery_abandoned),
+        "skipped": {
+            "discovery_cut_by_budget": budget.discovery_cut,
+            "discovery_abandoned": discovery_abandoned,
+            "sources_not_discovered": not_discovered,
+            "urls_not_attempted": diag["frontier"]["pending"] if budget.stopped_by else 0,
+        },
+    }
+    diag["located_by_callejero"] = sum("(callejero)" in (it.get("notes") or "") for it in listings)
+    diag["transport"] = transport_info()
+    diag["parse_cache"] = parse_cache.report()
+    if not discovery_abandoned:
+        # abandoned discovery threads may still write to the frontier; let it be collected with them
+        frontier.close()
     return listings, diag
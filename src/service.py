@@ -0,0 +1,322 @@
+"""
+Headless HTTP query service (stdlib asyncio, no extra dependencies).
+
+    python -m src.service --snapshot crawl.json.gz --port 8502
+
+Keeps one process-wide warm ListingIndex and geocode cache shared by every client.
+
+Endpoints (GET unless noted):
+    /health
+    /stats
+    /geocode?address=...
+    /nearest?address=...|lat=..&lon=..[&top_n=20][&radius_km=..][&min_area=..][&rent_min=..]
+             [&rent_max=..][&availability_now=1][&district=..][&treat_nd_as_zero=1]
+    /export?<same as /nearest>&format=csv|xlsx|pdf
+    /market?address=...|lat=..&lon=..[&rings=1] | ?district=...
+    /history?url=... | ?district=... | ?address=...|lat=..&lon=..   (rent history, see history.py)
+    POST /refresh   (recrawl in the background and swap the index when done; the crawl is saved
+                     to --save-snapshot, or to --snapshot, so a restart loads it)
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+
+from .districts import canonical_zone
+from .exporting import REQUIRED_COLS, export_excel_bytes, export_pdf_bytes, to_required_frame
+from .geocode import geocode_address_cached, geocoder_stats
+from .history import get_rent_history
+from .index import ListingIndex
+from .market_stats import MarketStats
+from .batch import load_or_crawl
+from .query import run_query
+
+MAX_HEADER_BYTES = 16_384
+MAX_BODY_BYTES = 1_000_000
+
+class ServiceState:
+    """
+    Process-wide warm state: the listings index, crawl diag and request counters.
+    """
+
+    def __init__(self, snapshot: str | None = None, save_snapshot: str | None = None,
+                 max_candidates: int = 400, geocode_cache: str | None = None):
+        self.snapshot = snapshot
+        self.save_snapshot = save_snapshot
+        self.max_candidates = max_candidates
+        self.geocode_cache = geocode_cache
+        self.index = ListingIndex([])
+        self.market = MarketStats()
+        self.diag: dict = {}
+        self.loaded_at = None
+        self.refreshing = False
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "by_path": {}}
+
+    def refresh(self, crawl: bool = False):
+        """
+        Load the snapshot (or crawl when there is none) and swap the index. crawl=True (POST /refresh)
+        always recrawls; the result is saved only to save_snapshot (the --snapshot input is never
+        overwritten).
+        """
+        with self._lock:
+            if self.refreshing:
+                return False
+            self.refreshing = True
+        try:
+            if crawl:
+                listings, diag = load_or_crawl(None, self.save_snapshot, self.max_candidates)
+            else:
+                listings, diag = load_or_crawl(self.snapshot, self.save_snapshot, self.max_candidates)
+            index = ListingIndex(listings)
+            self.market.upsert_many(index.listings)
+            # single reference swap: in-flight queries keep using the old index
+            self.index, self.diag, self.loaded_at = index, diag, time.time()
+        finally:
+            self.refreshing = False
+        return True
+
+    def record(self, path: str, elapsed_ms: float, ok: bool):
+        # called on the event loop only; /stats is serialized there too (see _serve_client)
+        self.stats["requests"] += 1
+        if not ok:
+            self.stats["errors"] += 1
+        p = self.stats["by_path"].setdefault(path, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        p["count"] += 1
+        p["total_ms"] += elapsed_ms
+        p["max_ms"] = max(p["max_ms"], elapsed_ms)
+
+def _arg(q: dict, name: str, default=None):
+    v = q.get(name)
+    return v[0] if v else default
+
+def _flag(q: dict, name: str) -> bool:
+    return str(_arg(q, name, "")).lower() in ("1", "true", "yes", "si", "sí")
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def _locate(state: ServiceState, q: dict) -> dict:
+    lat, lon = _arg(q, "lat"), _arg(q, "lon")
+    if lat is not None and lon is not None:
+        try:
+            return {"ok": True, "lat": float(lat), "lon": float(lon), "display_name": f"{lat},{lon}", "provider": "query"}
+        except ValueError:
+            raise HttpError(400, "lat/lon no válidos")
+    address = _arg(q, "address")
+    if not address:
+        raise HttpError(400, "Falta 'address' o 'lat'/'lon'")
+    geo = geocode_address_cached(address, cache_path=state.geocode_cache)
+    if not geo.get("ok"):
+        raise HttpError(422, geo.get("error", "No se pudo geocodificar"))
+    return geo
+
+def _query(state: ServiceState, q: dict) -> tuple[dict, list[dict]]:
+    geo = _locate(state, q)
+    try:
+        top_n = int(_arg(q, "top_n", 20))
+        radius_km = _arg(q, "radius_km")
+        radius_km = float(radius_km) if radius_km is not None else None
+        district = _arg(q, "district", "")
+        zone = canonical_zone(district)  # a district/barrio name matches exactly, other text as a substring
+        filters = {
+            "min_area": float(_arg(q, "min_area", 0)),
+            "district_contains": zone or district,
+            "zone_exact": zone is not None,
+            "rent_min": float(_arg(q, "rent_min", 0.0)),
+            "rent_max": float(_arg(q, "rent_max", 200.0)),
+            "availability_now": _flag(q, "availability_now"),
+        }
+        community_rate = float(_arg(q, "community_rate", 3.5))
+        ibi_rate_annual = float(_arg(q, "ibi_rate_annual", 20.0))
+    except ValueError:
+        raise HttpError(400, "Parámetro numérico no válido")
+
+    # filters pushed into the index walk before truncation; costs only for the returned rows
+    rows, _ = run_query(
+        state.index,
+        geo["lat"],
+        geo["lon"],
+        top_n=top_n,
+        radius_km=radius_km,
+        radius_limit=top_n,
+        filters=filters,
+        costs={
+            "treat_nd_as_zero": _flag(q, "treat_nd_as_zero"),
+            "enable_estimations": _flag(q, "enable_estimations"),
+            "community_rate": community_rate,
+            "ibi_rate_annual": ibi_rate_annual,
+        },
+    )
+    return geo, rows
+
+def handle(state: ServiceState, method: str, path: str, q: dict) -> tuple[int, str, bytes]:
+    """
+    Blocking request handler (runs in a worker thread; /stats on the event loop).
+    Returns (status, content_type, body).
+    """
+    if path == "/health":
+        return 200, "application/json", _json({"ok": True, "listings": len(state.index), "refreshing": state.refreshing})
+    if path == "/stats":
+        return 200, "application/json", _json({"stats": state.stats, "geocoder": geocoder_stats(),
+                                                   "loaded_at": state.loaded_at, "diag": state.diag})
+    if path == "/refresh":
+        if method != "POST":
+            raise HttpError(405, "Usa POST")
+        started = not state.refreshing
+        if started:
+            threading.Thread(target=state.refresh, kwargs={"crawl": True}, daemon=True).start()
+        return 202, "application/json", _json({"ok": True, "started": started})
+    if path == "/geocode":
+        geo = _locate(state, q)
+        return 200, "application/json", _json({k: v for k, v in geo.items() if k != "raw"})
+    if path == "/nearest":
+        geo, rows = _query(state, q)
+        out = [{c: it.get(c) for c in REQUIRED_COLS} for it in rows]
+        return 200, "application/json", _json({"location": {k: geo.get(k) for k in ("lat", "lon", "display_name")}, "count": len(out), "results": out})
+    if path == "/market":
+        district = _arg(q, "district")
+        if district and _arg(q, "lat") is None and not _arg(q, "address"):
+            return 200, "application/json", _json({"district": district, "stats": state.market.district(district)})
+        geo = _locate(state, q)
+        try:
+            rings = int(_arg(q, "rings", 1))
+        except ValueError:
+            raise HttpError(400, "rings no válido")
+        return 200, "application/json", _json({
+            "location": {k: geo.get(k) for k in ("lat", "lon", "display_name")},
+            "cell": state.market.at(geo["lat"], geo["lon"]),
+            "around": state.market.around(geo["lat"], geo["lon"], rings=max(0, min(rings, 5))),
+        })
+    if path == "/history":
+        history = get_rent_history()
+        url, district = _arg(q, "url"), _arg(q, "district")
+        if url:
+            return 200, "application/json", _json({"url": url, "trend": history.rent_trend(url),
+                                                   "history": history.listing_history(url)})
+        if district and _arg(q, "lat") is None and not _arg(q, "address"):
+            return 200, "application/json", _json({"district": district, "by_month": history.district_rent_by_month(district)})
+        geo = _locate(state, q)
+        return 200, "application/json", _json({
+            "location": {k: geo.get(k) for k in ("lat", "lon", "display_name")},
+            "by_month": history.cell_rent_by_month(geo["lat"], geo["lon"]),
+        })
+    if path == "/export":
+        _, rows = _query(state, q)
+        df = to_required_frame(rows)
+        fmt = _arg(q, "format", "csv").lower()
+        if fmt == "csv":
+            return 200, "text/csv; charset=utf-8", df.to_csv(index=False).encode("utf-8")
+        if fmt == "xlsx":
+            return 200, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", export_excel_bytes(df)
+        if fmt == "pdf":
+            return 200, "application/pdf", export_pdf_bytes(df, title="Madrid Office Rent Market")
+        raise HttpError(400, "format debe ser csv, xlsx o pdf")
+    raise HttpError(404, "No encontrado")
+
+def _json(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8")
+
+_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error"}
+
+def _response(status: int, ctype: str, body: bytes, keep_alive: bool) -> bytes:
+    return (
+        f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+        f"Content-Type: {ctype}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body
+    )
+
+async def _serve_client(state: ServiceState, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return
+            except asyncio.LimitOverrunError:
+                return
+            if len(head) > MAX_HEADER_BYTES:
+                return
+            lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, target, version = lines[0].split(" ", 2)
+            except ValueError:
+                return
+            headers = {}
+            for line in lines[1:]:
+                if ":" in line:
+                    k, v = line.split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+            try:
+                length = int(headers.get("content-length") or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                # the body cannot be delimited: answer and close the connection
+                writer.write(_response(400, "application/json",
+                                       _json({"ok": False, "error": "Content-Length no válido"}), keep_alive=False))
+                await writer.drain()
+                return
+            if length > MAX_BODY_BYTES:
+                status, ctype, body = 413, "application/json", _json({"ok": False, "error": "Cuerpo demasiado grande"})
+            else:
+                if length:
+                    await reader.readexactly(length)
+                parts = urlsplit(target)
+                q = parse_qs(parts.query)
+                t0 = time.perf_counter()
+                try:
+                    if parts.path == "/stats":
+                        # state.stats is mutated on the loop: serialize it here, not in a worker thread
+                        status, ctype, body = handle(state, method.upper(), parts.path, q)
+                    else:
+                        status, ctype, body = await asyncio.to_thread(handle, state, method.upper(), parts.path, q)
+                except HttpError as e:
+                    status, ctype, body = e.status, "application/json", _json({"ok": False, "error": e.message})
+                except Exception as e:
+                    status, ctype, body = 500, "application/json", _json({"ok": False, "error": str(e)})
+                state.record(parts.path, (time.perf_counter() - t0) * 1000.0, status < 400)
+
+            keep_alive = version.upper() == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+            writer.write(_response(status, ctype, body, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                return
+    finally:
+        writer.close()
+
+async def serve(state: ServiceState, host: str = "127.0.0.1", port: int = 8502, ready: asyncio.Event | None = None):
+    server = await asyncio.start_server(lambda r, w: _serve_client(state, r, w), host, port)
+    if ready is not None:
+        ready.set()
+    async with server:
+        await server.serve_forever()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Servicio HTTP de consulta (índice de ofertas en memoria).")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8502)
+    ap.add_argument("--snapshot", help="Cargar ofertas desde un snapshot (.json.gz) en lugar de rastrear")
+    ap.add_argument("--save-snapshot", help="Guardar cada rastreo en este snapshot (.json.gz)")
+    ap.add_argument("--geocode-cache", default="geocode_cache.json")
+    ap.add_argument("--max-candidates", type=int, default=400)
+    args = ap.parse_args(argv)
+
+    state = ServiceState(args.snapshot, args.save_snapshot, args.max_candidates, args.geocode_cache)
+    state.refresh()
+    print(f"{len(state.index)} ofertas cargadas; escuchando en http://{args.host}:{args.port}", flush=True)
+    try:
+        asyncio.run(serve(state, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
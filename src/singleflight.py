@@ -0,0 +1,69 @@
+"""
+Single-flight: concurrent calls with the same key share one execution.
+
+The first caller (leader) runs the function; callers arriving while it runs wait for
+the same result (or exception) instead of starting their own. Nothing is cached after
+the call finishes; combine with a cache for that.
+"""
+import threading
+from typing import Callable, Hashable
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+        self.waiters = 0
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call] = {}
+        self._stats = {"calls": 0, "executions": 0, "coalesced": 0, "errors": 0, "max_waiters": 0}
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> tuple[object, bool]:
+        """
+        Run fn(*args, **kwargs) once per concurrent key. Returns (result, shared): shared is True
+        for callers that waited on another caller's execution. The result object is the same
+        for every caller; copy it before mutating.
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats["coalesced"] += 1
+                self._stats["max_waiters"] = max(self._stats["max_waiters"], call.waiters)
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._stats["executions"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s["in_flight"] = len(self._calls)
+        s["coalesced_rate"] = round(s["coalesced"] / s["calls"], 3) if s["calls"] else None
+        return s
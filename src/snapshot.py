@@ -0,0 +1,23 @@
+import gzip
+import json
+from datetime import datetime
+
+def save_snapshot(path: str, listings: list[dict], diag: dict | None = None):
+    """
+    Persist a crawl result (listings + diag) as gzipped JSON so it can be reused
+    without crawling again.
+    """
+    payload = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "listings": listings,
+        "diag": diag or {},
+    }
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, default=str)
+
+def load_snapshot(path: str) -> tuple[list[dict], dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        payload = json.load(f)
+    diag = payload.get("diag") or {}
+    diag["snapshot"] = {"path": path, "created_at": payload.get("created_at")}
+    return payload.get("listings") or [], diag
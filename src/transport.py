@@ -0,0 +1,195 @@
+"""
+HTTP transport shared by the crawler (`direct_sources._get`) and the geocoders.
+
+Modes (env HTTP_TRANSPORT_MODE, or set_transport()):
+    live    plain requests.get (default)
+    record  requests.get, and every response (status, headers, body) is written to the archive
+    replay  responses are served from the archive, no network; unknown requests fail like a
+            connection error
+
+Archive layout (env HTTP_ARCHIVE, a directory):
+    index.jsonl         one line per recorded response: request key, status, headers, encoding,
+                        final url, elapsed time and body hash
+    bodies/<sha256>.gz  gzipped bodies, content-addressed (identical bodies are stored once)
+
+A request recorded several times (e.g. retries after a 429) is replayed in the same order.
+Replay latency (env HTTP_REPLAY_LATENCY_MS): a fixed delay in ms, or "recorded" to sleep the
+time the original request took.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+MODES = ("live", "record", "replay")
+
+class ReplayMiss(requests.exceptions.ConnectionError):
+    """Raised in replay mode when the archive has no response for a request."""
+
+class HttpArchive:
+    def __init__(self, path: str):
+        self.path = path
+        self.bodies_dir = os.path.join(path, "bodies")
+        self.index_path = os.path.join(path, "index.jsonl")
+        self._lock = threading.Lock()
+        self.entries: dict[str, list[dict]] = {}
+        self._served: dict[str, int] = {}
+        self.stats = {"recorded": 0, "replayed": 0, "misses": 0, "bodies_written": 0}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        e = json.loads(line)
+                        self.entries.setdefault(e["key"], []).append(e)
+
+    @staticmethod
+    def request_key(method: str, url: str, params: dict | None = None) -> str:
+        full = url
+        if params:
+            full += ("&" if "?" in url else "?") + urlencode(sorted((str(k), str(v)) for k, v in params.items()))
+        return hashlib.sha256(f"{method.upper()} {full}".encode("utf-8")).hexdigest()
+
+    def _body_path(self, digest: str) -> str:
+        return os.path.join(self.bodies_dir, f"{digest}.gz")
+
+    def record(self, key: str, url: str, r: requests.Response, elapsed: float):
+        body = r.content or b""
+        digest = hashlib.sha256(body).hexdigest()
+        entry = {
+            "key": key,
+            "url": url,
+            "final_url": r.url,
+            "status": r.status_code,
+            "headers": dict(r.headers),
+            "encoding": r.encoding,
+            "elapsed": round(elapsed, 4),
+            "body": digest,
+        }
+        with self._lock:
+            os.makedirs(self.bodies_dir, exist_ok=True)
+            bp = self._body_path(digest)
+            if not os.path.exists(bp):
+                tmp = bp + ".tmp"
+                with gzip.open(tmp, "wb") as f:
+                    f.write(body)
+                os.replace(tmp, bp)
+                self.stats["bodies_written"] += 1
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.entries.setdefault(key, []).append(entry)
+            self.stats["recorded"] += 1
+
+    def record_error(self, key: str, url: str, exc: Exception, elapsed: float):
+        entry = {"key": key, "url": url, "error": type(exc).__name__, "elapsed": round(elapsed, 4)}
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.entries.setdefault(key, []).append(entry)
+            self.stats["recorded"] += 1
+
+    def replay(self, key: str) -> tuple[requests.Response | Exception, float]:
+        with self._lock:
+            seq = self.entries.get(key)
+            if not seq:
+                self.stats["misses"] += 1
+                raise ReplayMiss(f"No recorded response for request {key[:12]}")
+            i = self._served.get(key, 0)
+            self._served[key] = i + 1
+            entry = seq[min(i, len(seq) - 1)]
+            self.stats["replayed"] += 1
+        if entry.get("error"):
+            # recorded failure: raise the same kind of exception the live request raised
+            err = requests.exceptions.Timeout if "Timeout" in entry["error"] else requests.exceptions.ConnectionError
+            return err(f"Recorded {entry['error']}"), entry["elapsed"]
+        with gzip.open(self._body_path(entry["body"]), "rb") as f:
+            body = f.read()
+        r = requests.Response()
+        r.status_code = entry["status"]
+        r.headers = CaseInsensitiveDict(entry["headers"])
+        r._content = body
+        r.encoding = entry["encoding"]
+        r.url = entry["final_url"]
+        r.reason = ""
+        return r, entry["elapsed"]
+
+_state = {"mode": None, "archive": None, "latency": None}
+_state_lock = threading.Lock()
+
+def set_transport(mode: str = "live", archive_path: str | None = None, replay_latency_ms=None):
+    """
+    Select the transport mode for the whole process.
+    replay_latency_ms: None (no delay), a number of ms, or "recorded".
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}")
+    if mode != "live" and not archive_path:
+        raise ValueError("record/replay need an archive path")
+    with _state_lock:
+        _state["mode"] = mode
+        _state["archive"] = HttpArchive(archive_path) if mode != "live" else None
+        _state["latency"] = replay_latency_ms
+
+def _current():
+    with _state_lock:
+        if _state["mode"] is None:
+            mode = (os.getenv("HTTP_TRANSPORT_MODE") or "live").lower()
+            path = os.getenv("HTTP_ARCHIVE")
+            if mode not in MODES or (mode != "live" and not path):
+                mode = "live"
+            _state["mode"] = mode
+            _state["archive"] = HttpArchive(path) if mode != "live" else None
+            _state["latency"] = os.getenv("HTTP_REPLAY_LATENCY_MS")
+        return _state["mode"], _state["archive"], _state["latency"]
+
+def transport_info() -> dict:
+    mode, archive, latency = _current()
+    return {"mode": mode, "archive": archive.path if archive else None,
+            "replay_latency_ms": latency, "stats": dict(archive.stats) if archive else {}}
+
+@contextmanager
+def use_transport(mode: str, archive_path: str | None = None, replay_latency_ms=None):
+    with _state_lock:
+        saved = dict(_state)
+    set_transport(mode, archive_path, replay_latency_ms)
+    try:
+        yield _state["archive"]
+    finally:
+        with _state_lock:
+            _state.update(saved)
+
+def http_get(url: str, params: dict | None = None, headers: dict | None = None, timeout=None,
+             allow_redirects: bool = True) -> requests.Response:
+    """
+    Drop-in for requests.get honoring the current transport mode.
+    """
+    mode, archive, latency = _current()
+    if mode == "live":
+        return requests.get(url, params=params, headers=headers, timeout=timeout, allow_redirects=allow_redirects)
+
+    key = HttpArchive.request_key("GET", url, params)
+    if mode == "replay":
+        r, elapsed = archive.replay(key)
+        if latency == "recorded":
+            time.sleep(elapsed)
+        elif latency:
+            time.sleep(float(latency) / 1000.0)
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+    t0 = time.perf_counter()
+    try:
+        r = requests.get(url, params=params, headers=headers, timeout=timeout, allow_redirects=allow_redirects)
+    except requests.exceptions.RequestException as e:
+        archive.record_error(key, url, e, time.perf_counter() - t0)
+        raise
+    archive.record(key, url, r, time.perf_counter() - t0)
+    return r
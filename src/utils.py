@@ -1,5 +1,6 @@
 import math
 import re
+import unicodedata
 from datetime import date
 from urllib.parse import urlparse, urlunparse
 
@@ -8,6 +9,13 @@ def normalize_text(s: str) -> str:
     s = re.sub(r"\s+", " ", s)
     return s
 
+def fold_accents(s: str) -> str:
+    """
+    normalize_text plus accent removal ("Chamberí" -> "chamberi").
+    """
+    s = unicodedata.normalize("NFKD", normalize_text(s))
+    return "".join(c for c in s if not unicodedata.combining(c))
+
 def canonical_url(url: str) -> str:
     try:
         p = urlparse(url)
@@ -47,6 +55,17 @@ def format_currency(x):
     except Exception:
         return "N/D"
 
+def dedup_key(it: dict) -> tuple:
+    """
+    Same office across portals: normalized building/location + area + rent.
+    """
+    return (
+        normalize_text(it.get("building_name","")),
+        normalize_text(it.get("location","")),
+        round(to_float(it.get("area_m2")) or 0, 1),
+        round(to_float(it.get("rent_eur_m2_month")) or 0, 2),
+    )
+
 def deduplicate_listings(listings: list[dict]) -> list[dict]:
     """
     Deduplicate by canonical URL first, then by (normalized building/location + area + rent).
@@ -65,37 +84,68 @@ def deduplicate_listings(listings: list[dict]) -> list[dict]:
     seen_key = set()
     final = []
     for it in out:
-        key = (
-            normalize_text(it.get("building_name","")),
-            normalize_text(it.get("location","")),
-            round(to_float(it.get("area_m2")) or 0, 1),
-            round(to_float(it.get("rent_eur_m2_month")) or 0, 2),
-        )
+        key = dedup_key(it)
         if key in seen_key:
             continue
         seen_key.add(key)
         final.append(it)
     return final
 
-def apply_filters(listings, min_area=0, district_contains="", rent_min=0.0, rent_max=200.0, availability_now=False):
-    dc = normalize_text(district_contains)
-    out = []
-    for it in listings:
-        area = to_float(it.get("area_m2"))
+def zone_text(it: dict) -> str:
+    """
+    Text the district/zone filter matches against: the geometric `district`/`barrio` columns
+    (see districts.assign_districts). The free-text location is used only when both are missing
+    (no coordinates, or outside every polygon), so zones that are not districts or barrios
+    ("AZCA") still match but a location never overrides the polygon.
+    """
+    if it.get("district") or it.get("barrio"):
+        return f"{it.get('district') or ''} | {it.get('barrio') or ''}"
+    return it.get("location") or ""
+
+def listing_filter(min_area=0, district_contains="", rent_min=0.0, rent_max=200.0, availability_now=False,
+                   zone_exact=False):
+    """
+    The apply_filters conditions as a predicate over one listing, built once per query
+    (the query planner pushes it down into the index walk).
+    District/zone: a substring of zone_text(it). With zone_exact (a name from the zone selector,
+    see districts.canonical_zone) the folded name must equal the district or the barrio; a
+    listing with neither matches when its location contains the name as whole words.
+    """
+    dc = fold_accents(district_contains)
+    in_location = re.compile(rf"\b{re.escape(dc)}\b").search if dc else None
+    min_area = float(min_area or 0)
+    rent_min, rent_max = float(rent_min), float(rent_max)
+
+    def in_zone(it: dict) -> bool:
+        if not zone_exact:
+            return dc in fold_accents(zone_text(it))
+        if it.get("district") or it.get("barrio"):
+            return dc in (fold_accents(it.get("district") or ""), fold_accents(it.get("barrio") or ""))
+        return bool(in_location(fold_accents(it.get("location") or "")))
+
+    def match(it: dict) -> bool:
+        if min_area:
+            area = to_float(it.get("area_m2"))
+            if area is not None and area < min_area:
+                return False
+        if dc and not in_zone(it):
+            return False
         rent = to_float(it.get("rent_eur_m2_month"))
-        loc = normalize_text(it.get("location",""))
-        avail = normalize_text(it.get("available_from",""))
-        if min_area and area is not None and area < float(min_area):
-            continue
-        if dc and dc not in loc:
-            continue
         if rent is not None:
-            if rent < float(rent_min) or rent > float(rent_max):
-                continue
-        if availability_now and not ("inmedi" in avail or "immediate" in avail):
-            continue
-        out.append(it)
-    return out
+            if rent < rent_min or rent > rent_max:
+                return False
+        if availability_now:
+            avail = normalize_text(it.get("available_from",""))
+            if not ("inmedi" in avail or "immediate" in avail):
+                return False
+        return True
+
+    return match
+
+def apply_filters(listings, min_area=0, district_contains="", rent_min=0.0, rent_max=200.0, availability_now=False,
+                  zone_exact=False):
+    match = listing_filter(min_area, district_contains, rent_min, rent_max, availability_now, zone_exact)
+    return [it for it in listings if match(it)]
 
 def compute_cost_fields(it: dict, treat_nd_as_zero: bool, enable_estimations: bool, community_rate: float, ibi_rate_annual: float):
     """
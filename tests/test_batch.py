@@ -0,0 +1,18 @@
+import pytest
+
+from src.batch import read_addresses
+
+@pytest.mark.parametrize("text, kw, expected", [
+    ("address\nCalle de Serrano 21\nCalle Mayor 1\n", {}, ["Calle de Serrano 21", "Calle Mayor 1"]),
+    ("Dirección,ref\nCalle de Serrano 21,A\n", {}, ["Calle de Serrano 21"]),
+    ("ref,ADDRESS\nA,Calle de Serrano 21\n", {}, ["Calle de Serrano 21"]),
+    ("ref,Oficina\nA,Calle de Serrano 21\n", {"column": "oficina"}, ["Calle de Serrano 21"]),
+    ("Calle de Serrano 21\nCalle Mayor 1\n", {}, ["Calle de Serrano 21", "Calle Mayor 1"]),
+    # an unrecognized header is kept as data unless the caller says there is one
+    ("Inmueble\nCalle de Serrano 21\n", {"header": True}, ["Calle de Serrano 21"]),
+    ("Calle\nCalle de Serrano 21\n", {"header": False}, ["Calle", "Calle de Serrano 21"]),
+])
+def test_read_addresses_header(tmp_path, text, kw, expected):
+    path = tmp_path / "direcciones.csv"
+    path.write_text(text, encoding="utf-8")
+    assert read_addresses(str(path), **kw) == expected
@@ -0,0 +1,55 @@
+import threading
+import time
+
+from src import coordinator
+from src.coordinator import CrawlCoordinator
+from src.history import RentHistory
+
+def _stub_search(monkeypatch, partial: bool = False):
+    calls = []
+    lock = threading.Lock()
+
+    def search(max_candidates, on_listing=None, deadline_s=None):
+        with lock:
+            calls.append(deadline_s)
+        time.sleep(0.2)
+        listings = [{"source_url": f"https://a/{n}", "rent_eur_m2_month": 20.0} for n in range(3)]
+        return listings, {"budget": {"partial": partial}}
+
+    monkeypatch.setattr(coordinator, "search_without_api", search)
+    monkeypatch.setattr(coordinator, "get_rent_history", lambda: RentHistory())
+    return calls
+
+def test_concurrent_callers_share_one_crawl_then_reuse_it(monkeypatch):
+    calls = _stub_search(monkeypatch)
+    coord = CrawlCoordinator(result_ttl_s=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(coord.crawl(max_candidates=50, deadline_s=90)))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert sorted(d["coordinator"]["result"] for _, d in results) == ["coalesced"] * 7 + ["ran"]
+    assert len({d["crawl_id"] for _, d in results}) == 1
+    # a complete crawl serves any later deadline within the TTL
+    listings, diag = coord.crawl(max_candidates=50, deadline_s=None)
+    assert len(calls) == 1 and diag["coordinator"]["result"] == "reused" and len(listings) == 3
+    assert coord.report()["crawl"]["crawls_reused"] == 1
+
+def test_partial_crawl_is_reused_only_up_to_its_deadline(monkeypatch):
+    calls = _stub_search(monkeypatch, partial=True)
+    coord = CrawlCoordinator(result_ttl_s=60)
+    coord.crawl(max_candidates=50, deadline_s=30)
+    assert coord.crawl(max_candidates=50, deadline_s=30)[1]["coordinator"]["result"] == "reused"
+    assert coord.crawl(max_candidates=50, deadline_s=20)[1]["coordinator"]["result"] == "reused"
+    assert coord.crawl(max_candidates=50, deadline_s=60)[1]["coordinator"]["result"] == "ran"
+    assert calls == [30, 60]
+
+def test_result_expires_after_ttl(monkeypatch):
+    calls = _stub_search(monkeypatch)
+    coord = CrawlCoordinator(result_ttl_s=0)
+    coord.crawl(max_candidates=50)
+    coord.crawl(max_candidates=50)
+    assert len(calls) == 2
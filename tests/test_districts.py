@@ -0,0 +1,76 @@
+import json
+import os
+import random
+
+import pytest
+
+from src import districts
+from src.districts import AreaIndex, assign_districts
+from src.utils import apply_filters
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+def _areas(name: str) -> AreaIndex:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return AreaIndex(json.load(f))
+
+@pytest.fixture
+def fixture_paths(monkeypatch):
+    monkeypatch.setattr(districts, "DISTRICTS_PATH", os.path.join(FIXTURES, "distritos.geojson"))
+    monkeypatch.setattr(districts, "BARRIOS_PATH", os.path.join(FIXTURES, "barrios.geojson"))
+
+def test_lookup_polygon_multipolygon_and_hole():
+    areas = _areas("distritos.geojson")
+    assert areas.lookup(40.43, -3.675) == "Salamanca"
+    assert areas.lookup(40.44, -3.70) == "Chamberí"
+    assert areas.lookup(40.402, -3.685) == "Retiro"
+    assert areas.lookup(40.405, -3.645) == "Retiro"  # second polygon of the MultiPolygon
+    assert areas.lookup(40.41, -3.675) is None  # inside the hole
+    assert areas.lookup(40.50, -3.60) is None
+
+def test_classify_matches_point_lookup():
+    areas = _areas("distritos.geojson")
+    rnd = random.Random(3)
+    lats = [40.39 + rnd.random() * 0.07 for _ in range(2000)] + [None]
+    lons = [-3.73 + rnd.random() * 0.10 for _ in range(2000)] + [-3.70]
+    expected = [areas.lookup(la, lo) if la is not None else None for la, lo in zip(lats, lons)]
+    assert areas.classify(lats, lons) == expected
+    assert {"Salamanca", "Chamberí", "Retiro", None} <= set(expected)
+
+def test_assign_districts(fixture_paths):
+    listings = [{"lat": 40.425, "lon": -3.675}, {"lat": 40.435, "lon": -3.695}, {"lat": None, "lon": None}]
+    assign_districts(listings)
+    assert [(it.get("district"), it.get("barrio")) for it in listings] == [
+        ("Salamanca", "Goya"), ("Chamberí", "Almagro"), (None, None)]
+    assert districts.zone_names() == ["Chamberí", "Retiro", "Salamanca", "Almagro", "Goya"]
+
+def test_assign_districts_without_geojson(monkeypatch):
+    monkeypatch.setattr(districts, "DISTRICTS_PATH", os.path.join(FIXTURES, "missing.geojson"))
+    monkeypatch.setattr(districts, "BARRIOS_PATH", os.path.join(FIXTURES, "missing.geojson"))
+    listings = [{"lat": 40.425, "lon": -3.675}]
+    assert assign_districts(listings) == [{"lat": 40.425, "lon": -3.675}]
+
+def test_zone_filter_keeps_location_fallback():
+    listings = [
+        {"location": "Torre Picasso, AZCA, Madrid"},
+        {"district": "Salamanca", "barrio": "Goya", "location": "Calle Goya 10, Madrid"},
+        {"location": "Calle Serrano, Salamanca"},
+    ]
+    assert apply_filters(listings, district_contains="AZCA") == listings[:1]
+    assert apply_filters(listings, district_contains="salamanca") == listings[1:]
+    assert apply_filters(listings, district_contains="Salamanca", zone_exact=True) == listings[1:]
+
+def test_polygon_wins_over_location(fixture_paths):
+    listings = [
+        {"district": "Chamberí", "barrio": "Almagro", "location": "Centro de Negocios Almagro, Madrid"},
+        {"district": "Centro", "barrio": "Sol", "location": "Puerta del Sol"},
+        {"district": "Centro", "barrio": "Soledad"},
+        {"location": "Plaza de la Soledad, Madrid"},
+        {"location": "Calle Mayor, Sol, Madrid"},
+    ]
+    assert apply_filters(listings, district_contains="Centro") == listings[1:3]
+    zone = districts.canonical_zone("chamberi")
+    assert zone == "Chamberí"
+    assert apply_filters(listings, district_contains=zone, zone_exact=True) == listings[:1]
+    assert apply_filters(listings, district_contains="Sol", zone_exact=True) == [listings[1], listings[4]]
+    assert districts.canonical_zone("Centro de Negocios") is None
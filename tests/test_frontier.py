@@ -0,0 +1,58 @@
+from bench.standin_server import standin_sources
+from src.frontier import Frontier
+from src.parse_cache import ParseCache
+from src.search import search_without_api
+
+def _urls(n: int, start: int = 0) -> list[str]:
+    return [f"https://portal.example/oficina/{i}" for i in range(start, start + n)]
+
+def test_crash_after_checkpoint_resumes_pending_and_skips_done(tmp_path):
+    path = str(tmp_path / "frontier.sqlite")
+    f = Frontier(path, checkpoint_every=10_000, checkpoint_seconds=3600)
+    f.add_many(_urls(10))
+    popped = [f.pop() for _ in range(4)]
+    for u in popped[:3]:
+        f.done(u, result={"source_url": u})
+    f.checkpoint()
+    # after the checkpoint: lost with the crash
+    f.done(popped[3], result={"source_url": popped[3]})
+    f.add_many(_urls(2, start=100))
+
+    # the process dies: its open transaction is never committed
+    f.db.rollback()
+    f.db.close()
+
+    resumed = Frontier(path)
+    assert resumed.stats["resumed"] == 1
+    assert [r["source_url"] for r in resumed.results()] == popped[:3]
+    # the popped-but-unfinished URL comes back first, then the never-popped ones, in queue order
+    rest = []
+    while (u := resumed.pop()) is not None:
+        rest.append(u)
+    assert rest == _urls(10)[3:]
+    assert not resumed.add(popped[0])  # done URLs are not queued again
+    assert resumed.add(_urls(1, start=100)[0])  # the uncommitted add is not remembered as seen
+
+def test_bloom_false_positives_never_drop_new_urls(tmp_path):
+    path = str(tmp_path / "frontier.sqlite")
+    f = Frontier(path, expected_urls=16, error_rate=0.5)
+    assert f.add_many(_urls(500)) == 500
+    assert f.stats["bloom_false_positives"] > 0 and f.stats["duplicates"] == 0
+    assert f.add_many(_urls(500)) == 0
+    f.close()
+    reopened = Frontier(path, expected_urls=16, error_rate=0.5)
+    assert reopened.add_many(_urls(50, start=500)) == 50
+    assert reopened.count("listing") == 550
+
+def test_search_resumes_from_the_frontier(tmp_path):
+    path = str(tmp_path / "frontier.sqlite")
+    with standin_sources(listings=10, latency_ms=0) as counters:
+        first, _ = search_without_api(max_candidates=12, frontier_path=path, parse_cache=ParseCache())
+        requests_before = sum(counters.values())
+        listings, diag = search_without_api(max_candidates=30, frontier_path=path, parse_cache=ParseCache())
+        requests_after = sum(counters.values())
+    assert diag["resumed_listings"] == len(first) == 12
+    assert [it["source_url"] for it in listings[:12]] == [it["source_url"] for it in first]
+    assert len({it["source_url"] for it in listings}) == len(listings) == 30
+    # the 12 listings of the first run are not downloaded again
+    assert diag["urls_attempted"] == 30 and requests_after - requests_before <= 18 + 10
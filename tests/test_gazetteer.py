@@ -0,0 +1,56 @@
+import pytest
+
+from src import gazetteer, geocode
+from src.gazetteer import Gazetteer, names_other_place, split_address
+
+def _rows():
+    for name, lat0 in (("Calle Mayor", 40.4155), ("Calle de Serrano", 40.4250), ("Calle de Serranos", 40.4300)):
+        for n in range(1, 41):
+            yield {"name": name, "number": n, "lat": lat0 + n * 1e-5, "lon": -3.70 - n * 1e-5}
+
+@pytest.fixture
+def gaz(monkeypatch):
+    g = Gazetteer.from_rows(_rows())
+    monkeypatch.setattr(gazetteer, "get_gazetteer", lambda: g)
+    return g
+
+def test_split_address():
+    assert split_address("Calle de Serrano 21, 28001 Madrid") == ("Calle de Serrano", 21)
+    assert split_address("Calle Mayor, 1, Alcalá de Henares") == ("Calle Mayor", 1)
+
+@pytest.mark.parametrize("address, other", [
+    ("Calle Mayor 1, Alcalá de Henares", True),
+    ("Calle Mayor, 1, Alcalá de Henares", True),
+    ("Calle Mayor 1, 28801", True),
+    ("Calle Mayor, Getafe", True),
+    ("Calle de Serrano 21, 28001 Madrid", False),
+    ("Calle Serrano 21, 3º izda, Salamanca, Madrid", False),
+    ("Paseo de la Castellana 200, Chamartín, Madrid, España", False),
+])
+def test_names_other_place(address, other):
+    assert names_other_place(address) is other
+
+def test_local_geocode_only_answers_exact_madrid_streets(gaz):
+    res = gazetteer.local_geocode("Calle de Serrano 21, Madrid")
+    assert res["provider"] == "callejero" and res["match"] == "exact/exact"
+    assert gazetteer.local_geocode("Calle Mayor 1, Alcalá de Henares") is None
+    # prefix ("Serr" -> serrano) and fuzzy ("Seranno") matches go to the network providers
+    assert gaz.geocode("Calle Serr 3")["match"].startswith("prefix")
+    assert gazetteer.local_geocode("Calle Serr 3") is None
+    assert gazetteer.local_geocode("Calle Seranno 3") is None
+
+def test_geocode_listings_skips_other_municipalities(gaz):
+    listings = [{"location": "Calle Mayor 10, Madrid"}, {"location": "Calle Mayor 10, Alcalá de Henares"}]
+    assert gazetteer.geocode_listings(listings) == 1
+    assert listings[0]["lat"] is not None and "lat" not in listings[1]
+
+def test_approximate_match_is_the_fallback_when_providers_fail(gaz, monkeypatch):
+    failed = {"ok": False, "error": "sin red"}
+    monkeypatch.setattr(geocode, "_geocode_hedged", lambda addr, deadline_s: failed)
+    res = geocode.geocode_address("Calle Seranno 3")
+    assert (res["provider"], res["match"]) == ("callejero", "fuzzy/exact")
+    assert geocode.geocode_address("Calle Mayor 1, Alcalá de Henares") == failed
+    # a network answer still wins over an approximate street match
+    found = {"ok": True, "lat": 40.43, "lon": -3.68, "display_name": "Calle de Serrano, Madrid", "provider": "photon"}
+    monkeypatch.setattr(geocode, "_geocode_hedged", lambda addr, deadline_s: found)
+    assert geocode.geocode_address("Calle Seranno 3") == found
@@ -0,0 +1,100 @@
+import json
+import threading
+import time
+
+import pytest
+
+from src import geocode
+
+class _Response:
+    def __init__(self, data, status_code: int = 200):
+        self.status_code = status_code
+        self._data = data
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+def _photon(lat: float, city: str) -> dict:
+    return {"features": [{"geometry": {"coordinates": [-3.70, lat]},
+                          "properties": {"name": "Calle Falsa", "city": city, "country": "España"}}]}
+
+def _nominatim(lat: float, place: str) -> list[dict]:
+    return [{"lat": str(lat), "lon": "-3.70", "display_name": f"Calle Falsa, {place}, España"}]
+
+@pytest.fixture
+def providers(monkeypatch):
+    """
+    Stub http_get: answers[provider] is (delay_s, data) or a callable(params) -> (delay_s, data).
+    Returns the list of (provider, query, start time) actually sent.
+    """
+    answers = {}
+    sent = []
+    lock = threading.Lock()
+
+    def http_get(url, params=None, headers=None, timeout=None, **kw):
+        provider = "photon" if url == geocode.PHOTON_URL else "nominatim"
+        with lock:
+            sent.append((provider, params["q"], time.monotonic()))
+        answer = answers[provider]
+        delay, data = answer(params) if callable(answer) else answer
+        time.sleep(delay)
+        return _Response(data)
+
+    monkeypatch.setattr(geocode, "http_get", http_get)
+    monkeypatch.setattr(geocode, "NOMINATIM_LIMITER", geocode._RateLimiter(10.0))  # 100 ms slots
+    return answers, sent
+
+def test_fast_photon_wins_and_nominatim_keeps_its_rate(providers):
+    answers, sent = providers
+    answers["photon"] = lambda params: (0.2 if "España" in params["q"] else 0.05, _photon(40.42, "Madrid"))
+    answers["nominatim"] = (0.3, _nominatim(40.41, "Madrid"))
+    res = geocode._geocode_hedged("Calle Falsa 1", deadline_s=2.0)
+    assert (res["provider"], res["variant"], res["lat"]) == ("photon", "photon", 40.42)
+    time.sleep(0.4)  # let the losing attempts finish
+    counts = {p: sum(1 for s in sent if s[0] == p) for p in ("photon", "nominatim")}
+    # both Photon variants went out at once; the second Nominatim slot came after Photon won
+    assert counts == {"photon": 2, "nominatim": 1}
+
+def test_forced_nominatim_wins_when_plain_answers_are_not_madrid(providers):
+    answers, sent = providers
+    answers["photon"] = (0.0, {"features": []})
+    answers["nominatim"] = lambda params: ((0.0, _nominatim(40.41, "Madrid")) if "Madrid" in params["q"]
+                                           else (0.0, _nominatim(41.65, "Zaragoza")))
+    res = geocode._geocode_hedged("Calle Falsa 1", deadline_s=2.0)
+    assert (res["variant"], res["lat"]) == ("nominatim+madrid", 40.41)
+    starts = sorted(t for p, _, t in sent if p == "nominatim")
+    assert len(starts) == 2 and starts[1] - starts[0] >= 0.09
+
+def test_nominatim_rate_is_process_wide(providers):
+    answers, sent = providers
+    answers["photon"] = (0.0, {"features": []})
+    answers["nominatim"] = (0.0, [])
+    threads = [threading.Thread(target=geocode._geocode_hedged, args=(f"Calle Falsa {n}", 3.0)) for n in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    starts = sorted(t for p, _, t in sent if p == "nominatim")
+    assert len(starts) == 6
+    assert min(b - a for a, b in zip(starts, starts[1:])) >= 0.09
+
+def test_each_cache_file_holds_only_its_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(geocode, "geocode_address", lambda a: {"ok": True, "lat": 40.4, "lon": -3.7,
+                                                               "display_name": f"{a}, Madrid"})
+    for name in ("_CACHE", "_CACHE_FILE_KEYS", "_CACHE_DIRTY", "_CACHE_SAVED_AT"):
+        monkeypatch.setattr(geocode, name, {})
+    monkeypatch.setattr(geocode, "_CACHE_FILES_LOADED", set())
+    a, b = str(tmp_path / "a.json"), str(tmp_path / "b.json")
+    geocode.geocode_address_cached("Calle Mayor 1", cache_path=a)
+    geocode.geocode_address_cached("Calle Mayor 2", cache_path=b)
+    # a hit on an entry of another file is added to this file
+    assert geocode.geocode_address_cached("Calle Mayor 1", cache_path=b)["cached"]
+    geocode.flush_geocode_cache()
+    with open(a, encoding="utf-8") as f:
+        assert list(json.load(f)) == ["calle mayor 1"]
+    with open(b, encoding="utf-8") as f:
+        assert list(json.load(f)) == ["calle mayor 1", "calle mayor 2"]
@@ -0,0 +1,97 @@
+from datetime import datetime, timezone
+
+from bench.standin_server import standin_sources
+from src.history import RentHistory
+from src.parse_cache import ParseCache
+from src.search import search_without_api
+
+def _ts(month: str, day: int = 1) -> int:
+    y, m = map(int, month.split("-"))
+    return int(datetime(y, m, day, tzinfo=timezone.utc).timestamp())
+
+def _listing(n: int, rent: float, district: str, lat: float = 40.41, lon: float = -3.70) -> dict:
+    return {"source_url": f"https://portal.example/oficina/{n}", "rent_eur_m2_month": rent,
+            "district": district, "lat": lat, "lon": lon}
+
+def _month(rows: list[dict], month: str) -> dict:
+    return next(r for r in rows if r["month"] == month)
+
+def test_unchanged_crawls_store_nothing():
+    h = RentHistory()
+    a = _listing(1, 20, "Centro")
+    for day in (1, 8, 15):
+        h.record([a], ts=_ts("2024-01", day))
+    assert h.stats()["changes"] == 1
+    h.record([dict(a, rent_eur_m2_month=22)], ts=_ts("2024-02"))
+    assert h.rent_trend(a["source_url"]) == [("2024-01-01", 20.0), ("2024-02-01", 22.0)]
+
+def test_delist_removes_rent_from_district_median():
+    h = RentHistory()
+    a, b = _listing(1, 20, "Retiro"), _listing(2, 30, "Retiro", lat=40.42)
+    h.record([a, b], ts=_ts("2024-01"))
+    counts = h.record([a], ts=_ts("2024-02"), gone=[b["source_url"]])
+    assert counts["delisted"] == 1
+    feb = _month(h.district_rent_by_month("Retiro"), "2024-02")
+    assert (feb["listings"], feb["median_rent_eur_m2_month"]) == (1, 20.0)
+    assert h.listing_history(b["source_url"])[-1]["delisted"] is True
+
+def test_relist_at_same_rent_counts_again():
+    h = RentHistory()
+    a, b = _listing(1, 20, "Retiro"), _listing(2, 30, "Retiro", lat=40.42)
+    h.record([a, b], ts=_ts("2024-01"))
+    h.record([a], ts=_ts("2024-01", 15), gone=[b["source_url"]])
+    h.record([a, b], ts=_ts("2024-02"))
+    feb = _month(h.district_rent_by_month("Retiro"), "2024-02")
+    assert (feb["listings"], feb["median_rent_eur_m2_month"]) == (2, 25.0)
+    assert h.listing_history(b["source_url"])[-1]["delisted"] is False
+
+def test_move_leaves_old_district_and_cell():
+    h = RentHistory()
+    a, b = _listing(1, 20, "Centro"), _listing(2, 30, "Centro")
+    h.record([a, b], ts=_ts("2024-01"))
+    h.record([a, dict(b, district="Salamanca", lat=40.43, lon=-3.68)], ts=_ts("2024-02"))
+    centro = _month(h.district_rent_by_month("Centro"), "2024-02")
+    assert (centro["listings"], centro["median_rent_eur_m2_month"]) == (1, 20.0)
+    assert h.district_rent_by_month("Salamanca") == [
+        {"month": "2024-02", "listings": 1, "median_rent_eur_m2_month": 30.0}]
+    assert _month(h.cell_rent_by_month(40.41, -3.70), "2024-02")["listings"] == 1
+    assert h.cell_rent_by_month(40.43, -3.68)[-1]["listings"] == 1
+    # the exit row is bookkeeping for the scans, not a state of the listing
+    assert [s["district"] for s in h.listing_history(b["source_url"])] == ["Centro", "Salamanca"]
+
+def test_missing_listing_is_not_delisted():
+    h = RentHistory()
+    a, b = _listing(1, 20, "Retiro"), _listing(2, 30, "Retiro", lat=40.42)
+    h.record([a, b], ts=_ts("2024-01"))
+    assert h.record([a], ts=_ts("2024-02"))["delisted"] == 0
+    assert h.district_rent_by_month("Retiro")[-1]["listings"] == 2
+    assert h.listing_history(b["source_url"])[-1]["delisted"] is False
+
+def _crawl(max_candidates: int = 400):
+    listings, diag = search_without_api(max_candidates=max_candidates, parse_cache=ParseCache())
+    return listings, diag.get("gone_urls", ())
+
+def test_crawl_delists_only_removed_pages():
+    statuses = {}
+    h = RentHistory()
+    with standin_sources(listings=6, latency_ms=0, statuses=statuses):
+        listings, gone = _crawl()
+        assert len(listings) == 24 and not gone
+        blocked = next(it["source_url"] for it in listings if it["source_url"].endswith("/3"))
+        h.record(listings, ts=_ts("2024-01"), gone=gone)
+        statuses.update({1: 404, 2: 410, 3: 403})
+        listings, gone = _crawl()
+    counts = h.record(listings, ts=_ts("2024-02"), gone=gone)
+    delisted = {u.rsplit("/", 1)[1] for u in gone}
+    assert counts["delisted"] == 8 and delisted == {"1", "2"}
+    # a blocked page keeps its listing active
+    assert h.listing_history(blocked)[-1]["delisted"] is False
+
+def test_capped_crawl_delists_nothing():
+    h = RentHistory()
+    with standin_sources(listings=6, latency_ms=0):
+        listings, gone = _crawl()
+        h.record(listings, ts=_ts("2024-01"), gone=gone)
+        listings, gone = _crawl(max_candidates=5)
+    assert len(listings) < 24
+    assert h.record(listings, ts=_ts("2024-02"), gone=gone)["delisted"] == 0
@@ -0,0 +1,53 @@
+import threading
+
+from src.market_stats import MarketStats
+
+def _listing(url: str, rent: float, **kw) -> dict:
+    return dict({"source_url": url, "building_name": "Torre Europa", "location": "Paseo de la Castellana 95, Madrid",
+                 "area_m2": 500, "rent_eur_m2_month": rent, "lat": 40.4503, "lon": -3.6920,
+                 "available_from": "Inmediato"}, **kw)
+
+def test_same_office_on_two_portals_counts_once():
+    stats = MarketStats()
+    stats.upsert(_listing("https://portal-a.example/1", 30))
+    stats.upsert(_listing("https://portal-b.example/xyz", 30))
+    assert len(stats) == 1
+    assert stats.at(40.4503, -3.6920)["count"] == 1
+
+def test_recrawl_with_new_rent_replaces_the_row():
+    stats = MarketStats()
+    stats.upsert(_listing("https://portal-a.example/1", 30))
+    stats.upsert(_listing("https://portal-b.example/xyz", 30))
+    # one portal updates the rent: two offers now, the other portal still lists 30
+    stats.upsert(_listing("https://portal-a.example/1", 32))
+    assert stats.at(40.4503, -3.6920)["count"] == 2
+    stats.upsert(_listing("https://portal-b.example/xyz", 32))
+    cell = stats.at(40.4503, -3.6920)
+    assert cell["count"] == 1 and abs(cell["rent_eur_m2_month_median"] - 32) < 0.5
+    # district assigned later (app/coordinator) updates the row in place
+    stats.upsert(_listing("https://portal-a.example/1", 32, district="Tetuán"))
+    assert stats.district("Tetuán")["count"] == 1 and stats.total.count == 1
+
+def test_reads_during_concurrent_upserts():
+    stats = MarketStats()
+    errors = []
+
+    def writer(n: int):
+        for i in range(2000):
+            stats.upsert(_listing(f"https://p{n}.example/{i}", 10 + i % 40, lat=40.40 + (i % 50) * 0.001))
+
+    def reader():
+        try:
+            for _ in range(500):
+                stats.around(40.42, -3.69, rings=2)
+                stats.at(40.42, -3.69)
+        except Exception as e:  # "dictionary changed size during iteration" without the lock
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(3)] + [threading.Thread(target=reader)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert stats.total.count == len(stats)
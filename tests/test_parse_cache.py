@@ -0,0 +1,23 @@
+from src.parse_cache import ParseCache, body_hash
+from src.parsers import extract_listing_from_html
+
+PAGE = ("<html><body><h1>Edificio Castellana</h1><p>Oficina en alquiler en Madrid, 300 m2, 20 €/m2/mes."
+        " Disponibilidad: marzo 2027{sep}planta 3 exterior</p></body></html>")
+
+def test_whitespace_that_changes_extraction_gets_its_own_entry():
+    one_line, two_lines = PAGE.format(sep=" "), PAGE.format(sep="\n")
+    assert body_hash(one_line) != body_hash(two_lines)
+    # RE_AVAIL stops at the newline: same text up to whitespace, different extraction
+    assert (extract_listing_from_html("u", one_line)["available_from"]
+            != extract_listing_from_html("u", two_lines)["available_from"])
+    cache = ParseCache()
+    for html in (one_line, two_lines):
+        assert cache.extract("https://a/1", html) == extract_listing_from_html("https://a/1", html)
+    assert cache.stats["hits"] == 0
+
+def test_unchanged_body_hits():
+    cache = ParseCache()
+    first = cache.extract("https://a/1", PAGE.format(sep=" "))
+    again = cache.extract("https://b/2", PAGE.format(sep=" "))
+    assert cache.stats["hits"] == 1
+    assert again == dict(first, source_url="https://b/2")
@@ -0,0 +1,66 @@
+import random
+
+from src.index import ListingIndex
+from src.query import DEFAULT_FILTERS, plan_query
+from src.utils import apply_filters, listing_filter
+
+def _listing(n: int, **kw) -> dict:
+    return dict({"source_url": f"https://a/{n}", "building_name": f"Edificio {n}", "rent_eur_m2_month": 20.0,
+                 "area_m2": 300.0, "location": ""}, **kw)
+
+def test_zone_plan_keeps_listings_without_coordinates():
+    listings = [
+        _listing(1, lat=40.43, lon=-3.68, district="Salamanca", barrio="Goya"),
+        _listing(2, lat=None, lon=None, location="Calle Serrano, Salamanca, Madrid"),
+    ]
+    index = ListingIndex(listings)
+    rows, plan = plan_query(index, 40.42, -3.70, top_n=5, filters={"district_contains": "Salamanca"})
+    assert plan["access"] == "zone_knn"
+    expected = apply_filters(listings, district_contains="Salamanca")
+    assert [r["source_url"] for r in rows] == [it["source_url"] for it in expected] == ["https://a/1", "https://a/2"]
+    assert [r["source_url"] for r in plan_query(index, 40.42, -3.70, top_n=5,
+                                                filters={"district_contains": "Salaman"})[0]] == ["https://a/1", "https://a/2"]
+
+def test_zone_plan_matches_grid_plan():
+    rnd = random.Random(7)
+    zones = [("Salamanca", "Goya"), ("Centro", "Sol"), ("Centro", "Soledad"), ("Chamberí", "Almagro"), (None, None)]
+    listings = []
+    for n in range(600):
+        district, barrio = rnd.choice(zones)
+        located = rnd.random() > 0.1
+        listings.append(_listing(
+            n, lat=40.40 + rnd.random() * 0.06 if located else None, lon=-3.72 + rnd.random() * 0.06 if located else None,
+            district=district, barrio=barrio,
+            location=rnd.choice(["Salamanca, Madrid", "Centro de Negocios", "Plaza de la Soledad", "Sol", ""]),
+            rent_eur_m2_month=round(rnd.uniform(10, 40), 1), score=rnd.randint(0, 5)))
+    index = ListingIndex(listings)
+    for _ in range(50):
+        lat, lon = 40.40 + rnd.random() * 0.06, -3.72 + rnd.random() * 0.06
+        filters = {"district_contains": rnd.choice(["Salamanca", "Goya", "centro", "Chamberi", "Sol"]), "rent_max": 30.0,
+                   "zone_exact": rnd.random() < 0.5}
+        radius = rnd.choice([None, 2.0])
+        zone_rows, plan = plan_query(index, lat, lon, top_n=15, radius_km=radius, filters=filters, radius_limit=15)
+        assert plan["zone"] and plan["zone_exact"] == filters["zone_exact"]
+        match = listing_filter(**dict(DEFAULT_FILTERS, **filters))
+        if radius is None:
+            grid_rows = index.nearest(lat, lon, k=15, where=match)
+        else:
+            grid_rows = index.within(lat, lon, radius, limit=15, where=match)
+        assert [r["source_url"] for r in zone_rows] == [r["source_url"] for r in grid_rows]
+
+def test_exact_zone_uses_by_zone_not_substrings():
+    listings = [
+        _listing(1, lat=40.417, lon=-3.703, district="Centro", barrio="Sol"),
+        _listing(2, lat=40.418, lon=-3.704, district="Centro", barrio="Soledad"),
+        _listing(3, lat=40.43, lon=-3.70, district="Chamberí", barrio="Almagro", location="Centro de Negocios, Sol"),
+        _listing(4, lat=None, lon=None, location="Calle Mayor, Sol"),
+        _listing(5, lat=None, lon=None, location="Plaza de la Soledad"),
+    ]
+    index = ListingIndex(listings)
+    assert index.zone_members("Sol", exact=True) == ([0], [3])
+    assert index.zone_members("Sol") == ([0, 1], [3, 4])
+    rows, plan = plan_query(index, 40.42, -3.70, top_n=5, filters={"district_contains": "Sol", "zone_exact": True})
+    assert (plan["access"], plan["zone_exact"]) == ("zone_knn", True)
+    assert [r["source_url"] for r in rows] == [it["source_url"] for it in
+                                               apply_filters(listings, district_contains="Sol", zone_exact=True)]
+    assert [r["source_url"] for r in rows] == ["https://a/1", "https://a/4"]
@@ -0,0 +1,50 @@
+import time
+
+from bench.standin_server import standin_sources
+from src import direct_sources
+from src.parse_cache import ParseCache
+from src.search import search_without_api
+from src.transport import use_transport
+
+def _crawl(**kw):
+    listings, diag = search_without_api(parse_cache=ParseCache(), **kw)
+    return [(it["source_url"], it.get("rent_eur_m2_month")) for it in listings], diag
+
+def test_replay_attempts_the_recorded_urls(tmp_path, monkeypatch):
+    archive = str(tmp_path / "archive")
+    with standin_sources(listings=30, latency_ms=5):
+        sources = dict(direct_sources.DEFAULT_SOURCES)
+        with use_transport("record", archive):
+            recorded, _ = _crawl(max_candidates=70)
+    monkeypatch.setattr(direct_sources, "DEFAULT_SOURCES", sources)
+    # the servers are gone: every response comes from the archive, with different timings
+    for latency in (None, "recorded"):
+        with use_transport("replay", archive, replay_latency_ms=latency) as replay:
+            replayed, diag = _crawl(max_candidates=70)
+            assert replay.stats["misses"] == 0
+        assert replayed == recorded
+        assert diag["blocked"] == {}
+    # 30 per source in source order: LoopNet, JLL, then 10 of CBRE
+    assert len(recorded) == 70
+    assert [u.split("/")[3] for u, _ in recorded[60:]] == ["cbre.es"] * 10
+
+def test_discovery_budget_cuts_a_slow_source():
+    with standin_sources(listings=6, latency_ms=0, source_latency_ms={"Savills": 3000}):
+        t0 = time.monotonic()
+        listings, diag = _crawl(max_candidates=100, budgets={"discovery": 0.5})
+        elapsed = time.monotonic() - t0
+    budget = diag["budget"]
+    assert budget["partial"] and budget["skipped"]["discovery_cut_by_budget"]
+    assert budget["skipped"]["sources_not_discovered"] == ["Savills"]
+    # the sources discovered in time are still crawled
+    assert len(listings) == 18 and elapsed < 3
+
+def test_deadline_marks_partial_and_lists_undiscovered_sources():
+    with standin_sources(listings=6, latency_ms=0, source_latency_ms={"CBRE": 3000, "Savills": 3000}):
+        t0 = time.monotonic()
+        listings, diag = _crawl(max_candidates=100, deadline_s=1.0)
+        elapsed = time.monotonic() - t0
+    budget = diag["budget"]
+    assert budget["partial"] and budget["deadline_s"] == 1.0
+    assert budget["skipped"]["sources_not_discovered"] == ["CBRE", "Savills"]
+    assert len(listings) == 12 and elapsed < 2.5
@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+from src import service
+from src.index import ListingIndex
+from src.service import ServiceState
+
+def _state() -> ServiceState:
+    state = ServiceState()
+    state.index = ListingIndex([
+        {"source_url": "https://a/1", "building_name": "Edificio 1", "lat": 40.42, "lon": -3.70, "rent_eur_m2_month": 20.0},
+        {"source_url": "https://a/2", "building_name": "Edificio 2", "lat": 40.45, "lon": -3.69, "rent_eur_m2_month": 25.0},
+    ])
+    return state
+
+async def _exchange(state: ServiceState, *requests: bytes) -> list[tuple[int, dict]]:
+    server = await asyncio.start_server(lambda r, w: service._serve_client(state, r, w), "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        out = []
+        for raw in requests:
+            writer.write(raw)
+            await writer.drain()
+            head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+            length = int(next(l for l in head.split("\r\n") if l.lower().startswith("content-length")).split(":")[1])
+            out.append((int(head.split(" ")[1]), json.loads(await reader.readexactly(length))))
+        # the server closes the connection after an undelimitable body
+        out.append((0, {"eof": await reader.read() == b""}))
+        writer.close()
+        return out
+    finally:
+        server.close()
+        await server.wait_closed()
+
+def _get(path: str, close: bool = False) -> bytes:
+    headers = "Host: x\r\n" + ("Connection: close\r\n" if close else "")
+    return f"GET {path} HTTP/1.1\r\n{headers}\r\n".encode()
+
+def test_bad_content_length_gets_400_and_closes():
+    raw = b"POST /refresh HTTP/1.1\r\nHost: x\r\nContent-Length: abc\r\n\r\n"
+    (status, body), (_, end) = asyncio.run(_exchange(_state(), raw))
+    assert status == 400 and body["ok"] is False and end["eof"]
+
+def test_routes_on_one_keep_alive_connection():
+    state = _state()
+    replies = asyncio.run(_exchange(
+        state, _get("/health"), _get("/nearest?lat=40.42&lon=-3.70&top_n=1"), _get("/refresh"),
+        _get("/nope"), _get("/stats", close=True)))
+    (health, h), (nearest, n), (refresh, _), (missing, _), (stats, s), _ = replies
+    assert (health, h["listings"]) == (200, 2)
+    assert nearest == 200 and [r["source_url"] for r in n["results"]] == ["https://a/1"]
+    assert (refresh, missing, stats) == (405, 404, 200)
+    # /stats sees every earlier request of the connection
+    assert s["stats"]["requests"] == 4 and s["stats"]["errors"] == 2
+
+def test_refresh_never_overwrites_the_input_snapshot(monkeypatch):
+    calls = []
+    monkeypatch.setattr(service, "load_or_crawl", lambda snapshot, save_to, max_candidates: calls.append(
+        (snapshot, save_to)) or ([], {}))
+    ServiceState(snapshot="in.json.gz").refresh(crawl=True)
+    ServiceState(snapshot="in.json.gz", save_snapshot="out.json.gz").refresh(crawl=True)
+    assert calls == [(None, None), (None, "out.json.gz")]
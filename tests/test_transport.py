@@ -0,0 +1,81 @@
+import gzip
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.transport import ReplayMiss, http_get, use_transport
+
+PAGES = {"/a": "<html>misma página</html>", "/b": "<html>misma página</html>", "/c": "<html>otra</html>"}
+
+@pytest.fixture
+def server():
+    hits = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            hits[self.path] = hits.get(self.path, 0) + 1
+            if self.path == "/flaky" and hits[self.path] == 1:
+                code, body = 429, "despacio"
+            else:
+                code, body = (200, PAGES.get(self.path, "ok")) if self.path != "/missing" else (404, "no")
+            data = body.encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}", hits
+    srv.shutdown()
+    srv.server_close()
+
+def test_record_replay_round_trip(server, tmp_path):
+    base, hits = server
+    archive = str(tmp_path / "archive")
+    paths = ["/a", "/b", "/c", "/missing", "/flaky", "/flaky"]
+    with use_transport("record", archive):
+        live = [http_get(base + p, params={"q": "x"} if p == "/c" else None, timeout=5) for p in paths]
+    served = sum(hits.values())
+    with use_transport("replay", archive) as replay:
+        replayed = [http_get(base + p, params={"q": "x"} if p == "/c" else None) for p in paths]
+        assert (replay.stats["replayed"], replay.stats["misses"]) == (len(paths), 0)
+    assert sum(hits.values()) == served  # nothing reached the server
+    for r, rr in zip(live, replayed):
+        assert (rr.status_code, rr.content, rr.text, rr.headers["Content-Type"]) == (
+            r.status_code, r.content, r.text, r.headers["Content-Type"])
+    # a request recorded twice replays in the recorded order
+    assert [r.status_code for r in replayed[-2:]] == [429, 200]
+
+def test_unknown_request_is_a_replay_miss(server, tmp_path):
+    base, _ = server
+    archive = str(tmp_path / "archive")
+    with use_transport("record", archive):
+        http_get(base + "/a", timeout=5)
+    with use_transport("replay", archive) as replay:
+        with pytest.raises(ReplayMiss):
+            http_get(base + "/a", params={"page": 2})
+        with pytest.raises(ReplayMiss):
+            http_get(base + "/nunca")
+        assert replay.stats["misses"] == 2
+
+def test_identical_bodies_are_stored_once_by_sha256(server, tmp_path):
+    base, _ = server
+    archive = str(tmp_path / "archive")
+    with use_transport("record", archive) as rec:
+        for p in ("/a", "/b", "/c", "/a"):
+            http_get(base + p, timeout=5)
+        assert rec.stats["recorded"] == 4 and rec.stats["bodies_written"] == 2
+    files = sorted(os.listdir(os.path.join(archive, "bodies")))
+    expected = sorted(hashlib.sha256(PAGES[p].encode("utf-8")).hexdigest() + ".gz" for p in ("/a", "/c"))
+    assert files == expected
+    for name in files:
+        with gzip.open(os.path.join(archive, "bodies", name), "rb") as f:
+            assert hashlib.sha256(f.read()).hexdigest() + ".gz" == name